@@ -64,7 +64,9 @@ export const loadGame = async (props: SGProps) => {
       console.debug("Game loaded successfully.");
       const data = await response.json();
       data.response.forEach((response: any) => {
-        let { uText, uStyles } = processResponse(response);
+        // Logged commands leave out fields that have their default value
+        const command = { ...data.defaults?.[response.type], ...response };
+        let { uText, uStyles } = processResponse(command);
         uStyles = uStyles.map((style) => ({ ...style, characterDelayMs: 0 }));
         props.handleConversation(uText, uStyles);
       });
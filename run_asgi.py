@@ -0,0 +1,8 @@
+import uvicorn
+
+from run_server import setup_logging
+
+if __name__ == "__main__":
+    setup_logging()
+    # The ASGI lifespan startup hook warms up the worker and fills the session pool
+    uvicorn.run("server.asgi:application", host="0.0.0.0", port=5000)
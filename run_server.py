@@ -1,27 +1,11 @@
-import logging
-
 from server import app
-
-# Set up the default logger
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-
-# Create a console logger
-ch = logging.StreamHandler()
-ch.setLevel(logging.WARNING)
-ch.setFormatter(
-    logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-)
-logger.addHandler(ch)
-
-# Create a file logger with everything
-fh = logging.FileHandler("server.log", mode="a", encoding="utf-8")
-fh.setLevel(logging.DEBUG)
-fh.setFormatter(
-    logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-)
-logger.addHandler(fh)
+from server.logs import setup_logging
 
 
 if __name__ == "__main__":
+    from server.startup import warm_up
+
+    setup_logging()
+    # Load everything and start filling the session pool before accepting players
+    warm_up()
     app.run(host="0.0.0.0", port=5000, debug=True)
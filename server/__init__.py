@@ -1,6 +1,5 @@
 import logging
 import os
-from datetime import datetime, timedelta
 
 from flask import Flask
 from flask_cors import CORS
@@ -8,6 +7,8 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_session import Session
 
+from server.storage import SessionManager
+
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -16,20 +17,21 @@ app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
 app.config["SESSION_TYPE"] = "filesystem"
 
-# Global in-memory game state storage for active sessions
-game_states = {}
-AI_API_USAGE: int = 0
-AI_API_LIMIT: int = 30
-last_reset_date = datetime.now().date()  # Initialize with the current date
 
+def restore_session(checkpoint: dict):
+    from server.game import Checkpoint, restore_game
+    from server.routes import create_llm
+
+    return restore_game(Checkpoint.from_dict(checkpoint), llm=create_llm())
 
-def check_and_reset_limit(self):
-    # Check if the current date is different from the last reset date
-    if datetime.now().date() > self.last_reset_date:
-        # Reset the usage and update the last reset date
-        API_USAGE = 0
-        last_reset_date = datetime.now().date()
 
+# Global game state storage for active sessions. Idle games are spilled to disk.
+game_states = SessionManager(
+    restore=restore_session,
+    spill_dir=os.environ.get("SESSION_SPILL_DIR"),
+    max_in_memory=int(os.environ.get("SESSION_MAX_IN_MEMORY", 1000)),
+    idle_ttl=float(os.environ.get("SESSION_IDLE_SECONDS", 15 * 60)),
+)
 
 # Define allowed origins based on the environment
 if os.environ.get("FLASK_ENV") == "development":
@@ -1,5 +1,6 @@
 import yaml
-from langchain.memory import ConversationBufferMemory
+
+from server.agents.memory import Transcript
 
 def load_agent_data(filename: str) -> dict:
     with open(filename, 'r') as file:
@@ -9,17 +10,35 @@ def load_agent_data(filename: str) -> dict:
 
 
 class Agent:
-    _raw: dict
-    _memory: ConversationBufferMemory
+    # The character data is loaded once and shared by the agents of every game;
+    # only the memory is per game
+    __slots__ = ("_raw", "_memory")
 
-    def __init__(self, datafile: str):
-        self._memory = ConversationBufferMemory()
-        self._raw = load_agent_data(datafile)
+    def __init__(
+        self,
+        datafile: str | None = None,
+        data: dict | None = None,
+        transcript: Transcript | None = None,
+    ):
+        if data is None:
+            if datafile is None:
+                raise ValueError('Either datafile or data must be given')
+            data = load_agent_data(datafile)
+        self._raw = data
+        # Agents of the same game share one transcript, each with their own view of it.
+        # Characters may set their own budget for how much history they're prompted with.
+        if transcript is None:
+            transcript = Transcript()
+        self._memory = transcript.view(self.name, data.get('memory_token_budget'))
 
     @property
     def name(self) -> str:
         return str(self._raw['name'])
 
+    @property
+    def short_name(self) -> str:
+        return str(self._raw.get('short_name', ''))
+
     @property
     def short_description(self) -> str:
         return str(self._raw['subtitle'])
@@ -35,6 +54,8 @@ class Agent:
         return self._raw['intro_talks_first']
     
 class PlayerAgent(Agent):
+    __slots__ = ()
+
     _raw = {
         'name': 'You',
         'short_name': 'You',
@@ -47,5 +68,7 @@ class PlayerAgent(Agent):
         'intro_talks_first': False,
     }
 
-    def __init__(self):
-        self._memory = ConversationBufferMemory()
+    def __init__(self, transcript: Transcript | None = None):
+        if transcript is None:
+            transcript = Transcript()
+        self._memory = transcript.view(self.name)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# Which prompts may be answered from the cache:
+#   "none"     - never
+#   "openings" - only prompts with no conversation history, which are identical across games
+#   "all"      - any prompt, as long as the rendered text matches exactly
+CACHE_POLICIES = ("none", "openings", "all")
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    text: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+
+def cache_key(prompt: str, model_params: dict) -> str:
+    payload = json.dumps({"prompt": prompt, "model": model_params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Model replies keyed by a hash of the fully rendered prompt and the model's
+    parameters. A bounded in-memory LRU sits in front of an optional SQLite file,
+    and entries in both expire after `ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        policy: str = "openings",
+        max_entries: int = 2048,
+        ttl: float = 24 * 60 * 60,
+        path: str | None = None,
+    ):
+        if policy not in CACHE_POLICIES:
+            raise ValueError(f"Unknown cache policy {policy}, expected one of {CACHE_POLICIES}")
+        self.policy = policy
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._memory: OrderedDict[str, tuple[CachedResponse, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {"hits": 0, "misses": 0, "saved_tokens": 0, "saved_cost": 0.0}
+
+        if path is not None:
+            with self._connect() as db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, created REAL)"
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, sqlite connections can't be shared. Using it as
+        # a context manager only commits or rolls back, it stays open for reuse.
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5)
+        return db
+
+    def is_cacheable(self, history: str) -> bool:
+        match self.policy:
+            case "none":
+                return False
+            case "openings":
+                return history == ""
+        return True
+
+    def get(self, key: str) -> CachedResponse | None:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[1] < self.ttl:
+                    self._memory.move_to_end(key)
+                    return self._hit(entry[0])
+                del self._memory[key]
+
+        if self.path is not None:
+            with self._connect() as db:
+                row = db.execute(
+                    "SELECT value, created FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+            if row is not None and now - row[1] < self.ttl:
+                response = CachedResponse(**json.loads(row[0]))
+                with self._lock:
+                    self._remember(key, response, row[1])
+                    return self._hit(response)
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def contains(self, key: str) -> bool:
+        """Whether `key` is cached, without counting it as a hit or miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                return True
+        if self.path is not None:
+            with self._connect() as db:
+                row = db.execute(
+                    "SELECT created FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+            return row is not None and now - row[0] < self.ttl
+        return False
+
+    def _hit(self, response: CachedResponse) -> CachedResponse:
+        self.stats["hits"] += 1
+        self.stats["saved_tokens"] += response.prompt_tokens + response.completion_tokens
+        self.stats["saved_cost"] += response.cost
+        return response
+
+    def _remember(self, key: str, response: CachedResponse, created: float) -> None:
+        self._memory[key] = (response, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, key: str, response: CachedResponse) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+        if self.path is not None:
+            with self._connect() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                    (key, json.dumps(response.__dict__), now),
+                )
+                db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+
+
+response_cache = ResponseCache(
+    policy=os.environ.get("LLM_CACHE_POLICY", "openings"),
+    max_entries=int(os.environ.get("LLM_CACHE_SIZE", 2048)),
+    ttl=float(os.environ.get("LLM_CACHE_TTL_SECONDS", 24 * 60 * 60)),
+    path=os.environ.get("LLM_CACHE_PATH"),
+)
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, get_buffer_string
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+from server.agents.conversation import LLMRequest, model_name
+
+logger = logging.getLogger(__name__)
+
+# Set to a directory to record a cassette for every game
+CASSETTE_DIR = os.environ.get("LLM_CASSETTE_DIR")
+
+
+class CassetteMissError(LookupError):
+    pass
+
+
+def cassette_path(directory: str, game_id: str) -> str:
+    return os.path.join(directory, f"{game_id}.jsonl")
+
+
+class CassetteRecorder:
+    """
+    Appends a game's player inputs and model replies to a JSONL file, one event per
+    line, as they happen. Together they're enough to play the game again offline
+    with `server.game.replay_cassette`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _write(self, event: dict) -> None:
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line)
+
+    def record_input(self, user_input: str | None) -> None:
+        self._write({"kind": "input", "input": user_input})
+
+    def record_call(
+        self, request: LLMRequest, text: str, scene: str, source: str, latency: float
+    ) -> None:
+        self._write(
+            {
+                "kind": "llm",
+                "scene": scene,
+                "agent": request.agent.name,
+                "model": model_name(request.chain.llm),
+                "source": source,
+                "prompt": request.render()[0].to_string(),
+                "response": text,
+                "latency_s": round(latency, 6),
+                "prompt_tokens": request.prompt_tokens,
+                "completion_tokens": request.completion_tokens,
+                "cost": request.cost,
+            }
+        )
+
+
+def read_cassette(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class ReplayLLM(BaseChatModel):
+    """
+    Answers prompts with the replies recorded in a cassette instead of calling a
+    model. Replies are looked up by the exact prompt, in recorded order when the
+    same prompt was sent more than once, and report the recorded token usage.
+
+    With `timings`, every reply takes as long as it originally did, divided by
+    `speed`. Unless `strict`, a prompt that wasn't recorded gets the next unused
+    reply rather than raising `CassetteMissError`.
+    """
+
+    calls: list[dict]
+    model_name: str = "cassette"
+    timings: bool = False
+    speed: float = 1.0
+    strict: bool = True
+    _by_prompt: dict[str, deque] = PrivateAttr(default_factory=dict)
+    _unused: deque = PrivateAttr(default_factory=deque)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def model_post_init(self, __context: Any) -> None:
+        by_prompt = defaultdict(deque)
+        for index, call in enumerate(self.calls):
+            by_prompt[call["prompt"]].append(index)
+        self._by_prompt = dict(by_prompt)
+        self._unused = deque(range(len(self.calls)))
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ReplayLLM":
+        calls = [event for event in read_cassette(path) if event["kind"] == "llm"]
+        if calls:
+            kwargs.setdefault("model_name", calls[0]["model"])
+        return cls(calls=calls, **kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-replay"
+
+    @property
+    def _identifying_params(self) -> dict:
+        # Keeps replayed replies apart from real ones in the response cache
+        digest = hashlib.sha256(json.dumps(self.calls, sort_keys=True).encode()).hexdigest()
+        return {"model_name": self.model_name, "cassette": digest}
+
+    def _next_call(self, prompt: str) -> dict:
+        with self._lock:
+            indices = self._by_prompt.get(prompt)
+            if indices:
+                index = indices.popleft()
+                self._unused.remove(index)
+            elif not self.strict and self._unused:
+                index = self._unused.popleft()
+                self._by_prompt[self.calls[index]["prompt"]].remove(index)
+            else:
+                raise CassetteMissError("No recorded reply for this prompt")
+        return self.calls[index]
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # String prompts arrive as a single message holding the whole prompt
+        prompt = messages[0].content if len(messages) == 1 else get_buffer_string(messages)
+        call = self._next_call(prompt)
+        if self.timings and self.speed > 0:
+            time.sleep(call["latency_s"] / self.speed)
+
+        message = AIMessage(
+            content=call["response"],
+            usage_metadata={
+                "input_tokens": call["prompt_tokens"],
+                "output_tokens": call["completion_tokens"],
+                "total_tokens": call["prompt_tokens"] + call["completion_tokens"],
+            },
+            response_metadata={"model_name": call["model"]},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+
+import httpx
+
+from server.agents.providers import PROVIDERS_FILE, ModelRouter, build_router, read_providers
+
+logger = logging.getLogger(__name__)
+
+
+def key_fingerprint(api_key: str | None) -> str:
+    """Tells API keys apart in stats and logs without revealing them."""
+    if not api_key:
+        return "default"
+    return hashlib.sha256(api_key.encode()).hexdigest()[:8]
+
+
+@dataclass
+class PoolStats:
+    requests: int = 0
+    # Requests holding a connection right now
+    in_flight: int = 0
+    connections_opened: int = 0
+    # Time requests spent waiting for a free connection
+    wait_s: float = 0.0
+    max_wait_s: float = 0.0
+
+
+class _RequestTrace:
+    """Follows one request through httpcore's trace events."""
+
+    __slots__ = ("pool", "started", "waited")
+
+    def __init__(self, pool: "ClientPool"):
+        self.pool = pool
+        self.started = time.perf_counter()
+        self.waited = False
+
+    def __call__(self, name: str, info: dict) -> None:
+        # The request has a connection once it starts opening one or sending on one
+        if not self.waited and name.endswith(("connect_tcp.started", "send_request_headers.started")):
+            self.waited = True
+            self.pool._waited(time.perf_counter() - self.started)
+        if name.endswith("connect_tcp.complete"):
+            self.pool._opened()
+        elif name.endswith("send_request_headers.started"):
+            self.pool._sending(1)
+        elif name.endswith("response_closed.complete"):
+            self.pool._sending(-1)
+
+
+class _AsyncRequestTrace(_RequestTrace):
+    async def __call__(self, name: str, info: dict) -> None:
+        super().__call__(name, info)
+
+
+class ClientPool:
+    """
+    Keep-alive HTTP connections to one provider for one API key, shared by every
+    model client that talks to it. At most `size` connections are open at once;
+    requests beyond that wait for one, which shows up in `stats`.
+
+    The async client belongs to the event loop that first uses it, which is the
+    one serving the app. A `transport` stands in for the network, for tests.
+    """
+
+    def __init__(
+        self,
+        base_url: str | None,
+        api_key: str | None,
+        size: int,
+        keepalive_expiry: float,
+        transport: httpx.BaseTransport | httpx.AsyncBaseTransport | None = None,
+    ):
+        self.base_url = base_url
+        self.label = f"{base_url or 'default'}@{key_fingerprint(api_key)}"
+        self.size = size
+        self._lock = threading.Lock()
+        self._stats = PoolStats()
+        limits = httpx.Limits(
+            max_connections=size, max_keepalive_connections=size, keepalive_expiry=keepalive_expiry
+        )
+        self.http = httpx.Client(
+            limits=limits, transport=transport, event_hooks={"request": [self._on_request]}
+        )
+        self.async_http = httpx.AsyncClient(
+            limits=limits, transport=transport, event_hooks={"request": [self._aon_request]}
+        )
+
+    def _on_request(self, request: httpx.Request) -> None:
+        self._started()
+        request.extensions["trace"] = _RequestTrace(self)
+
+    async def _aon_request(self, request: httpx.Request) -> None:
+        self._started()
+        request.extensions["trace"] = _AsyncRequestTrace(self)
+
+    def _started(self) -> None:
+        with self._lock:
+            self._stats.requests += 1
+
+    def _sending(self, change: int) -> None:
+        with self._lock:
+            self._stats.in_flight += change
+
+    def _waited(self, seconds: float) -> None:
+        with self._lock:
+            self._stats.wait_s += seconds
+            self._stats.max_wait_s = max(self._stats.max_wait_s, seconds)
+
+    def _opened(self) -> None:
+        with self._lock:
+            self._stats.connections_opened += 1
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {"pool": self.label, "size": self.size, **asdict(self._stats)}
+
+    def openai_clients(self, api_key: str | None, **params) -> dict:
+        """The sync and async `openai` clients for `ChatOpenAI`, sending through this pool."""
+        import openai
+
+        params = {"api_key": api_key or os.environ.get("OPENAI_API_KEY"), "base_url": self.base_url, **params}
+        return {
+            "client": openai.OpenAI(http_client=self.http, **params).chat.completions,
+            "async_client": openai.AsyncOpenAI(http_client=self.async_http, **params).chat.completions,
+        }
+
+
+class ClientRegistry:
+    """
+    Process-wide model clients. Games that use the same provider config and API
+    key share one `ModelRouter`, and everything talking to the same provider with
+    the same key shares one `ClientPool`, so connections and TLS sessions are
+    reused across games instead of being set up for each of them.
+    """
+
+    def __init__(self, pool_size: int = 64, keepalive_expiry: float = 60.0, transport=None):
+        self.pool_size = pool_size
+        self.keepalive_expiry = keepalive_expiry
+        # Passed on to every pool, see `ClientPool`
+        self.transport = transport
+        self._lock = threading.Lock()
+        # (base url, key fingerprint) -> pool
+        self._pools: dict[tuple[str | None, str], ClientPool] = {}
+        # (config digest, key fingerprint) -> router
+        self._routers: dict[tuple[str, str], ModelRouter] = {}
+
+    def pool(self, base_url: str | None, api_key: str | None = None) -> ClientPool:
+        key = (base_url, key_fingerprint(api_key))
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = ClientPool(
+                    base_url, api_key, self.pool_size, self.keepalive_expiry, self.transport
+                )
+                logger.info("opened llm client pool. pool=%s ; size=%d", pool.label, self.pool_size)
+        return pool
+
+    def router(self, api_key: str | None = None, config: dict | None = None, path: str = PROVIDERS_FILE) -> ModelRouter:
+        if config is None:
+            config = read_providers(path)
+        digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+        key = (digest, key_fingerprint(api_key))
+        with self._lock:
+            router = self._routers.get(key)
+        if router is None:
+            built = build_router(config, clients=self, api_key=api_key)
+            with self._lock:
+                router = self._routers.setdefault(key, built)
+        return router
+
+    @property
+    def stats(self) -> list[dict]:
+        with self._lock:
+            pools = list(self._pools.values())
+        return [pool.stats for pool in pools]
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for name, kind, field, help_text in [
+            ("llm_client_pool_size", "gauge", "size", "Most connections a pool keeps open."),
+            ("llm_client_pool_in_flight", "gauge", "in_flight", "Requests holding one of a pool's connections."),
+            ("llm_client_pool_requests_total", "counter", "requests", "Requests sent through a pool."),
+            ("llm_client_pool_connections_opened_total", "counter", "connections_opened", "Connections a pool opened."),
+            ("llm_client_pool_wait_seconds_total", "counter", "wait_s", "Time requests waited for a connection."),
+            ("llm_client_pool_wait_seconds_max", "gauge", "max_wait_s", "Longest a request waited for a connection."),
+        ]:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f'{name}{{pool="{stats["pool"]}"}} {stats[field]}' for stats in self.stats]
+        return "\n".join(lines) + "\n"
+
+
+llm_clients = ClientRegistry(
+    pool_size=int(os.environ.get("LLM_POOL_SIZE", "64")),
+    keepalive_expiry=float(os.environ.get("LLM_KEEPALIVE_SECONDS", "60")),
+)
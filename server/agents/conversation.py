@@ -1,16 +1,30 @@
-from dataclasses import dataclass
-from langchain.chains import LLMChain
-from langchain.chat_models import ChatOpenAI, FakeListChatModel
-from langchain.prompts import PromptTemplate
-from langchain.schema.messages import ChatMessage
-from langchain.callbacks import get_openai_callback
+from __future__ import annotations
+
+from collections.abc import Callable, Generator
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
 from server.agents.agent import Agent, PlayerAgent
+from server.agents.cache import CachedResponse, ResponseCache, cache_key
+from server.agents.memory import estimate_tokens, shared_audience
+from server.agents.turns import TurnPolicy, default_turn_policy
 import logging
 
+# langchain takes most of the server's import time, so it's only imported once a
+# conversation needs it, or up front by `server.startup.warm_up`
+if TYPE_CHECKING:
+    from langchain.chains import LLMChain
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.prompt_values import PromptValue
+    from langchain_core.prompts import PromptTemplate
+
+    # Any chat model, including the pools and routers in `server.agents.providers`
+    LLM_t = BaseChatModel
+
 logger = logging.getLogger(__name__)
 
 
-LLM_t = ChatOpenAI | FakeListChatModel
+def model_name(llm: LLM_t) -> str:
+    return getattr(llm, "model_name", None) or llm._llm_type
 
 
 @dataclass
@@ -25,29 +39,212 @@ class LLMData:
     llm: LLM_t
     prompt: str
     extra_flavor: dict
+    prompt_name: str | None = None
+
+    @property
+    def model(self) -> LLM_t:
+        """The model for this prompt, which is its tier when `llm` routes between several."""
+        for_prompt = getattr(self.llm, "for_prompt", None)
+        return self.llm if for_prompt is None else for_prompt(self.prompt_name)
+
+
+# (agent name, prompt name) -> (agent data, flavor, prompt, compiled template)
+_compiled_prompts: dict[tuple[str, str], tuple[dict, dict, str, PromptTemplate]] = {}
+
+
+def compile_prompt(agent: Agent, llmd: LLMData) -> PromptTemplate:
+    """
+    Fills the agent's persona and the setting into the prompt and parses the result,
+    once per agent and prompt. The cached template is reused for as long as the
+    game content is the same objects, so a content reload recompiles it.
+    """
+    key = (agent.name, llmd.prompt_name or llmd.prompt)
+    cached = _compiled_prompts.get(key)
+    if (
+        cached is not None
+        and cached[0] is agent._raw
+        and cached[1] is llmd.extra_flavor
+        and cached[2] is llmd.prompt
+    ):
+        return cached[3]
+
+    from langchain_core.prompts import PromptTemplate
+
+    template = PromptTemplate.from_template(
+        llmd.prompt.format(**{**agent._raw, **llmd.extra_flavor})
+    )
+    _compiled_prompts[key] = (agent._raw, llmd.extra_flavor, llmd.prompt, template)
+    return template
+
+
+def usage_callback():
+    """Collects the token usage and cost of the model calls made inside it."""
+    from langchain_community.callbacks.manager import get_openai_callback
+
+    return get_openai_callback()
+
+
+# Called with (agent name, token) while a reply is streamed
+TokenCallback_t = Callable[[str, str], None]
+
+# Reply length assumed when reserving budget for a model call, before it's known
+EXPECTED_REPLY_TOKENS = 150
+
+
+@dataclass
+class LLMRequest:
+    """
+    A single completion needed by a conversation. Conversations yield these up to
+    whoever is driving the scene, which sends back the raw text of the reply.
+    This keeps every model call in one place, so it can be recorded or replayed.
+    """
+
+    agent: Agent
+    chain: LLMChain
+    message: str
+    # Filled in once the model has been called
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    _rendered: tuple[PromptValue, str] | None = field(default=None, repr=False)
+
+    def render(self) -> tuple[PromptValue, str]:
+        """The prompt for this request, and the history that went into it."""
+        if self._rendered is None:
+            inputs = {"message": self.message, "history": self.agent._memory.buffer}
+            prompt = self.chain.prompt.format_prompt(
+                **{key: inputs[key] for key in self.chain.prompt.input_variables}
+            )
+            self._rendered = (prompt, inputs["history"])
+        return self._rendered
+
+    @property
+    def cache_key(self) -> str:
+        return cache_key(self.render()[0].to_string(), self.chain.llm._identifying_params)
+
+    def _record_usage(self, cb) -> None:
+        self.prompt_tokens = cb.prompt_tokens
+        self.completion_tokens = cb.completion_tokens
+        self.cost = cb.total_cost
+        # Avoid logging if both values are zero. This likely means we aren't using an OpenAI model
+        # at this time.
+        if cb.prompt_tokens != 0 or cb.completion_tokens != 0:
+            logger.info("invoked llm. prompt tokens=%d ; completion tokens=%d ; cost=%f", cb.prompt_tokens, cb.completion_tokens, cb.total_cost)
+
+    def expected_tokens(self) -> int:
+        """Roughly what calling the model for this request will cost, for reserving budget."""
+        return estimate_tokens(self.render()[0].to_string()) + EXPECTED_REPLY_TOKENS
+
+    def billable_tokens(self, text: str) -> int:
+        """Tokens the provider reported for this request, or an estimate if it reported none."""
+        if self.prompt_tokens or self.completion_tokens:
+            return self.prompt_tokens + self.completion_tokens
+        return estimate_tokens(self.render()[0].to_string()) + estimate_tokens(text)
+
+    # `generate`, `agenerate`, `generate_stream` and `cached` only produce the reply.
+    # The session then `replay`s it, leaving the agent's memory as after a real call.
+
+    def generate(self) -> str:
+        """Calls the model without touching the agent's memory."""
+        with usage_callback() as cb:
+            text = self.chain.llm.invoke(self.render()[0]).content
+            self._record_usage(cb)
+        return text
+
+    async def agenerate(self) -> str:
+        with usage_callback() as cb:
+            text = (await self.chain.llm.ainvoke(self.render()[0])).content
+            self._record_usage(cb)
+        return text
+
+    def generate_stream(self, on_token: TokenCallback_t) -> str:
+        """Like `generate`, but hands every token to `on_token` as the model produces it."""
+        text = ""
+        with usage_callback() as cb:
+            for chunk in self.chain.llm.stream(self.render()[0]):
+                text += chunk.content
+                on_token(self.agent.name, chunk.content)
+            self._record_usage(cb)
+        return text
+
+    def cached(self, cache: ResponseCache) -> str | None:
+        """The cached reply, if the cache's policy and contents allow it."""
+        if not cache.is_cacheable(self.render()[1]):
+            return None
+        hit = cache.get(self.cache_key)
+        if hit is None:
+            return None
+        logger.info("served llm reply from cache. saved prompt tokens=%d ; completion tokens=%d ; cost=%f", hit.prompt_tokens, hit.completion_tokens, hit.cost)
+        return hit.text
+
+    def to_cache(self, cache: ResponseCache, text: str) -> None:
+        if cache.is_cacheable(self.render()[1]):
+            cache.put(
+                self.cache_key,
+                CachedResponse(text, self.prompt_tokens, self.completion_tokens, self.cost),
+            )
+
+    def replay(self, text: str) -> str:
+        """Uses a previously generated reply instead of calling the model."""
+        # The agent remembers what it was answering; the reply itself is added to
+        # the transcript by the conversation, for everyone taking part to see
+        memory = self.agent._memory
+        memory.transcript.append("Human", self.message, memory.audience)
+        return text
+
+
+@dataclass
+class Speculation:
+    """
+    Requests that are likely to be needed soon. Scenes yield these when they know
+    what might come next, so the replies can be generated while the player reads.
+    """
+
+    requests: list[LLMRequest]
+
+
+@dataclass
+class ParallelRequests:
+    """
+    Requests that don't depend on each other's replies. Whoever drives the scene may
+    fulfil them concurrently, and sends back the replies in the same order.
+    """
+
+    requests: list[LLMRequest]
+
+
+Talk_t = Generator[LLMRequest | ParallelRequests, str | list[str], list[ConversationResponse]]
 
 
 class Conversation:
-    def __init__(self, agents: list[Agent | PlayerAgent], llmd: LLMData):
+    def __init__(
+        self,
+        agents: list[Agent | PlayerAgent],
+        llmd: LLMData,
+        turn_policy: TurnPolicy | None = None,
+        parallel: bool = False,
+    ):
         # Declare vars
         self.agents = agents
+        # In parallel reactions mode everyone replies to the message itself, all at
+        # once, rather than each to the reply before theirs
+        self.parallel = parallel
         self.conversations = []
-        self.formatted_prompts = []
+        # Decides who replies to each message
+        self.turn_policy = turn_policy if turn_policy is not None else default_turn_policy
+        # Everyone taking part hears every reply
+        self.audience = shared_audience(agent.name for agent in agents)
 
-        # Create the prompts and conversations
-        for i, agent in enumerate(agents):
-            self.formatted_prompts.append(
-                llmd.prompt.format(**{**agent._raw, **llmd.extra_flavor})
-            )
+        from langchain.chains import LLMChain
 
-            # Initialize the conversations
+        # Create the conversations
+        for agent in agents:
             if not isinstance(agent, PlayerAgent):
                 self.conversations.append(
                     LLMChain(
-                        llm=llmd.llm,
-                        prompt=PromptTemplate.from_template(self.formatted_prompts[i]),
+                        llm=llmd.model,
+                        prompt=compile_prompt(agent, llmd),
                         verbose=False,
-                        memory=self.agents[i]._memory,
                     )
                 )
             else:
@@ -62,41 +259,43 @@ class Conversation:
             return ConversationResponse(text, agent.name, True)
         return ConversationResponse(text, agent.name, False)
 
-    # Cycles the agents and conversations to the next one.
-    # (We cycle and not iterate so that the conversation order can be easily observed externally by inspecting the Conversation object)
-    def cycle_agents(self):
-        curr = self.agents.pop(0)
-        self.agents.append(curr)
-        tmp = self.conversations.pop(0)
-        self.conversations.append(tmp)
-
-    def begin_conversation(self) -> list[ConversationResponse]:
+    def begin_conversation(self) -> Talk_t:
         """Starts a conversation without player input"""
-        return self.converse("[Conversation begins]")
+        return (yield from self.converse("[Conversation begins]"))
 
-    # Loops through each member of the conversation and allows them to speak.
-    def converse(self, message: str) -> list[ConversationResponse]:
+    # Lets the agents picked by the turn policy speak, each one replying to the one before.
+    def converse(self, message: str) -> Talk_t:
         responses: list[ConversationResponse] = []
         carried_message = message
 
-        # If the first agent is a PlayerAgent, skip it.
-        if isinstance(self.agents[0], PlayerAgent):
-            self.cycle_agents()
+        speakers = self.turn_policy.speakers(self.agents, message)
+        if self.parallel and len(speakers) > 1:
+            return (yield from self.__react(speakers, message))
 
-        while not isinstance(self.agents[0], PlayerAgent):
-            res, mes = self.__talk(self.agents[0], self.conversations[0], carried_message)
+        for agent in speakers:
+            conversation = self.conversations[self.agents.index(agent)]
+            res = yield from self.__talk(agent, conversation, carried_message)
             responses.append(res)
-            
-            for a in self.agents:
-                a._memory.chat_memory.add_message(mes)
-
-            self.cycle_agents()
             carried_message = res.text
 
         return responses
 
+    def __react(self, speakers: list[Agent], message: str) -> Talk_t:
+        requests = [
+            LLMRequest(agent, self.conversations[self.agents.index(agent)], message)
+            for agent in speakers
+        ]
+        raw_responses: list[str] = yield ParallelRequests(requests)
+
+        # Replies join the transcript in speaking order, however they finished
+        responses: list[ConversationResponse] = []
+        for agent, raw_response in zip(speakers, raw_responses):
+            res = self.__parse_response(agent, raw_response)
+            agent._memory.transcript.append(agent.name, res.text, self.audience)
+            responses.append(res)
+        return responses
 
-    def speak_directly(self, message: str, agent: Agent) -> list[ConversationResponse]:
+    def speak_directly(self, message: str, agent: Agent) -> Talk_t:
         if agent not in self.agents:
             raise ValueError(f"Agent {agent.name} is not in the conversation")
 
@@ -104,10 +303,8 @@ class Conversation:
         responses: list[ConversationResponse] = []
 
         # Converse directly with the target agent without disturbing turn order
-        res, mes = self.__talk(agent, conversation, message)
+        res = yield from self.__talk(agent, conversation, message)
         responses.append(res)
-        for a in self.agents:
-            a._memory.chat_memory.add_message(mes)
 
         return responses
 
@@ -116,18 +313,7 @@ class Conversation:
         if isinstance(agent, PlayerAgent):
             raise ValueError("PlayerAgent shoudn't talk via this method")
 
-        with get_openai_callback() as cb:
-            raw_response = conversation({"message": message})
-            res: ConversationResponse = self.__parse_response(agent, raw_response["text"])
-            # Avoid logging if both values are zero. This likely means we aren't using an OpenAI model
-            # at this time.
-            if cb.prompt_tokens != 0 or cb.completion_tokens != 0:
-                logger.info("invoked llm. prompt tokens=%d ; completion tokens=%d ; cost=%f", cb.prompt_tokens, cb.completion_tokens, cb.total_cost)
-
-        # We need to remove and rename the AIMessage that gets added automatically
-        # and re-add it as a ChatMessage with the correct label
-        cm = agent._memory.chat_memory
-        cm.messages = cm.messages[:-1]
-        msg: ChatMessage = ChatMessage(role=agent.name, content=res.text)
-        # Return the generated response
-        return res, msg
+        raw_response: str = yield LLMRequest(agent, conversation, message)
+        res: ConversationResponse = self.__parse_response(agent, raw_response)
+        agent._memory.transcript.append(agent.name, res.text, self.audience)
+        return res
@@ -0,0 +1,168 @@
+import os
+import re
+from collections.abc import Iterator
+from dataclasses import dataclass
+from itertools import islice
+
+# Tokens of history agents are prompted with before older entries are folded into
+# a summary, unless their character sets its own. 0 keeps the whole history.
+DEFAULT_MEMORY_TOKEN_BUDGET = int(os.environ.get("MEMORY_TOKEN_BUDGET", 1500))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text. Close enough for a
+    # budget, and avoids a tokenizer dependency.
+    return len(text) // 4 + 1
+
+
+def summarize_line(line: str, max_words: int = 20) -> str:
+    """Shortens a `speaker: text` line down to its first sentence."""
+    speaker, sep, text = line.partition(": ")
+    if not sep:
+        speaker, text = "", line
+    first = _SENTENCE_END.split(text.strip(), maxsplit=1)[0]
+    words = first.split()
+    if len(words) > max_words:
+        first = " ".join(words[:max_words]) + "..."
+    return f"{speaker}: {first}" if speaker else first
+
+
+# Audiences are the same few sets of names in every game, so games share them
+_audiences: dict[frozenset[str], frozenset[str]] = {}
+
+
+def shared_audience(names) -> frozenset[str]:
+    audience = frozenset(names)
+    return _audiences.setdefault(audience, audience)
+
+
+@dataclass(frozen=True, slots=True)
+class TranscriptEntry:
+    role: str
+    content: str
+    # Names of the agents that see this entry. Conversations share one set between
+    # all of their entries.
+    audience: frozenset[str]
+
+    @property
+    def line(self) -> str:
+        return f"{self.role}: {self.content}"
+
+
+class Transcript:
+    """
+    Everything said in one game, in order, shared by all of its agents. Entries are
+    only ever appended; what each agent remembers is a `TranscriptView` of it.
+    """
+
+    __slots__ = ("entries", "_views")
+
+    def __init__(self):
+        self.entries: list[TranscriptEntry] = []
+        self._views: list["TranscriptView"] = []
+
+    def view(self, name: str, token_budget: int | None = None) -> "TranscriptView":
+        view = TranscriptView(self, name, token_budget)
+        self._views.append(view)
+        return view
+
+    def append(self, role: str, content: str, audience: frozenset[str]) -> None:
+        entry = TranscriptEntry(role, content, audience)
+        self.entries.append(entry)
+        for view in self._views:
+            if view.name in audience:
+                view._saw(entry)
+
+
+class TranscriptView:
+    """
+    What one agent remembers of a transcript: the entries it was in the audience
+    for, from `start` on, with anything older folded into a short summary once the
+    whole history goes over `token_budget` (if it's not 0).
+
+    The summary is extractive rather than written by the model, so it costs nothing
+    and is deterministic, which keeps checkpoint replays exact.
+    """
+
+    __slots__ = (
+        "transcript",
+        "name",
+        "audience",
+        "token_budget",
+        "keep_recent",
+        "summary_share",
+        "summary",
+        "start",
+        "_count",
+        "_tokens",
+        "_summary_tokens",
+    )
+
+    def __init__(
+        self,
+        transcript: Transcript,
+        name: str,
+        token_budget: int | None = None,
+        # Entries that are never folded, however tight the budget is
+        keep_recent: int = 4,
+        # Share of the budget the summary may use before its oldest lines are dropped
+        summary_share: float = 0.3,
+    ):
+        self.transcript = transcript
+        self.name = name
+        # For entries only this agent sees, such as the prompt it answered
+        self.audience = shared_audience([name])
+        self.token_budget = DEFAULT_MEMORY_TOKEN_BUDGET if token_budget is None else token_budget
+        self.keep_recent = keep_recent
+        self.summary_share = summary_share
+        self.summary: list[str] = []
+        # Offset of the oldest entry that isn't folded into the summary
+        self.start = len(transcript.entries)
+        # Count and estimated tokens of the visible entries from `start` on
+        self._count = 0
+        self._tokens = 0
+        self._summary_tokens = 0
+
+    def messages(self) -> Iterator[TranscriptEntry]:
+        # Without copying the entries, every agent renders this for every prompt
+        for entry in islice(self.transcript.entries, self.start, None):
+            if self.name in entry.audience:
+                yield entry
+
+    def _saw(self, entry: TranscriptEntry) -> None:
+        self._count += 1
+        self._tokens += estimate_tokens(entry.content)
+        self._fold()
+
+    def _fold(self) -> None:
+        if not self.token_budget:
+            return
+        entries = self.transcript.entries
+        while (
+            self._count > self.keep_recent
+            and self._summary_tokens + self._tokens > self.token_budget
+        ):
+            while self.name not in entries[self.start].audience:
+                self.start += 1
+            entry = entries[self.start]
+            line = summarize_line(entry.line)
+            self.summary.append(line)
+            self._summary_tokens += estimate_tokens(line)
+            self._count -= 1
+            self._tokens -= estimate_tokens(entry.content)
+            self.start += 1
+
+        summary_budget = int(self.token_budget * self.summary_share)
+        while self.summary and self._summary_tokens > summary_budget:
+            self._summary_tokens -= estimate_tokens(self.summary.pop(0))
+
+    @property
+    def buffer(self) -> str:
+        """The history as it's filled into prompts."""
+        recent = "\n".join(entry.line for entry in self.messages())
+        if not self.summary:
+            return recent
+        summary = "\n".join(self.summary)
+        return f"Summary of earlier conversation:\n{summary}\n\nRecent conversation:\n{recent}"
@@ -0,0 +1,700 @@
+import asyncio
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from collections.abc import AsyncIterator, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any
+
+import yaml
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, get_buffer_string
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from server.agents.memory import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS_FILE = os.environ.get(
+    "LLM_PROVIDERS_FILE", os.path.join(os.path.dirname(__file__), "..", "data", "providers.yaml")
+)
+
+# Latencies of recent successful calls kept per tier, for the hedging threshold
+LATENCY_WINDOW = 200
+
+# Backend calls run here, so a call that times out can be abandoned rather than
+# waited for. It keeps its worker until the backend gives up on it.
+backend_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("LLM_BACKEND_WORKERS", "32")), thread_name_prefix="llm-backend"
+)
+
+
+class ProviderConfigError(ValueError):
+    pass
+
+
+class LLMTimeoutError(TimeoutError):
+    def __init__(self, message: str, abandoned: int = 0):
+        super().__init__(message)
+        # Calls given up on that were still running, and will still cost
+        self.abandoned = abandoned
+
+
+class BackendError(RuntimeError):
+    pass
+
+
+def backend_name(llm: BaseChatModel) -> str:
+    return getattr(llm, "model_name", None) or llm._llm_type
+
+
+def _as_chunk(result: ChatResult) -> ChatGenerationChunk:
+    message = result.generations[0].message
+    return ChatGenerationChunk(
+        message=AIMessageChunk(content=message.content, usage_metadata=message.usage_metadata)
+    )
+
+
+def backend_stream(llm: BaseChatModel, messages: list[BaseMessage], stop, kwargs: dict) -> Iterator[ChatGenerationChunk]:
+    """The reply of `llm` as it's generated, or as a single chunk if it can't stream."""
+    if type(llm)._stream is BaseChatModel._stream:
+        yield _as_chunk(llm._generate(messages, stop=stop, **kwargs))
+    else:
+        yield from llm._stream(messages, stop=stop, **kwargs)
+
+
+async def abackend_stream(
+    llm: BaseChatModel, messages: list[BaseMessage], stop, kwargs: dict
+) -> AsyncIterator[ChatGenerationChunk]:
+    # Models that only stream synchronously are streamed in a worker thread by `_astream`
+    if type(llm)._astream is BaseChatModel._astream and type(llm)._stream is BaseChatModel._stream:
+        yield _as_chunk(await llm._agenerate(messages, stop=stop, **kwargs))
+    else:
+        async for chunk in llm._astream(messages, stop=stop, **kwargs):
+            yield chunk
+
+
+class LatencyLLM(BaseChatModel):
+    """
+    A local stand-in for a model provider. Replies with one of `responses`, picked
+    by the prompt, after `latency` seconds plus up to `jitter` more, and reports
+    estimated token usage like a provider would. Games sharing a backend get the
+    same reply to the same prompt, whatever else it's answering. The first
+    `failures` calls raise `BackendError` instead, after the same delay.
+
+    Streamed replies come a word at a time, with the usage on the last chunk.
+    """
+
+    responses: list[str]
+    latency: float = 0.0
+    jitter: float = 0.0
+    failures: int = 0
+    model_name: str = "latency-fake"
+    _calls: int = PrivateAttr(default=0)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "latency-fake"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model_name": self.model_name, "responses": self.responses}
+
+    def _delay(self) -> tuple[int, float]:
+        with self._lock:
+            call = self._calls
+            self._calls += 1
+        return call, self.latency + random.uniform(0, self.jitter)
+
+    def _reply(self, call: int, messages: list[BaseMessage]) -> ChatResult:
+        if call < self.failures:
+            raise BackendError(f"{self.model_name} failed call {call}")
+        prompt = get_buffer_string(messages)
+        text = self.responses[zlib.crc32(prompt.encode()) % len(self.responses)]
+        usage = {"input_tokens": estimate_tokens(prompt), "output_tokens": estimate_tokens(text)}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        message = AIMessage(content=text, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        call, delay = self._delay()
+        time.sleep(delay)
+        return self._reply(call, messages)
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        call, delay = self._delay()
+        await asyncio.sleep(delay)
+        return self._reply(call, messages)
+
+    def _chunks(self, result: ChatResult) -> Iterator[ChatGenerationChunk]:
+        message = result.generations[0].message
+        words = re.findall(r"\S+\s*|\s+", message.content)
+        for i, word in enumerate(words):
+            usage = message.usage_metadata if i == len(words) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word, usage_metadata=usage))
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        yield from self._chunks(self._generate(messages, stop, **kwargs))
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        for chunk in self._chunks(await self._agenerate(messages, stop, **kwargs)):
+            yield chunk
+
+
+class PooledLLM(BaseChatModel):
+    """
+    Spreads calls over `backends`, taking turns. Every attempt gets `timeout`
+    seconds, and a failed or timed out attempt is retried on the next backend up
+    to `retries` times, after a jittered exponential backoff.
+
+    With `hedge_percentile`, an attempt still running after that percentile of
+    recent latencies gets a duplicate on the next backend, and whichever replies
+    first wins. Hedging only starts once `hedge_min_samples` calls have finished,
+    and never sooner than `hedge_min_delay`, so quick backends aren't doubled up.
+
+    Backends are called directly, so token usage is reported once, with the reply
+    that was used. Duplicates and timed out attempts that were left running still
+    cost, so each adds what the reply used to the usage reported with it.
+
+    Streamed replies are passed through from the backend. The timeout, retries and
+    hedging apply until the first chunk arrives, since nothing has been handed on
+    before then; after that the reply comes from that backend alone, and fails if
+    it goes `timeout` seconds without another chunk.
+    """
+
+    backends: list[BaseChatModel]
+    tier: str = "default"
+    model_name: str = ""
+    timeout: float = 30.0
+    retries: int = 2
+    backoff: float = 0.25
+    max_backoff: float = 4.0
+    hedge_percentile: float | None = None
+    hedge_min_samples: int = 20
+    hedge_min_delay: float = 0.05
+    _latencies: deque = PrivateAttr(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+    _next: int = PrivateAttr(default=0)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _stats: dict = PrivateAttr(
+        default_factory=lambda: {"calls": 0, "retries": 0, "timeouts": 0, "errors": 0, "hedged": 0, "hedges_won": 0}
+    )
+
+    def model_post_init(self, __context: Any) -> None:
+        if not self.backends:
+            raise ProviderConfigError(f"Tier {self.tier} has no backends")
+        if not self.model_name:
+            self.model_name = backend_name(self.backends[0])
+
+    @property
+    def _llm_type(self) -> str:
+        return "pooled"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {
+            "model_name": self.model_name,
+            "tier": self.tier,
+            "backends": [backend._identifying_params for backend in self.backends],
+        }
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _first_backend(self) -> int:
+        with self._lock:
+            first = self._next
+            self._next = (first + 1) % len(self.backends)
+            self._stats["calls"] += 1
+        return first
+
+    def hedge_delay(self) -> float | None:
+        """Seconds an attempt may run before it's hedged, or None when hedging is off."""
+        if self.hedge_percentile is None:
+            return None
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < self.hedge_min_samples:
+            return None
+        index = min(int(len(latencies) * self.hedge_percentile), len(latencies) - 1)
+        return max(latencies[index], self.hedge_min_delay)
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter", so retries from many sessions don't arrive together
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def _retrying(self, attempt: int, error: Exception) -> float:
+        self._count("timeouts" if isinstance(error, LLMTimeoutError) else "errors")
+        if attempt == self.retries:
+            logger.warning("llm call failed. tier=%s ; attempts=%d ; error=%r", self.tier, attempt + 1, error)
+            raise error
+        self._count("retries")
+        delay = self._backoff(attempt)
+        logger.info("retrying llm call. tier=%s ; attempt=%d ; delay=%f ; error=%r", self.tier, attempt + 1, delay, error)
+        return delay
+
+    def _won(self, started: float, hedge: bool) -> None:
+        with self._lock:
+            self._latencies.append(time.perf_counter() - started)
+            if hedge:
+                self._stats["hedges_won"] += 1
+
+    @staticmethod
+    def _charge_abandoned(message: BaseMessage, abandoned: int) -> None:
+        """Adds usage for `abandoned` more calls that cost about what `message` did."""
+        usage = getattr(message, "usage_metadata", None)
+        if abandoned and usage:
+            message.usage_metadata = {
+                **usage,
+                **{
+                    key: usage[key] * (1 + abandoned)
+                    for key in ("input_tokens", "output_tokens", "total_tokens")
+                },
+            }
+
+    def _with_abandoned(self, result: ChatResult, abandoned: int) -> ChatResult:
+        for generation in result.generations:
+            self._charge_abandoned(generation.message, abandoned)
+        return result
+
+    def _call(self, index: int, messages: list[BaseMessage], stop, kwargs: dict) -> ChatResult:
+        return self.backends[index % len(self.backends)]._generate(messages, stop=stop, **kwargs)
+
+    async def _acall(self, index: int, messages: list[BaseMessage], stop, kwargs: dict) -> ChatResult:
+        return await self.backends[index % len(self.backends)]._agenerate(messages, stop=stop, **kwargs)
+
+    def _attempt(
+        self, index: int, messages: list[BaseMessage], stop, kwargs: dict
+    ) -> tuple[ChatResult, int]:
+        """A reply from the backend at `index`, hedged if slow, and how many other calls were left running."""
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        attempts: dict[Future, bool] = {backend_pool.submit(self._call, index, messages, stop, kwargs): False}
+        hedge = self.hedge_delay()
+        if hedge is not None and hedge < self.timeout:
+            done, _ = wait(attempts, timeout=hedge)
+            if not done:
+                self._count("hedged")
+                attempts[backend_pool.submit(self._call, index + 1, messages, stop, kwargs)] = True
+
+        error: Exception | None = None
+        pending = set(attempts)
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.perf_counter(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    # Calls that already started can't be stopped
+                    running = sum(not other.cancel() for other in pending)
+                    self._won(started, attempts[future])
+                    return future.result(), running
+                error = future.exception()
+        if pending:
+            running = sum(not other.cancel() for other in pending)
+            raise LLMTimeoutError(f"No reply from tier {self.tier} within {self.timeout}s", running)
+        raise error
+
+    async def _aattempt(
+        self, index: int, messages: list[BaseMessage], stop, kwargs: dict
+    ) -> tuple[ChatResult, int]:
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        attempts: dict[asyncio.Task, bool] = {
+            asyncio.ensure_future(self._acall(index, messages, stop, kwargs)): False
+        }
+        hedge = self.hedge_delay()
+        if hedge is not None and hedge < self.timeout:
+            done, _ = await asyncio.wait(attempts, timeout=hedge)
+            if not done:
+                self._count("hedged")
+                attempts[asyncio.ensure_future(self._acall(index + 1, messages, stop, kwargs))] = True
+
+        error: Exception | None = None
+        pending = set(attempts)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(deadline - time.perf_counter(), 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                # Cancelled requests may still have been billed for, so they count as running
+                if not done:
+                    raise LLMTimeoutError(
+                        f"No reply from tier {self.tier} within {self.timeout}s", len(pending)
+                    )
+                for task in done:
+                    if task.exception() is None:
+                        self._won(started, attempts[task])
+                        return task.result(), len(pending)
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        first, abandoned = self._first_backend(), 0
+        for attempt in range(self.retries + 1):
+            try:
+                result, running = self._attempt(first + attempt, messages, stop, kwargs)
+                return self._with_abandoned(result, abandoned + running)
+            except Exception as error:
+                abandoned += getattr(error, "abandoned", 0)
+                time.sleep(self._retrying(attempt, error))
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        first, abandoned = self._first_backend(), 0
+        for attempt in range(self.retries + 1):
+            try:
+                result, running = await self._aattempt(first + attempt, messages, stop, kwargs)
+                return self._with_abandoned(result, abandoned + running)
+            except Exception as error:
+                abandoned += getattr(error, "abandoned", 0)
+                await asyncio.sleep(self._retrying(attempt, error))
+
+
+    def _pump(self, index: int, messages, stop, kwargs: dict, attempt: int, events: queue.Queue, stopped: threading.Event) -> None:
+        """Streams from the backend at `index` into `events`, tagged with `attempt`, until `stopped`."""
+        try:
+            for chunk in backend_stream(self.backends[index % len(self.backends)], messages, stop, kwargs):
+                if stopped.is_set():
+                    return
+                events.put((attempt, chunk, None))
+        except Exception as error:
+            events.put((attempt, None, error))
+            return
+        events.put((attempt, None, None))
+
+    def _open_stream(
+        self, index: int, messages: list[BaseMessage], stop, kwargs: dict
+    ) -> tuple[Iterator[ChatGenerationChunk], int]:
+        """
+        Streams from the backend at `index`, hedged if its first chunk is slow. Returns
+        once a chunk has arrived, with the reply and how many other calls were left running.
+        """
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        events: queue.Queue = queue.Queue()
+        # Attempt number (0 or 1 for the hedge) -> (its call, whether to stop streaming)
+        attempts: dict[int, tuple[Future, threading.Event]] = {}
+
+        def launch(attempt: int) -> None:
+            stopped = threading.Event()
+            future = backend_pool.submit(self._pump, index + attempt, messages, stop, kwargs, attempt, events, stopped)
+            attempts[attempt] = (future, stopped)
+
+        def abandon(others) -> int:
+            for _, stopped in others:
+                stopped.set()
+            # Calls that already started can't be stopped
+            return sum(not future.cancel() for future, _ in others)
+
+        launch(0)
+        hedge = self.hedge_delay()
+        hedge_at = started + hedge if hedge is not None and hedge < self.timeout else None
+        failed: dict[int, Exception] = {}
+        while True:
+            wake = deadline if hedge_at is None else hedge_at
+            try:
+                attempt, chunk, error = events.get(timeout=max(wake - time.perf_counter(), 0))
+            except queue.Empty:
+                if hedge_at is not None:
+                    hedge_at = None
+                    self._count("hedged")
+                    launch(1)
+                    continue
+                running = abandon([attempts[a] for a in attempts if a not in failed])
+                raise LLMTimeoutError(f"No reply from tier {self.tier} within {self.timeout}s", running)
+            if chunk is not None:
+                break
+            failed[attempt] = error or BackendError(f"{self.model_name} sent an empty reply")
+            if len(failed) == len(attempts):
+                raise failed[attempt]
+
+        running = abandon([attempts[a] for a in attempts if a not in failed and a != attempt])
+        self._won(started, attempt == 1)
+        return self._rest(chunk, attempt, events, attempts[attempt][1]), running
+
+    def _rest(self, first: ChatGenerationChunk, attempt: int, events: queue.Queue, stopped: threading.Event) -> Iterator[ChatGenerationChunk]:
+        try:
+            yield first
+            while True:
+                try:
+                    source, chunk, error = events.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise LLMTimeoutError(f"Reply from tier {self.tier} stalled for {self.timeout}s") from None
+                if source != attempt:
+                    continue
+                if error is not None:
+                    raise error
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            stopped.set()
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        first, abandoned = self._first_backend(), 0
+        for attempt in range(self.retries + 1):
+            try:
+                chunks, running = self._open_stream(first + attempt, messages, stop, kwargs)
+                break
+            except Exception as error:
+                abandoned += getattr(error, "abandoned", 0)
+                time.sleep(self._retrying(attempt, error))
+        for chunk in chunks:
+            self._charge_abandoned(chunk.message, abandoned + running)
+            yield chunk
+
+    async def _apump(self, index: int, messages, stop, kwargs: dict, attempt: int, events: asyncio.Queue) -> None:
+        try:
+            async for chunk in abackend_stream(self.backends[index % len(self.backends)], messages, stop, kwargs):
+                events.put_nowait((attempt, chunk, None))
+        except Exception as error:
+            events.put_nowait((attempt, None, error))
+            return
+        events.put_nowait((attempt, None, None))
+
+    async def _aopen_stream(
+        self, index: int, messages: list[BaseMessage], stop, kwargs: dict
+    ) -> tuple[AsyncIterator[ChatGenerationChunk], int]:
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        events: asyncio.Queue = asyncio.Queue()
+        attempts: dict[int, asyncio.Task] = {}
+
+        def launch(attempt: int) -> None:
+            attempts[attempt] = asyncio.ensure_future(
+                self._apump(index + attempt, messages, stop, kwargs, attempt, events)
+            )
+
+        def abandon(others: list[asyncio.Task]) -> int:
+            # Cancelled requests may still have been billed for, so they count as running
+            for task in others:
+                task.cancel()
+            return len(others)
+
+        launch(0)
+        hedge = self.hedge_delay()
+        hedge_at = started + hedge if hedge is not None and hedge < self.timeout else None
+        failed: dict[int, Exception] = {}
+        while True:
+            wake = deadline if hedge_at is None else hedge_at
+            try:
+                attempt, chunk, error = await asyncio.wait_for(
+                    events.get(), timeout=max(wake - time.perf_counter(), 0)
+                )
+            except asyncio.TimeoutError:
+                if hedge_at is not None:
+                    hedge_at = None
+                    self._count("hedged")
+                    launch(1)
+                    continue
+                running = abandon([attempts[a] for a in attempts if a not in failed])
+                raise LLMTimeoutError(f"No reply from tier {self.tier} within {self.timeout}s", running)
+            except BaseException:
+                abandon(list(attempts.values()))
+                raise
+            if chunk is not None:
+                break
+            failed[attempt] = error or BackendError(f"{self.model_name} sent an empty reply")
+            if len(failed) == len(attempts):
+                raise failed[attempt]
+
+        running = abandon([attempts[a] for a in attempts if a not in failed and a != attempt])
+        self._won(started, attempt == 1)
+        return self._arest(chunk, attempt, events, attempts[attempt]), running
+
+    async def _arest(
+        self, first: ChatGenerationChunk, attempt: int, events: asyncio.Queue, task: asyncio.Task
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        try:
+            yield first
+            while True:
+                try:
+                    source, chunk, error = await asyncio.wait_for(events.get(), timeout=self.timeout)
+                except asyncio.TimeoutError:
+                    raise LLMTimeoutError(f"Reply from tier {self.tier} stalled for {self.timeout}s") from None
+                if source != attempt:
+                    continue
+                if error is not None:
+                    raise error
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            task.cancel()
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        first, abandoned = self._first_backend(), 0
+        for attempt in range(self.retries + 1):
+            try:
+                chunks, running = await self._aopen_stream(first + attempt, messages, stop, kwargs)
+                break
+            except Exception as error:
+                abandoned += getattr(error, "abandoned", 0)
+                await asyncio.sleep(self._retrying(attempt, error))
+        async for chunk in chunks:
+            self._charge_abandoned(chunk.message, abandoned + running)
+            yield chunk
+
+
+class ModelRouter(BaseChatModel):
+    """
+    Tiers of models, such as a fast and cheap one and a slower, better one, with
+    each prompt routed to one of them. A route for a prompt also covers its layout
+    variants, e.g. `single_person_conversation_complex_prefix_stable`. Used as a
+    model itself, it's the default tier.
+    """
+
+    tiers: dict[str, BaseChatModel]
+    routes: dict[str, str] = {}
+    default_tier: str
+    model_name: str = ""
+
+    def model_post_init(self, __context: Any) -> None:
+        for tier in [self.default_tier, *self.routes.values()]:
+            if tier not in self.tiers:
+                raise ProviderConfigError(f"Unknown tier {tier}")
+        if not self.model_name:
+            self.model_name = backend_name(self.tiers[self.default_tier])
+
+    @property
+    def _llm_type(self) -> str:
+        return "router"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return self.tiers[self.default_tier]._identifying_params
+
+    def tier_for(self, prompt_name: str | None) -> str:
+        if prompt_name:
+            # Longest matching route first, so a variant can have its own route
+            for route in sorted(self.routes, key=len, reverse=True):
+                if prompt_name == route or prompt_name.startswith(f"{route}_"):
+                    return self.routes[route]
+        return self.default_tier
+
+    def for_prompt(self, prompt_name: str | None) -> BaseChatModel:
+        return self.tiers[self.tier_for(prompt_name)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return self.tiers[self.default_tier]._generate(messages, stop=stop, **kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return await self.tiers[self.default_tier]._agenerate(messages, stop=stop, **kwargs)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        return backend_stream(self.tiers[self.default_tier], messages, stop, kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        async for chunk in abackend_stream(self.tiers[self.default_tier], messages, stop, kwargs):
+            yield chunk
+
+
+def build_backend(spec: dict, clients=None, api_key: str | None = None) -> BaseChatModel:
+    """
+    A backend from its config. With `clients`, a `ClientRegistry`, OpenAI backends
+    send through the registry's shared connection pool for their endpoint and key.
+    """
+    spec = dict(spec)
+    kind = spec.pop("kind", None)
+    match kind:
+        case "openai":
+            from langchain.chat_models import ChatOpenAI
+
+            if api_key is not None:
+                spec["openai_api_key"] = api_key
+            if clients is not None:
+                pool = clients.pool(spec.get("openai_api_base"), api_key)
+                spec.update(pool.openai_clients(api_key, max_retries=spec.get("max_retries", 2)))
+            return ChatOpenAI(**spec)
+        case "fake":
+            return LatencyLLM(**spec)
+    raise ProviderConfigError(f"Unknown backend kind {kind}")
+
+
+def build_router(config: dict, clients=None, api_key: str | None = None) -> ModelRouter:
+    tiers = {}
+    for name, tier in config.get("tiers", {}).items():
+        tier = dict(tier)
+        backends = [build_backend(spec, clients, api_key) for spec in tier.pop("backends", [])]
+        tiers[name] = PooledLLM(backends=backends, tier=name, **tier)
+    if not tiers:
+        raise ProviderConfigError("No model tiers configured")
+    return ModelRouter(
+        tiers=tiers,
+        routes=config.get("routes") or {},
+        default_tier=config.get("default_tier", next(iter(tiers))),
+    )
+
+
+def read_providers(path: str = PROVIDERS_FILE) -> dict:
+    with open(path, "r") as file:
+        return yaml.safe_load(file)
+
+
+def load_providers(path: str = PROVIDERS_FILE) -> ModelRouter:
+    return build_router(read_providers(path))
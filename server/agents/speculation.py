@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+
+from server.agents.conversation import LLMRequest, model_name
+from server.metrics import llm_metrics
+
+logger = logging.getLogger(__name__)
+
+# Called with the tokens a discarded speculative reply cost
+SpentCallback_t = Callable[[int], None]
+
+
+class Speculator:
+    """
+    Generates replies a scene expects to need soon on a small pool of worker
+    threads, while the player is still reading or choosing. A speculative reply is
+    only used for a request with the same cache key, i.e. the exact prompt it was
+    generated from, so using one never changes what the player sees.
+
+    Replies that end up unused are wasted spend, so speculation pauses whenever
+    more than `max_wasted_tokens` were wasted in the last `period` seconds.
+    """
+
+    def __init__(
+        self,
+        workers: int = 0,
+        max_pending: int = 16,
+        max_wasted_tokens: int = 100_000,
+        period: float = 60 * 60,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_wasted_tokens = max_wasted_tokens
+        self.period = period
+        self._executor = (
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speculate")
+            if workers > 0
+            else None
+        )
+        self._lock = threading.Lock()
+        self._pending = 0
+        # (time, tokens) of every discarded reply within `period`
+        self._wasted: deque[tuple[float, int]] = deque()
+        self.stats = {"started": 0, "used": 0, "wasted": 0, "skipped": 0, "wasted_tokens": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self._executor is not None
+
+    def _wasted_recently(self, now: float) -> int:
+        while self._wasted and now - self._wasted[0][0] > self.period:
+            self._wasted.popleft()
+        return sum(tokens for _, tokens in self._wasted)
+
+    def _run(self, request: LLMRequest) -> tuple[str, float]:
+        started = time.perf_counter()
+        try:
+            return request.generate(), time.perf_counter() - started
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def submit(self, request: LLMRequest) -> Future | None:
+        """Starts generating a reply for `request`, unless the pool or the waste cap says no."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if (
+                self._pending >= self.max_pending
+                or self._wasted_recently(time.time()) >= self.max_wasted_tokens
+            ):
+                self.stats["skipped"] += 1
+                return None
+            self._pending += 1
+            self.stats["started"] += 1
+        # Render now, on the caller's thread, so the prompt reflects the memory as it is
+        request.render()
+        return self._executor.submit(copy_context().run, self._run, request)
+
+    def claim(self) -> None:
+        with self._lock:
+            self.stats["used"] += 1
+
+    def discard(
+        self, scene: str, request: LLMRequest, future: Future, on_spent: SpentCallback_t
+    ) -> None:
+        """
+        Gives up on a speculative reply, accounting for whatever it cost. `on_spent`
+        is called once it's known, with 0 if it never got a reply.
+        """
+        if future.cancel():
+            with self._lock:
+                self._pending -= 1
+                self.stats["wasted"] += 1
+            on_spent(0)
+            return
+
+        def account(done: Future) -> None:
+            if done.exception() is not None:
+                on_spent(0)
+                return
+            text, latency = done.result()
+            tokens = request.billable_tokens(text)
+            with self._lock:
+                self.stats["wasted"] += 1
+                self.stats["wasted_tokens"] += tokens
+                self._wasted.append((time.time(), tokens))
+            llm_metrics.observe(
+                request.agent.name,
+                scene,
+                model_name(request.chain.llm),
+                "speculative_wasted",
+                latency,
+                request.prompt_tokens,
+                request.completion_tokens,
+                request.cost,
+            )
+            on_spent(tokens)
+
+        future.add_done_callback(account)
+
+
+speculator = Speculator(
+    workers=int(os.environ.get("SPECULATION_WORKERS", 0)),
+    max_pending=int(os.environ.get("SPECULATION_MAX_PENDING", 16)),
+    max_wasted_tokens=int(os.environ.get("SPECULATION_MAX_WASTED_TOKENS_PER_HOUR", 100_000)),
+)
@@ -0,0 +1,115 @@
+import logging
+import os
+import re
+import threading
+from typing import Protocol
+
+from server.agents.agent import Agent, PlayerAgent
+
+logger = logging.getLogger(__name__)
+
+
+class TurnPolicy(Protocol):
+    def speakers(self, agents: list[Agent], message: str) -> list[Agent]:
+        """The agents that reply to `message`, in the order they speak."""
+        ...
+
+
+class RoundRobin:
+    """Everyone replies, in the order they joined the conversation, starting after the player."""
+
+    def speakers(self, agents: list[Agent], message: str) -> list[Agent]:
+        player = next(
+            (i for i, agent in enumerate(agents) if isinstance(agent, PlayerAgent)), -1
+        )
+        return [
+            agent
+            for agent in agents[player + 1 :] + agents[: max(player, 0)]
+            if not isinstance(agent, PlayerAgent)
+        ]
+
+
+round_robin = RoundRobin()
+
+
+def aliases(agent: Agent) -> set[str]:
+    """The ways a player might address `agent`: full and short name, nickname and surname."""
+    names = {agent.name, agent.short_name}
+    names.update(re.findall(r'"([^"]+)"', agent.name))
+    words = re.sub(r'"[^"]*"', " ", agent.name).split()
+    if len(words) > 1:
+        names.add(words[-1])
+    return {name for name in names if name}
+
+
+class Addressed:
+    """
+    Only the agents the player names reply, in the order they're named and at most
+    `max_replies` of them. When nobody is named, `fallback` decides.
+    """
+
+    def __init__(self, max_replies: int | None = None, fallback: TurnPolicy | None = None):
+        self.max_replies = max_replies
+        self.fallback = fallback if fallback is not None else round_robin
+        # Agent names -> (pattern matching any alias, alias -> agent name)
+        self._matchers: dict[tuple[str, ...], tuple[re.Pattern, dict[str, str]]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"rounds": 0, "addressed_rounds": 0, "calls_avoided": 0}
+
+    def _matcher(self, agents: list[Agent]) -> tuple[re.Pattern, dict[str, str]]:
+        key = tuple(agent.name for agent in agents)
+        matcher = self._matchers.get(key)
+        if matcher is None:
+            owners: dict[str, set[str]] = {}
+            for agent in agents:
+                for alias in aliases(agent):
+                    owners.setdefault(alias.lower(), set()).add(agent.name)
+            # A name shared by several agents addresses none of them
+            unique = {alias: names.pop() for alias, names in owners.items() if len(names) == 1}
+            # Longest first, so "Marshal Flint" wins over "Flint"
+            alternatives = "|".join(re.escape(a) for a in sorted(unique, key=len, reverse=True))
+            pattern = re.compile(rf"\b({alternatives})\b" if unique else r"(?!)", re.IGNORECASE)
+            matcher = self._matchers[key] = (pattern, unique)
+        return matcher
+
+    def addressed(self, agents: list[Agent], message: str) -> list[Agent]:
+        candidates = [agent for agent in agents if not isinstance(agent, PlayerAgent)]
+        pattern, owner = self._matcher(candidates)
+        by_name = {agent.name: agent for agent in candidates}
+        named: list[Agent] = []
+        for match in pattern.finditer(message):
+            agent = by_name[owner[match.group(1).lower()]]
+            if agent not in named:
+                named.append(agent)
+        return named
+
+    def speakers(self, agents: list[Agent], message: str) -> list[Agent]:
+        chosen = self.addressed(agents, message)[: self.max_replies]
+        addressed = bool(chosen)
+        if not addressed:
+            chosen = self.fallback.speakers(agents, message)
+
+        avoided = len(round_robin.speakers(agents, message)) - len(chosen)
+        with self._lock:
+            self.stats["rounds"] += 1
+            self.stats["addressed_rounds"] += addressed
+            self.stats["calls_avoided"] += max(avoided, 0)
+        return chosen
+
+
+def make_turn_policy(name: str, max_replies: int | None = None) -> TurnPolicy:
+    match name:
+        case "round_robin":
+            return RoundRobin()
+        case "addressed":
+            return Addressed(max_replies=max_replies)
+    raise ValueError(f"Unknown turn policy {name}")
+
+
+_max_replies = os.environ.get("TURN_MAX_REPLIES")
+# Used by conversations that aren't given a policy of their own. Letting only the
+# addressed agents reply changes how group scenes play, so it has to be asked for.
+default_turn_policy = make_turn_policy(
+    os.environ.get("TURN_POLICY", "round_robin"),
+    int(_max_replies) if _max_replies else None,
+)
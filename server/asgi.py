@@ -0,0 +1,103 @@
+"""
+ASGI entry point. `/play` runs natively on the event loop so a single process can
+wait on many model calls at once; every other route is served by the regular
+Flask app through a WSGI adapter.
+
+Run with `python run_asgi.py`, or any ASGI server pointed at `server.asgi:application`.
+"""
+
+import asyncio
+import logging
+import re
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.test import EnvironBuilder
+
+from server import app
+from server.routes import play_async
+from server.startup import warm_up
+
+logger = logging.getLogger(__name__)
+
+PLAY_PATH = re.compile(r"/play/(?P<game_id>[^/]+)")
+
+wsgi_application = WsgiToAsgi(app)
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+def build_environ(scope, body: bytes) -> dict:
+    client = scope.get("client") or ("", 0)
+    return EnvironBuilder(
+        path=scope["path"],
+        method=scope["method"],
+        query_string=scope.get("query_string", b"").decode("latin-1"),
+        headers=[
+            (name.decode("latin-1"), value.decode("latin-1"))
+            for name, value in scope["headers"]
+        ],
+        data=body,
+        environ_base={"REMOTE_ADDR": client[0]},
+    ).get_environ()
+
+
+async def play(scope, receive, send, game_id: str) -> None:
+    body = await read_body(receive)
+    # Run inside a real Flask request context so the before/after request hooks
+    # (CORS, rate limiting, sessions) apply exactly as they do to the WSGI routes.
+    with app.request_context(build_environ(scope, body)):
+        try:
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = await play_async(game_id)
+            response = app.make_response(rv)
+        except Exception as error:
+            response = app.make_response(app.handle_exception(error))
+        response = app.process_response(response)
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in response.headers.items()
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": response.get_data()})
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Servers wait for startup to complete before accepting connections. Loading
+            # the content and models blocks, so it's kept off the event loop.
+            await asyncio.to_thread(warm_up)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+
+    if scope["type"] == "http" and scope["method"] == "POST":
+        match = PLAY_PATH.fullmatch(scope["path"])
+        if match is not None:
+            await play(scope, receive, send, match["game_id"])
+            return
+
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,242 @@
+"""
+Drives complete scripted playthroughs through the Flask app, with a number of
+players in parallel, and reports throughput and latency per endpoint.
+
+    python -m server.benchmarks.load_test --players 50 --output bench.json
+
+The model is the `FakeListChatModel` that `/start` uses, so the numbers measure
+the server itself. Results are written as JSON so runs can be compared between
+commits with `--compare previous.json`.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from server import app, game_states
+from server.budget import token_budget
+
+PLAYER_MESSAGE = "Where were you the night Jeb died?"
+
+
+def resident_memory_bytes() -> int:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        # Peak rather than current, but the best portable option. Kilobytes on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def answer(command: dict) -> str | None:
+    """What a scripted player sends in reply to a command."""
+    match command["type"]:
+        case "SelectOptionCommand":
+            return command["options"][0][0]
+        case "MessageCommand":
+            return PLAYER_MESSAGE
+        case "SceneEndCommand":
+            return None
+    return ""
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def call(self, endpoint: str, request, *args, **kwargs):
+        start = time.perf_counter()
+        response = request(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            if response.status_code >= 400:
+                self.errors[endpoint] += 1
+        return response
+
+
+def play_through(recorder: Recorder, max_steps: int, batch: bool = False) -> int:
+    """Plays one game from start to finish. Returns the number of `/play` calls."""
+    with app.test_client() as client:
+        game_id = recorder.call("/start", client.get, "/start").json["game_id"]
+        user_input = None
+        steps = 0
+        for steps in range(1, max_steps + 1):
+            response = recorder.call(
+                "/play",
+                client.post,
+                f"/play/{game_id}",
+                json={"input": user_input, "batch": batch},
+            )
+            if response.status_code != 200:
+                break
+            if batch:
+                command = response.json["responses"][-1]
+            else:
+                command = response.json["response"]
+            if command["is_game_over"]:
+                break
+            user_input = answer(command)
+        recorder.call("/load", client.post, f"/load/{game_id}")
+        recorder.call("/end", client.post, f"/end/{game_id}")
+    return steps
+
+
+def measure_session_memory(sessions: int) -> dict:
+    """
+    Memory per game, for games kept active part way through. Resident memory is
+    what the container sees, but freed memory from earlier games gets reused, so
+    the bytes traced by `tracemalloc` are reported too.
+    """
+    gc.collect()
+    tracemalloc.start()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    before = resident_memory_bytes()
+    game_ids = []
+    with app.test_client() as client:
+        for _ in range(sessions):
+            game_id = client.get("/start").json["game_id"]
+            user_input = None
+            # Get into the first conversation so agents have some memory
+            for _ in range(8):
+                command = client.post(
+                    f"/play/{game_id}", json={"input": user_input}
+                ).json["response"]
+                user_input = answer(command)
+            game_ids.append(game_id)
+        gc.collect()
+        after = resident_memory_bytes()
+        traced_after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        for game_id in game_ids:
+            client.post(f"/end/{game_id}")
+    return {
+        "sessions": sessions,
+        "rss_bytes_per_session": (after - before) / sessions,
+        "traced_bytes_per_session": (traced_after - traced_before) / sessions,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(
+    players: int,
+    concurrency: int,
+    max_steps: int,
+    memory_sessions: int,
+    batch: bool = False,
+) -> dict:
+    # The benchmark is about the server, not the AI allowance
+    token_budget.enabled = False
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        steps = list(
+            pool.map(lambda _: play_through(recorder, max_steps, batch), range(players))
+        )
+    duration = time.perf_counter() - start
+
+    total_requests = sum(len(v) for v in recorder.latencies.values())
+    endpoints = {
+        endpoint: {
+            "requests": len(values),
+            "errors": recorder.errors[endpoint],
+            "mean_ms": statistics.fmean(values) * 1000,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+        }
+        for endpoint, values in sorted(recorder.latencies.items())
+    }
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "players": players,
+        "concurrency": concurrency,
+        "batch": batch,
+        "duration_s": duration,
+        "games_per_s": players / duration,
+        "requests_per_s": total_requests / duration,
+        "plays_per_game": statistics.fmean(steps),
+        "endpoints": endpoints,
+        "session_memory": measure_session_memory(memory_sessions)
+        if memory_sessions
+        else None,
+        "session_storage": dict(game_states.stats),
+    }
+
+
+def compare(current: dict, previous: dict) -> list[str]:
+    lines = []
+    for endpoint, stats in current["endpoints"].items():
+        old = previous.get("endpoints", {}).get(endpoint)
+        if old is None:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            change = (stats[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            lines.append(f"{endpoint} {key}: {old[key]:.2f} -> {stats[key]:.2f} ({change:+.1f}%)")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-steps", type=int, default=400)
+    parser.add_argument("--memory-sessions", type=int, default=50)
+    parser.add_argument(
+        "--batch", action="store_true", help="use batched `/play` requests"
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run(
+        args.players, args.concurrency, args.max_steps, args.memory_sessions, args.batch
+    )
+    print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as file:
+            for line in compare(results, json.load(file)):
+                print(line)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
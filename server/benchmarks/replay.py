@@ -0,0 +1,58 @@
+"""
+Plays recorded games again offline, from the cassettes written when
+`LLM_CASSETTE_DIR` is set, and reports how long each took.
+
+    python -m server.benchmarks.replay games/*.jsonl --timings --speed 10
+
+Without `--timings` the model replies are instant, which measures the server's
+own overhead; with it, each reply takes its recorded time divided by `--speed`.
+"""
+
+import argparse
+import json
+import time
+
+from server.agents.cassette import read_cassette
+from server.budget import token_budget
+from server.game import replay_cassette
+
+
+def replay(path: str, timings: bool, speed: float) -> dict:
+    recorded = [event for event in read_cassette(path) if event["kind"] == "llm"]
+    start = time.perf_counter()
+    session = replay_cassette(path, timings=timings, speed=speed)
+    duration = time.perf_counter() - start
+    return {
+        "cassette": path,
+        "duration_s": duration,
+        "plays": len(session.inputs),
+        "llm_calls": len(session.llm_outputs),
+        "recorded_llm_calls": len(recorded),
+        "recorded_llm_latency_s": sum(event["latency_s"] for event in recorded),
+        "matches_recording": session.llm_outputs == [event["response"] for event in recorded],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("cassettes", nargs="+")
+    parser.add_argument("--timings", action="store_true", help="wait as long as the model originally took")
+    parser.add_argument("--speed", type=float, default=1.0, help="divide recorded timings by this")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    token_budget.enabled = False
+    results = [replay(path, args.timings, args.speed) for path in args.cassettes]
+    for result in results:
+        print(
+            f"{result['cassette']}: {result['plays']} plays, {result['llm_calls']} model calls "
+            f"in {result['duration_s']:.3f}s (recorded model time {result['recorded_llm_latency_s']:.3f}s)"
+            + ("" if result["matches_recording"] else " -- DIVERGED from the recording")
+        )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Measures the memory each active game keeps, at the start of the game and at the
+end of every scene, by playing a number of games side by side.
+
+    python -m server.benchmarks.session_memory --games 200 --budget-kb 40
+
+Games are played directly through `Session`, with a fake model that answers with
+a new string every time, as a real one would, so replies aren't shared between
+games. Exits with an error when a game keeps more than `--budget-kb` at any scene
+boundary.
+"""
+
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+
+from server.commands import Command, MessageCommand, SceneEndCommand, SelectOptionCommand
+from server.game import Session, initialize_game
+
+PLAYER_MESSAGE = "Where were you the night Jeb died?"
+REPLIES = [
+    "Reckon I was at the saloon all night, ask anyone. Whistle poured me three whiskeys.",
+    "Jeb had more enemies than gold, stranger. Ask Miss Clara who he owed money to.",
+    "I don't take kindly to questions like that. [QUIT]",
+]
+# Games a server is sized for, to project the per game numbers to
+CONCURRENT_GAMES = 10_000
+
+
+def fresh_replies_llm():
+    from langchain_community.chat_models import FakeListChatModel
+
+    class FreshReplies(FakeListChatModel):
+        def _call(self, *args, **kwargs) -> str:
+            # A copy, so every game keeps its own replies like with a real model
+            return "".join(list(super()._call(*args, **kwargs)))
+
+    return FreshReplies(responses=REPLIES)
+
+
+def answer(command: Command) -> str | None:
+    match command:
+        case SceneEndCommand():
+            return None
+        case SelectOptionCommand():
+            return command.choices[-1]
+        case MessageCommand():
+            return PLAYER_MESSAGE
+    return ""
+
+
+def play_scene(session: Session, user_input: str | None) -> str | None:
+    """Plays `session` to the end of its current scene. Returns the input the next one starts with."""
+    while True:
+        command = session.play(user_input)
+        user_input = answer(command)
+        if isinstance(command, SceneEndCommand):
+            return user_input
+
+
+def run(games: int = 200) -> dict:
+    llm = fresh_replies_llm()
+    # Play a game through first, so only what the games keep is measured, not
+    # what their first use of each module loads
+    warm = initialize_game(llm=llm)
+    while not warm.is_gameover():
+        play_scene(warm, None)
+    del warm
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [initialize_game(llm=llm) for _ in range(games)]
+    inputs: list[str | None] = [None] * games
+
+    def boundary(scene: str) -> dict:
+        gc.collect()
+        per_game = (tracemalloc.get_traced_memory()[0] - before) / games
+        return {
+            "scene": scene,
+            "bytes_per_session": round(per_game),
+            "projected_mb": round(per_game * CONCURRENT_GAMES / 1e6, 1),
+        }
+
+    boundaries = [boundary("start")]
+    while not sessions[0].is_gameover():
+        scene = sessions[0].scene_name
+        for i, session in enumerate(sessions):
+            inputs[i] = play_scene(session, inputs[i])
+        boundaries.append(boundary(scene))
+    tracemalloc.stop()
+    return {
+        "games": games,
+        "projected_games": CONCURRENT_GAMES,
+        "boundaries": boundaries,
+        "max_bytes_per_session": max(b["bytes_per_session"] for b in boundaries),
+    }
+
+
+def check(results: dict, budget_kb: float | None) -> list[str]:
+    if budget_kb is None or results["max_bytes_per_session"] <= budget_kb * 1000:
+        return []
+    return [
+        f"Games keep up to {results['max_bytes_per_session'] / 1000:.1f}kB, over the {budget_kb:.0f}kB budget"
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--budget-kb", type=float, default=None)
+    args = parser.parse_args()
+
+    results = run(args.games)
+    print(json.dumps(results, indent=2))
+    problems = check(results, args.budget_kb)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
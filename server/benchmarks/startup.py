@@ -0,0 +1,85 @@
+"""
+Measures how long importing the server takes in a fresh interpreter, module by
+module, using `python -X importtime`.
+
+    python -m server.benchmarks.startup --runs 5 --top 15 --budget-ms 1000
+
+Exits with an error when the import takes longer than `--budget-ms`, or loads
+any of the libraries that are meant to wait for `server.startup.warm_up`.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Top level packages `import server` must not load
+DEFERRED = ("langchain", "langchain_core", "langchain_community", "langsmith", "openai", "httpx")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def import_times(module: str) -> dict[str, tuple[int, int]]:
+    """Module name -> (self, cumulative) microseconds, for one fresh import of `module`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def run(module: str = "server", runs: int = 3, top: int = 15) -> dict:
+    # The quickest run is the least disturbed by whatever else the machine is doing
+    times = min((import_times(module) for _ in range(runs)), key=lambda t: t[module][1])
+    slowest = sorted(times.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    return {
+        "module": module,
+        "total_ms": times[module][1] / 1000,
+        "modules_loaded": len(times),
+        "slowest_ms": {name: round(self_us / 1000, 2) for name, (self_us, _) in slowest},
+        "deferred_loaded": sorted(
+            {name.split(".")[0] for name in times if name.split(".")[0] in DEFERRED}
+        ),
+    }
+
+
+def check(results: dict, budget_ms: float | None) -> list[str]:
+    problems = [
+        f"{results['module']} imports {package}, which should wait for warm-up"
+        for package in results["deferred_loaded"]
+    ]
+    if budget_ms is not None and results["total_ms"] > budget_ms:
+        problems.append(
+            f"Importing {results['module']} took {results['total_ms']:.0f}ms, over the {budget_ms:.0f}ms budget"
+        )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--module", default="server")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    args = parser.parse_args()
+
+    results = run(args.module, args.runs, args.top)
+    print(json.dumps(results, indent=2))
+    problems = check(results, args.budget_ms)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
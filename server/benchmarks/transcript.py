@@ -0,0 +1,94 @@
+"""
+Measures the memory each conversation turn allocates and keeps, for the shared
+transcript and for the per-agent message lists it replaced.
+
+    python -m server.benchmarks.transcript --turns 500 --agents 5
+
+A turn is what happens to memory when an agent replies: its history is rendered
+into the prompt, the message it answered is remembered, and the reply is shown to
+everyone in the conversation.
+"""
+
+import argparse
+import gc
+import json
+import tracemalloc
+from collections.abc import Callable
+
+from langchain_core.messages import AIMessage, ChatMessage, HumanMessage, get_buffer_string
+
+from server.agents.memory import Transcript
+
+REPLY = "Reckon I was at the saloon all night, ask anyone. Whistle poured me three whiskeys."
+
+
+def transcript_turns(agents: int) -> Callable[[int], None]:
+    transcript = Transcript()
+    views = [transcript.view(f"Agent {i}", token_budget=10**9) for i in range(agents)]
+    audience = frozenset(view.name for view in views)
+
+    def turn(i: int) -> None:
+        speaker = views[i % agents]
+        speaker.buffer
+        transcript.append("Human", REPLY, speaker.audience)
+        transcript.append(speaker.name, REPLY, audience)
+
+    return turn
+
+
+def message_list_turns(agents: int) -> Callable[[int], None]:
+    """The previous design: every agent keeps its own copy of every message."""
+    histories: list[list] = [[] for _ in range(agents)]
+
+    def turn(i: int) -> None:
+        speaker = histories[i % agents]
+        get_buffer_string(speaker)
+        speaker.append(HumanMessage(content=REPLY))
+        speaker.append(AIMessage(content=REPLY))
+        # The reply was re-labelled by copying the list without its last message
+        histories[i % agents] = speaker[:-1]
+        message = ChatMessage(role=f"Agent {i % agents}", content=REPLY)
+        for history in histories:
+            history.append(message)
+
+    return turn
+
+
+def measure(turn: Callable[[int], None], turns: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    peaks = []
+    for i in range(turns):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        turn(i)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    retained = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return {
+        "turns": turns,
+        "retained_bytes_per_turn": retained / turns,
+        "peak_bytes_per_turn": sum(peaks) / turns,
+        "peak_bytes_last_turn": peaks[-1],
+    }
+
+
+def run(turns: int, agents: int) -> dict:
+    return {
+        "agents": agents,
+        "transcript": measure(transcript_turns(agents), turns),
+        "message_lists": measure(message_list_turns(agents), turns),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--agents", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.turns, args.agents), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Bucket:
+    """A token bucket holding up to `capacity` LLM tokens, refilled evenly over `period` seconds."""
+
+    capacity: float
+    # None means the bucket never refills
+    period: float | None = None
+
+    @property
+    def rate(self) -> float:
+        return 0.0 if self.period is None else self.capacity / self.period
+
+
+class BudgetExceededError(RuntimeError):
+    """Raised when a model call would cost more than one of its buckets has left."""
+
+
+class TokenBudget:
+    """
+    Token buckets for AI usage at global, per-IP and per-game scope. The buckets
+    live in a SQLite file, so every worker process on the machine shares them, and
+    each update is a single transaction.
+
+    Callers `reserve` the tokens a model call is expected to cost before making it,
+    and `charge` the difference to what it actually cost afterwards (a refund if it
+    cost less). Buckets only go negative by how much a reply outgrew its estimate.
+
+    Rows for buckets that have refilled to capacity, or that never refill and have
+    gone unused for `forget_after` seconds (games no longer played), are pruned
+    every `prune_every` seconds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        buckets: dict[str, Bucket],
+        enabled: bool = True,
+        forget_after: float = 2 * 24 * 60 * 60,
+        prune_every: float = 10 * 60,
+    ):
+        self.path = path
+        self.buckets = buckets
+        self.enabled = enabled
+        self.forget_after = forget_after
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._last_prune = time.time()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, sqlite connections can't be shared
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def _level(self, db: sqlite3.Connection, scope: str, key: str, now: float) -> float:
+        bucket = self.buckets[scope]
+        row = db.execute(
+            "SELECT tokens, updated FROM buckets WHERE key = ?", (f"{scope}:{key}",)
+        ).fetchone()
+        if row is None:
+            return bucket.capacity
+        tokens, updated = row
+        return min(bucket.capacity, tokens + (now - updated) * bucket.rate)
+
+    def remaining(self, scopes: dict[str, str]) -> dict[str, float]:
+        now = time.time()
+        db = self._connect()
+        return {
+            scope: self._level(db, scope, key, now)
+            for scope, key in scopes.items()
+            if scope in self.buckets
+        }
+
+    def allows(self, scopes: dict[str, str]) -> bool:
+        """Whether every bucket for `scopes` (e.g. {"ip": ..., "game": ...}) has tokens left."""
+        if not self.enabled:
+            return True
+        exhausted = [scope for scope, level in self.remaining(scopes).items() if level <= 0]
+        if exhausted:
+            logger.warning("AI usage budget exhausted for %s", exhausted)
+        return not exhausted
+
+    def _take(self, scopes: dict[str, str], tokens: float, reserve: bool) -> None:
+        now = time.time()
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            levels = {
+                scope: self._level(db, scope, key, now)
+                for scope, key in scopes.items()
+                if scope in self.buckets
+            }
+            exhausted = [scope for scope, level in levels.items() if level < tokens]
+            if reserve and exhausted:
+                logger.warning("AI usage budget exhausted for %s", exhausted)
+                raise BudgetExceededError(f"AI usage budget exhausted for {exhausted}")
+            for scope, level in levels.items():
+                db.execute(
+                    "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                    (f"{scope}:{scopes[scope]}", level - tokens, now),
+                )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        if now - self._last_prune >= self.prune_every:
+            self.prune(now)
+
+    def reserve(self, scopes: dict[str, str], tokens: int) -> None:
+        """
+        Takes `tokens` from every bucket for `scopes` at once, or raises
+        `BudgetExceededError` without taking any if one of them has fewer left.
+        """
+        if self.enabled:
+            self._take(scopes, tokens, reserve=True)
+
+    def charge(self, scopes: dict[str, str], tokens: int) -> None:
+        """Takes `tokens` from every bucket for `scopes`, however few they have left. Negative refunds."""
+        if self.enabled and tokens != 0:
+            self._take(scopes, tokens, reserve=False)
+
+    def prune(self, now: float | None = None) -> int:
+        """Drops the rows that no longer hold anything a missing row wouldn't. Returns how many."""
+        now = time.time() if now is None else now
+        self._last_prune = now
+        db = self._connect()
+        pruned = 0
+        for scope, bucket in self.buckets.items():
+            if bucket.period is None:
+                cursor = db.execute(
+                    "DELETE FROM buckets WHERE key LIKE ? AND updated < ?",
+                    (f"{scope}:%", now - self.forget_after),
+                )
+            else:
+                cursor = db.execute(
+                    "DELETE FROM buckets WHERE key LIKE ? AND tokens + (? - updated) * ? >= ?",
+                    (f"{scope}:%", now, bucket.rate, bucket.capacity),
+                )
+            pruned += cursor.rowcount
+        if pruned:
+            logger.info("pruned %d stale budget rows", pruned)
+        return pruned
+
+
+@dataclass
+class BudgetAccount:
+    """The buckets one player's model calls are charged to, e.g. {"ip": ..., "game": ...}."""
+
+    budget: TokenBudget
+    scopes: dict[str, str]
+
+    def reserve(self, tokens: int) -> None:
+        self.budget.reserve(self.scopes, tokens)
+
+    def charge(self, tokens: int) -> None:
+        self.budget.charge(self.scopes, tokens)
+
+
+DAY = 24 * 60 * 60
+
+token_budget = TokenBudget(
+    path=os.environ.get(
+        "BUDGET_DB", os.path.join(tempfile.gettempdir(), "rattlesnake-budget.sqlite")
+    ),
+    buckets={
+        "global": Bucket(float(os.environ.get("BUDGET_GLOBAL_TOKENS_PER_DAY", 5_000_000)), DAY),
+        "ip": Bucket(float(os.environ.get("BUDGET_IP_TOKENS_PER_DAY", 500_000)), DAY),
+        "game": Bucket(float(os.environ.get("BUDGET_GAME_TOKENS", 300_000))),
+    },
+    enabled=os.environ.get("BUDGET_ENABLED", "1") != "0",
+    forget_after=float(os.environ.get("BUDGET_FORGET_GAMES_AFTER_SECONDS", 2 * DAY)),
+)
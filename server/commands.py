@@ -1,14 +1,19 @@
-from copy import copy
-from dataclasses import KW_ONLY, dataclass, field
+import weakref
+from dataclasses import KW_ONLY, MISSING, dataclass, field, fields
+from typing import get_args, get_origin
 
+from server.wire import WireError, packb, unpackb
 
-@dataclass(frozen=True, kw_only=True)
+
+# Slotted, as games hold on to many of them. Subclasses override `expects_user_input`
+# by declaring the field again, a plain class attribute wouldn't reach the slot.
+@dataclass(frozen=True, kw_only=True, slots=True, weakref_slot=True)
 class Command:
     is_game_over: bool = False
     expects_user_input: bool = field(default=False, init=False)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class GenericMessageCommand(Command):
     """
     Could add other fields here in the future to further decorate the frontend.
@@ -23,33 +28,33 @@ class GenericMessageCommand(Command):
     character_delay_ms: int = 30
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class SceneEndCommand(GenericMessageCommand):
     pass
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class MessageCommand(GenericMessageCommand):
-    expects_user_input = True
+    expects_user_input: bool = field(default=True, init=False)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class SelectOptionCommand(GenericMessageCommand):
     options: list[tuple[str, str]] = None
-    expects_user_input = True
+    expects_user_input: bool = field(default=True, init=False)
 
     @property
     def choices(self):
         return [x[0] for x in self.options]
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class MessageDelayCommand(GenericMessageCommand):
     delay_ms: int = 1000
 
 
 # For the gunshot
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class SoundDelayCommand(Command):
     sound_name: str
     delay_ms: int
@@ -64,16 +69,176 @@ Commands = (
 )
 
 
+class CommandCodecError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class CommandLayout:
+    """How a command type is encoded, worked out once per type."""
+
+    command_type: type[Command]
+    type_name: str
+    # Registered tag, used instead of the type name in the binary encoding
+    tag: int
+    # Constructor fields in a fixed order: required ones first, then those with defaults
+    fields: tuple[str, ...]
+    defaults: dict
+    expects_user_input: bool
+    # Field name -> function restoring a value that JSON or MessagePack changed,
+    # i.e. tuples that come back as lists
+    decoders: dict
+
+
+# Type tags are part of the binary encoding, so never reuse or renumber one
+_layouts_by_type: dict[type[Command], CommandLayout] = {}
+_layouts_by_name: dict[str, CommandLayout] = {}
+_layouts_by_tag: dict[int, CommandLayout] = {}
+
+
+def _decoder_for(field_type):
+    # Only `list[tuple[...]]` fields, such as the options of a SelectOptionCommand, need one
+    if get_origin(field_type) is list and get_origin(get_args(field_type)[0]) is tuple:
+        return lambda value: None if value is None else [tuple(item) for item in value]
+    return None
+
+
+def register_command(command_type: type[Command], tag: int) -> CommandLayout:
+    if tag in _layouts_by_tag:
+        raise CommandCodecError(
+            f"Tag {tag} is already used by {_layouts_by_tag[tag].type_name}"
+        )
+    init_fields = sorted(
+        (f for f in fields(command_type) if f.init),
+        key=lambda f: (f.default is not MISSING, f.name == "is_game_over"),
+    )
+    defaults = {f.name: f.default for f in init_fields if f.default is not MISSING}
+    expects_user_input = command_type.__dataclass_fields__["expects_user_input"].default
+    defaults["expects_user_input"] = expects_user_input
+    decoders = {
+        f.name: decoder for f in init_fields if (decoder := _decoder_for(f.type)) is not None
+    }
+    layout = CommandLayout(
+        command_type=command_type,
+        type_name=command_type.__name__,
+        tag=tag,
+        fields=tuple(f.name for f in init_fields),
+        defaults=defaults,
+        expects_user_input=expects_user_input,
+        decoders=decoders,
+    )
+    _layouts_by_type[command_type] = layout
+    _layouts_by_name[layout.type_name] = layout
+    _layouts_by_tag[tag] = layout
+    return layout
+
+
+register_command(SoundDelayCommand, 1)
+register_command(MessageDelayCommand, 2)
+register_command(SelectOptionCommand, 3)
+register_command(MessageCommand, 4)
+register_command(SceneEndCommand, 5)
+
+
+def command_layout(command_type: type[Command]) -> CommandLayout:
+    try:
+        return _layouts_by_type[command_type]
+    except KeyError:
+        raise CommandCodecError(f"{command_type.__name__} is not a registered command") from None
+
+
+def command_defaults(command_type: type[Command]) -> dict:
+    """The value every field of `command_type` has unless it's given one."""
+    return command_layout(command_type).defaults
+
+
 def marshal_command(command: Command) -> dict:
-    data = copy(command.__dict__)
+    layout = command_layout(type(command))
+    data = {name: getattr(command, name) for name in layout.fields}
     # Include the expects_user_input field explicitly as it may be otherwise optimized out
-    data["expects_user_input"] = command.expects_user_input
-    data["type"] = command.__class__.__name__
+    data["expects_user_input"] = layout.expects_user_input
+    data["type"] = layout.type_name
+    return data
+
+
+def compact_command(command: Command) -> dict:
+    """Like `marshal_command`, but leaves out every field that has its default value."""
+    layout = command_layout(type(command))
+    data = {"type": layout.type_name}
+    for name in layout.fields:
+        value = getattr(command, name)
+        if name not in layout.defaults or layout.defaults[name] != value:
+            data[name] = value
     return data
 
 
-def unmarshal_command(_: dict) -> Command:
-    raise NotImplementedError()
+def _build(layout: CommandLayout, values: dict) -> Command:
+    for name, decoder in layout.decoders.items():
+        if name in values:
+            values[name] = decoder(values[name])
+    try:
+        return layout.command_type(**values)
+    except TypeError as error:
+        raise CommandCodecError(f"Invalid {layout.type_name}: {error}") from error
+
+
+def unmarshal_command(data: dict) -> Command:
+    """The command `data` was made from, by either `marshal_command` or `compact_command`."""
+    layout = _layouts_by_name.get(data.get("type"))
+    if layout is None:
+        raise CommandCodecError(f"Unknown command type {data.get('type')}")
+    return _build(layout, {name: data[name] for name in layout.fields if name in data})
+
+
+# Encodings of commands that are shown as they are in every game, by id. Entries
+# go with their command, such as when a content reload replaces the scenes, so
+# the id can't be reused by another one while it's here.
+_shared_encodings: dict[int, bytes] = {}
+
+
+def share_command(command: Command) -> Command:
+    """
+    Marks `command` as shown unchanged in many games, such as a scene's fixed text,
+    so every game's event log holds the same encoding of it rather than its own
+    until it's compressed with the events around it.
+    """
+    if id(command) not in _shared_encodings:
+        _shared_encodings[id(command)] = _encode(command)
+        weakref.finalize(command, _shared_encodings.pop, id(command), None)
+    return command
+
+
+def encode_command(command: Command) -> bytes:
+    """
+    A compact binary encoding of `command`: a MessagePack array of the type's tag
+    followed by its field values in layout order, without any trailing defaults.
+    """
+    shared = _shared_encodings.get(id(command))
+    return shared if shared is not None else _encode(command)
+
+
+def _encode(command: Command) -> bytes:
+    layout = command_layout(type(command))
+    values = [getattr(command, name) for name in layout.fields]
+    while values:
+        name = layout.fields[len(values) - 1]
+        if name not in layout.defaults or layout.defaults[name] != values[-1]:
+            break
+        values.pop()
+    return packb([layout.tag, *values])
+
+
+def decode_command(data: bytes) -> Command:
+    try:
+        tag, *values = unpackb(data)
+    except (WireError, TypeError, ValueError) as error:
+        raise CommandCodecError(f"Invalid encoded command: {error}") from error
+    layout = _layouts_by_tag.get(tag)
+    if layout is None:
+        raise CommandCodecError(f"Unknown command tag {tag}")
+    if len(values) > len(layout.fields):
+        raise CommandCodecError(f"Too many values for {layout.type_name}")
+    return _build(layout, dict(zip(layout.fields, values)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+import yaml
+
+from server.scenes.graph import CompiledScene, SceneGraphError, compile_scenes
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+CHARACTER_NAMES = ["flint", "billy", "clara", "whistle"]
+REQUIRED_CHARACTER_KEYS = [
+    "name",
+    "short_name",
+    "subtitle",
+    "long_description",
+    "opinions",
+    "clues",
+    "introduction",
+    "intro_talks_first",
+]
+
+
+class ContentError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class GameContent:
+    """All of the static data a game is built from, loaded and validated once."""
+
+    prompts: dict[str, str]
+    setting: dict[str, str]
+    # Raw character data, in the order the characters appear in a game
+    characters: list[dict]
+    version: int
+    # The scenes of a game in order, compiled from `scenes.yaml`
+    scenes: tuple[CompiledScene, ...] = ()
+
+
+def load_dict(filename: str) -> dict:
+    with open(filename, "r") as file:
+        raw = file.read()
+    return yaml.safe_load(raw)
+
+
+def prefix_stable_prompt(prompt: str) -> str:
+    """
+    `prompt` with the paragraph holding the conversation history moved to just
+    before the message, so everything that never changes for a character comes
+    first and providers can reuse the cached prompt prefix on every turn.
+    """
+    paragraphs = prompt.split("\n\n")
+    history = next((i for i, text in enumerate(paragraphs) if "{{history}}" in text), None)
+    message = next((i for i, text in enumerate(paragraphs) if "{{message}}" in text), None)
+    if history is None or message is None or history >= message - 1:
+        return prompt
+    paragraphs.insert(message - 1, paragraphs.pop(history))
+    return "\n\n".join(paragraphs)
+
+
+def with_prompt_layouts(prompts: dict) -> dict:
+    """`prompts`, plus a `<name>_prefix_stable` variant of each one that has a different one."""
+    variants = {}
+    for name, prompt in prompts.items():
+        if isinstance(prompt, str) and (stable := prefix_stable_prompt(prompt)) != prompt:
+            variants[f"{name}_prefix_stable"] = stable
+    return {**prompts, **variants}
+
+
+def validate_content(prompts: dict, setting: dict, characters: list[dict]) -> None:
+    for name, prompt in prompts.items():
+        if not isinstance(prompt, str):
+            raise ContentError(f"Prompt {name} is not a string")
+    for character in characters:
+        missing = [key for key in REQUIRED_CHARACTER_KEYS if key not in character]
+        if missing:
+            raise ContentError(
+                f"Character {character.get('name')} is missing fields: {missing}"
+            )
+        budget = character.get("memory_token_budget")
+        if budget is not None and (not isinstance(budget, int) or budget <= 0):
+            raise ContentError(
+                f"Character {character['name']} has an invalid memory_token_budget: {budget}"
+            )
+        # Every prompt must be fillable for every character, otherwise the
+        # failure would only show up in the middle of somebody's game.
+        for name, prompt in prompts.items():
+            try:
+                prompt.format(**{**character, **setting})
+            except (KeyError, IndexError) as error:
+                raise ContentError(
+                    f"Prompt {name} can not be formatted for {character['name']}: {error}"
+                ) from error
+
+
+class ContentRegistry:
+    """
+    Process-wide cache of the game data in `server/data`.
+    Files are only re-read when their modification time changes, and the
+    modification times themselves are only checked every `check_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        data_dir: str = DATA_DIR,
+        character_names: list[str] = CHARACTER_NAMES,
+        check_interval: float = 2.0,
+    ):
+        self.data_dir = data_dir
+        self.character_names = character_names
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._content: GameContent | None = None
+        self._mtimes: dict[str, float] = {}
+        self._last_check = 0.0
+
+    @property
+    def files(self) -> list[str]:
+        return [
+            os.path.join(self.data_dir, "prompts.yaml"),
+            os.path.join(self.data_dir, "setting.yaml"),
+            os.path.join(self.data_dir, "scenes.yaml"),
+        ] + [
+            os.path.join(self.data_dir, "characters", f"{name}.yaml")
+            for name in self.character_names
+        ]
+
+    def _read_mtimes(self) -> dict[str, float]:
+        return {path: os.stat(path).st_mtime for path in self.files}
+
+    def _load(self, mtimes: dict[str, float]) -> GameContent:
+        prompts_file, setting_file, scenes_file, *character_files = self.files
+        prompts = with_prompt_layouts(load_dict(prompts_file))
+        setting = load_dict(setting_file)
+        characters = [load_dict(path) for path in character_files]
+        validate_content(prompts, setting, characters)
+        try:
+            scenes = compile_scenes(load_dict(scenes_file), characters)
+        except (SceneGraphError, KeyError, TypeError) as error:
+            raise ContentError(f"Invalid scenes in {scenes_file}: {error}") from error
+
+        version = 1 if self._content is None else self._content.version + 1
+        self._mtimes = mtimes
+        logger.info("Loaded game content version %d from %s", version, self.data_dir)
+        return GameContent(
+            prompts=prompts,
+            setting=setting,
+            characters=characters,
+            version=version,
+            scenes=scenes,
+        )
+
+    def get(self) -> GameContent:
+        now = time.monotonic()
+        if self._content is not None and now - self._last_check < self.check_interval:
+            return self._content
+
+        with self._lock:
+            if self._content is not None and now - self._last_check < self.check_interval:
+                return self._content
+            mtimes = self._read_mtimes()
+            if self._content is None or mtimes != self._mtimes:
+                try:
+                    self._content = self._load(mtimes)
+                except (OSError, yaml.YAMLError, ContentError) as error:
+                    # Keep serving the last good content if an edit broke something
+                    if self._content is None:
+                        raise
+                    logger.error("failed to reload game content. error: %s", error)
+                    self._mtimes = mtimes
+            self._last_check = now
+            return self._content
+
+
+content_registry = ContentRegistry()
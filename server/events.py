@@ -0,0 +1,54 @@
+import zlib
+from dataclasses import dataclass, field
+
+from server.commands import Command, compact_command, decode_command, encode_command
+from server.wire import packb, unpackb
+
+# Events are compressed together in blocks of this many
+EVENT_BLOCK = 32
+
+
+@dataclass(slots=True)
+class EventLog:
+    """
+    Everything the player has been shown, in order. Events are only ever appended,
+    and each one's offset is its position in the log, so a client that has seen
+    everything before some offset only needs the events `since` it.
+
+    Events are kept in the binary encoding of `encode_command`, which stores the
+    text inline and leaves out default values, and are only turned back into
+    compact commands (see `compact_command`) when they're read. Once there are
+    `EVENT_BLOCK` of them they're compressed as one block, since the older events
+    are mostly text that's only read again when a client reloads the game.
+    """
+
+    # Each a zlib compressed MessagePack array of `EVENT_BLOCK` encoded events
+    blocks: list[bytes] = field(default_factory=list)
+    # The events after the last block
+    events: list[bytes] = field(default_factory=list)
+
+    def append(self, command: Command) -> int:
+        """Adds `command` to the log and returns its offset."""
+        offset = self.cursor
+        self.events.append(encode_command(command))
+        if len(self.events) == EVENT_BLOCK:
+            self.blocks.append(zlib.compress(packb(self.events)))
+            self.events = []
+        return offset
+
+    @property
+    def cursor(self) -> int:
+        """The offset the next event will get."""
+        return len(self.blocks) * EVENT_BLOCK + len(self.events)
+
+    def since(self, offset: int) -> list[dict]:
+        offset = max(offset, 0)
+        first = min(offset // EVENT_BLOCK, len(self.blocks))
+        events = [
+            event for block in self.blocks[first:] for event in unpackb(zlib.decompress(block))
+        ]
+        events += self.events
+        return [compact_command(decode_command(event)) for event in events[offset - first * EVENT_BLOCK :]]
+
+    def __len__(self) -> int:
+        return self.cursor
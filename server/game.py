@@ -1,37 +1,174 @@
-import server.scenes.rattlesnake_ridge
-from server.scenes.core import Scene_t, UserInput_t, GameData
-from server.commands import Command, SceneEndCommand, MessageCommand, SelectOptionCommand, marshal_command
-from server.agents.conversation import LLM_t, PlayerAgent, Agent
-import yaml
-import logging
+from __future__ import annotations
 
-import yaml
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING
 
-from server.agents.conversation import Agent, LLM_t, PlayerAgent
+from server.agents.cache import response_cache
+from server.agents.conversation import (
+    Agent,
+    LLMRequest,
+    ParallelRequests,
+    PlayerAgent,
+    Speculation,
+    TokenCallback_t,
+    model_name,
+)
+from server.agents.memory import Transcript
+from server.agents.speculation import SpentCallback_t, Speculator, speculator
+from server.budget import BudgetAccount, BudgetExceededError
 from server.commands import (
     Command,
     MessageCommand,
     SceneEndCommand,
     SelectOptionCommand,
 )
-from server.scenes import *
+from server.content import GameContent, content_registry
+from server.events import EventLog
+from server.logs import log_context
+from server.metrics import UsageMetrics, llm_metrics
+from server.scenes.core import GameData, Scene_t, UserInput_t
+
+if TYPE_CHECKING:
+    from server.agents.cassette import CassetteRecorder
+    from server.agents.conversation import LLM_t
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on the commands returned by one batched play
+MAX_BATCH_SIZE = 64
+
+# Generates the replies of conversations in parallel reactions mode
+reaction_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("REACTION_WORKERS", 16)), thread_name_prefix="reactions"
+)
+
+
+# A speculative reply in the making, and what to call with the tokens it cost
+Speculative_t = tuple[LLMRequest, Future, SpentCallback_t]
+
+
+class CheckpointError(ValueError):
+    pass
+
+
+class SessionBusyError(RuntimeError):
+    """Raised when a game is played while another request is still playing it."""
+
+
+@dataclass
+class Checkpoint:
+    """
+    Everything needed to rebuild a session: the input of every `play` call and the
+    raw text of every model reply, in order. Replaying the inputs while serving the
+    recorded replies deterministically walks the scenes back to the same point.
+    """
+
+    scene_index: int
+    inputs: list[UserInput_t] = field(default_factory=list)
+    outputs: list[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Checkpoint":
+        return cls(
+            scene_index=data["scene_index"],
+            inputs=list(data["inputs"]),
+            outputs=list(data["outputs"]),
+        )
+
+
+def default_scenes() -> tuple[Scene_t, ...]:
+    """The scenes of a game, in order, as compiled from `server/data/scenes.yaml`."""
+    return content_registry.get().scenes
+
 
 class Session:
-    scene_stack: list[Scene_t] = server.scenes.rattlesnake_ridge.SCENE_ORDER
-    last_scene_output : Command | None = None
+    # Thousands of games are held at once, so sessions keep no per instance dict
+    __slots__ = (
+        "llm",
+        "player",
+        "prompts",
+        "setting",
+        "actors",
+        "logs",
+        "gameover",
+        "scene_index",
+        "inputs",
+        "llm_outputs",
+        "_replay",
+        "usage",
+        "tokens_spent",
+        "_spent_lock",
+        "speculator",
+        "_speculative",
+        "cassette",
+        "scene_stack",
+        "current_scene",
+        "scene_name",
+        "scene_started",
+        "last_scene_output",
+        "_playing",
+        "_account",
+        "_resume",
+        "_play_outputs",
+    )
 
-    def __init__(self, llm: LLM_t, prompts, setting, actors):
+    def __init__(
+        self,
+        llm: LLM_t,
+        prompts,
+        setting,
+        actors,
+        speculator: Speculator = speculator,
+        transcript: Transcript | None = None,
+        scenes: tuple[Scene_t, ...] | None = None,
+    ):
         self.llm = llm
-        self.player = PlayerAgent()
+        self.player = PlayerAgent(transcript)
         self.prompts = prompts
         self.setting = setting
         self.actors = actors
-        self.logs = []
+        self.logs = EventLog()
         self.gameover = False
+        self.scene_index = -1
+        # Recorded for checkpoints
+        self.inputs: list[UserInput_t] = []
+        self.llm_outputs: list[str] = []
+        # Replies to serve instead of calling the model while restoring. Only
+        # restored games get a deque.
+        self._replay: deque[str] | tuple = ()
+        # Model usage of this game alone; see `server.metrics.llm_metrics` for all games
+        self.usage = UsageMetrics(histogram=False)
+        # Model tokens this game has cost, for budgets
+        self.tokens_spent = 0
+        self._spent_lock = threading.Lock()
+        # Replies generated ahead of time, by cache key
+        self.speculator = speculator
+        self._speculative: dict[str, Speculative_t] = {}
+        # Records inputs and model replies when set, see `replay_cassette`
+        self.cassette: CassetteRecorder | None = None
+        self.last_scene_output: Command | None = None
+        # Held for the whole of a play, so two requests can't both drive the scene
+        self._playing = threading.Lock()
+        # Charged for the model calls of the play in progress, if anything is
+        self._account: BudgetAccount | None = None
+        # The step a play was refused budget at, for the next play to pick up, and
+        # how many replies were recorded before that play started
+        self._resume: LLMRequest | ParallelRequests | None = None
+        self._play_outputs = 0
 
+        self.scene_stack = tuple(scenes) if scenes is not None else default_scenes()
         self.start_next_scene()
 
     @property
@@ -51,43 +188,370 @@ class Session:
         next_scene = self.scene_stack[0]
         self.scene_stack = self.scene_stack[1:]
         self.current_scene = next_scene(self.game_data)
+        self.scene_name = next_scene.name
         self.scene_started = False
+        self.scene_index += 1
 
     def is_gameover(self) -> bool:
         return self.gameover
 
-    def play(self, user_input: str) -> Command:
-        if self.is_gameover():
-            logger.warn("User attempted to play a game that has finished")
-            return SceneEndCommand("The game is over.", is_game_over=True)
+    def _observe(self, request: LLMRequest, source: str, latency: float, text: str) -> None:
+        if self.cassette is not None:
+            self.cassette.record_call(request, text, self.scene_name, source, latency)
+        labels = (request.agent.name, self.scene_name, model_name(request.chain.llm), source)
+        usage = (request.prompt_tokens, request.completion_tokens, request.cost)
+        llm_metrics.observe(*labels, latency, *usage)
+        self.usage.observe(*labels, latency, *usage)
 
-        if not self.scene_started:
-            if user_input is not None:
-                logger.warn(
-                    'got user input "%s" at the beginning of a scene. Expected `None` input.',
-                    user_input,
-                )
+    def _speculate(self, speculation: Speculation) -> None:
+        if self._replay or not self.speculator.enabled:
+            return
+        self._discard_speculation()
+        for request in speculation.requests:
+            if response_cache.is_cacheable(request.render()[1]) and response_cache.contains(
+                request.cache_key
+            ):
+                continue
             try:
-                resp = next(self.current_scene)
+                spent = self._reserve(request)
+            except BudgetExceededError:
+                # Guessing ahead is the first thing to go when the budget runs low
+                break
+            future = self.speculator.submit(request)
+            if future is None:
+                spent(0)
+            else:
+                self._speculative[request.cache_key] = (request, future, spent)
+
+    def _add_spent(self, tokens: int) -> None:
+        # Also called from worker threads
+        with self._spent_lock:
+            self.tokens_spent += tokens
+
+    def _reserve(self, request: LLMRequest) -> SpentCallback_t:
+        """
+        Reserves budget for calling the model for `request`, and returns what to call
+        with the tokens the call actually cost. Raises `BudgetExceededError` if the
+        account charged for this play hasn't got room for it.
+        """
+        account = self._account
+        if account is None:
+            return self._add_spent
+        reserved = request.expected_tokens()
+        account.reserve(reserved)
+
+        def spent(tokens: int) -> None:
+            # Whatever the estimate was off by, either way
+            account.charge(tokens - reserved)
+            self._add_spent(tokens)
+
+        return spent
+
+    def _discard_speculation(self) -> None:
+        for request, future, spent in self._speculative.values():
+            self.speculator.discard(self.scene_name, request, future, spent)
+        self._speculative.clear()
+
+    def _claim_speculation(self, request: LLMRequest) -> Speculative_t | None:
+        """The speculative reply generated for exactly this request, if any. Drops the rest."""
+        if not self._speculative:
+            return None
+        claimed = self._speculative.pop(request.cache_key, None)
+        self._discard_speculation()
+        if claimed is not None:
+            self.speculator.claim()
+        return claimed
+
+    def _use_speculation(self, request: LLMRequest, claimed: Speculative_t) -> str:
+        speculative, future, spent = claimed
+        text = future.result()[0]
+        request.prompt_tokens = speculative.prompt_tokens
+        request.completion_tokens = speculative.completion_tokens
+        request.cost = speculative.cost
+        request.to_cache(response_cache, text)
+        spent(request.billable_tokens(text))
+        return text
+
+    def _ready_reply(self, request: LLMRequest, claimed: Speculative_t | None) -> tuple[str, str] | None:
+        """The reply to `request` and where it came from, if a speculative guess or the cache has it."""
+        if claimed is not None and claimed[1].exception() is not None:
+            # Its reservation goes back, and the model is called instead
+            claimed[2](0)
+            claimed = None
+        if claimed is not None:
+            return self._use_speculation(request, claimed), "speculative"
+        if (text := request.cached(response_cache)) is not None:
+            return text, "cache"
+        return None
+
+    def _generated(self, request: LLMRequest, spent: SpentCallback_t, text: str) -> str:
+        request.to_cache(response_cache, text)
+        spent(request.billable_tokens(text))
+        return text
+
+    def _produce(
+        self,
+        request: LLMRequest,
+        on_token: TokenCallback_t | None,
+        claimed: Speculative_t | None,
+    ) -> str:
+        """The reply to `request` from a speculative guess, the cache or the model."""
+        with log_context(agent=request.agent.name):
+            started = time.perf_counter()
+            ready = self._ready_reply(request, claimed)
+            if ready is not None:
+                text, source = ready
+                if on_token is not None:
+                    on_token(request.agent.name, text)
+            else:
+                source, spent = "model", self._reserve(request)
+                try:
+                    if on_token is not None:
+                        text = request.generate_stream(on_token)
+                    else:
+                        text = request.generate()
+                except BaseException:
+                    spent(0)
+                    raise
+                self._generated(request, spent, text)
+            self._observe(request, source, time.perf_counter() - started, text)
+            return text
+
+    async def _aproduce(self, request: LLMRequest, claimed: Speculative_t | None) -> str:
+        # The budget's database calls block, so they're made in a worker thread
+        with log_context(agent=request.agent.name):
+            started = time.perf_counter()
+            if claimed is not None:
+                try:
+                    await asyncio.wrap_future(claimed[1])
+                except Exception as error:
+                    logger.warning("speculative reply failed, calling the model. error: %s", error)
+            ready = await asyncio.to_thread(self._ready_reply, request, claimed)
+            if ready is not None:
+                text, source = ready
+            else:
+                source, spent = "model", await asyncio.to_thread(self._reserve, request)
+                try:
+                    text = await request.agenerate()
+                except BaseException:
+                    await asyncio.to_thread(spent, 0)
+                    raise
+                await asyncio.to_thread(self._generated, request, spent, text)
+            self._observe(request, source, time.perf_counter() - started, text)
+            return text
+
+    def _commit(self, request: LLMRequest, text: str) -> str:
+        request.replay(text)
+        self.llm_outputs.append(text)
+        return text
+
+    def _fulfil(self, request: LLMRequest, on_token: TokenCallback_t | None) -> str:
+        if self._replay:
+            return self._commit(request, self._replay.popleft())
+        return self._commit(request, self._produce(request, on_token, self._claim_speculation(request)))
+
+    async def _afulfil(self, request: LLMRequest) -> str:
+        if self._replay:
+            return self._commit(request, self._replay.popleft())
+        return self._commit(request, await self._aproduce(request, self._claim_speculation(request)))
+
+    def _prepare_all(
+        self, requests: list[LLMRequest], claimed: list[Speculative_t | None]
+    ) -> tuple[list[tuple[str, str, float] | None], dict[int, SpentCallback_t]]:
+        """
+        The replies already at hand, with where they came from and how long they took,
+        and the budget reserved for the model calls the rest need. Reserves for all of
+        them or none, so a refused play doesn't leave some of the calls made.
+        """
+        ready: list[tuple[str, str, float] | None] = []
+        for request, claim in zip(requests, claimed):
+            started = time.perf_counter()
+            reply = self._ready_reply(request, claim)
+            ready.append(None if reply is None else (*reply, time.perf_counter() - started))
+        reserved: dict[int, SpentCallback_t] = {}
+        try:
+            for i, request in enumerate(requests):
+                if ready[i] is None:
+                    reserved[i] = self._reserve(request)
+        except BudgetExceededError:
+            for spent in reserved.values():
+                spent(0)
+            raise
+        return ready, reserved
+
+    def _settle_all(
+        self,
+        requests: list[LLMRequest],
+        ready: list[tuple[str, str, float] | None],
+        reserved: dict[int, SpentCallback_t],
+        generated: dict[int, tuple[str, float] | BaseException],
+    ) -> list[str]:
+        """Accounts for the model calls, then observes every reply in request order."""
+        failure = None
+        for i, result in generated.items():
+            if isinstance(result, BaseException):
+                reserved[i](0)
+                failure = failure or result
+            else:
+                self._generated(requests[i], reserved[i], result[0])
+                ready[i] = (result[0], "model", result[1])
+        if failure is not None:
+            raise failure
+        for request, (text, source, latency) in zip(requests, ready):
+            with log_context(agent=request.agent.name):
+                self._observe(request, source, latency, text)
+        return [text for text, _, _ in ready]
+
+    def _generate_timed(self, request: LLMRequest) -> tuple[str, float]:
+        with log_context(agent=request.agent.name):
+            started = time.perf_counter()
+            text = request.generate()
+            return text, time.perf_counter() - started
+
+    def _fulfil_all(self, parallel: ParallelRequests, on_token: TokenCallback_t | None) -> list[str]:
+        """
+        Produces the replies to independent requests concurrently, then commits them in
+        request order, so memories and checkpoints don't depend on which finished first.
+        Only the model calls are made on other threads. Replies are observed, recorded
+        and streamed here, in request order, each as a whole.
+        """
+        requests = parallel.requests
+        if self._replay or len(requests) < 2:
+            return [self._fulfil(request, on_token) for request in requests]
+        claimed = [self._claim_speculation(request) for request in requests]
+        ready, reserved = self._prepare_all(requests, claimed)
+        futures = {
+            # Logged with the game and scene they're made for
+            i: reaction_pool.submit(copy_context().run, self._generate_timed, requests[i])
+            for i in reserved
+        }
+        generated: dict[int, tuple[str, float] | BaseException] = {}
+        for i, future in futures.items():
+            try:
+                generated[i] = future.result()
             except Exception as error:
-                logger.error(
-                    "failed to get the next command from current scene. error: %s",
-                    error,
-                )
-                self.gameover = True
-                raise error
+                generated[i] = error
+        texts = self._settle_all(requests, ready, reserved, generated)
+        if on_token is not None:
+            for request, text in zip(requests, texts):
+                on_token(request.agent.name, text)
+        return [self._commit(request, text) for request, text in zip(requests, texts)]
+
+    async def _agenerate_timed(self, request: LLMRequest) -> tuple[str, float]:
+        with log_context(agent=request.agent.name):
+            started = time.perf_counter()
+            text = await request.agenerate()
+            return text, time.perf_counter() - started
+
+    async def _afulfil_all(self, parallel: ParallelRequests) -> list[str]:
+        requests = parallel.requests
+        if self._replay or len(requests) < 2:
+            return [await self._afulfil(request) for request in requests]
+        claimed = [self._claim_speculation(request) for request in requests]
+        for claim in claimed:
+            if claim is not None:
+                await asyncio.wait([asyncio.wrap_future(claim[1])])
+        ready, reserved = await asyncio.to_thread(self._prepare_all, requests, claimed)
+        indices = list(reserved)
+        results = await asyncio.gather(
+            *(self._agenerate_timed(requests[i]) for i in indices), return_exceptions=True
+        )
+        texts = await asyncio.to_thread(
+            self._settle_all, requests, ready, reserved, dict(zip(indices, results))
+        )
+        return [self._commit(request, text) for request, text in zip(requests, texts)]
+
+    def _first_step(self, user_input: UserInput_t) -> Command | LLMRequest:
+        if self._resume is not None:
+            # The scene is still waiting for the replies a refused play didn't get
+            step, self._resume = self._resume, None
+            return step
+        if not self.scene_started:
             self.scene_started = True
-        else:
+            return next(self.current_scene)
+        return self.current_scene.send(user_input)
+
+    def _advance(
+        self, user_input: UserInput_t, on_token: TokenCallback_t | None
+    ) -> Command:
+        """Runs the current scene up to the next command, fulfilling any model calls on the way."""
+        step = self._first_step(user_input)
+        while isinstance(step, (LLMRequest, ParallelRequests, Speculation)):
             try:
-                resp = self.current_scene.send(user_input)
-            except Exception as error:
-                logger.error(
-                    "failed to get the next command from current scene. error: %s",
-                    error,
-                )
-                self.gameover = True
-                raise error
+                match step:
+                    case Speculation():
+                        self._speculate(step)
+                        reply = None
+                    case ParallelRequests():
+                        reply = self._fulfil_all(step, on_token)
+                    case _:
+                        reply = self._fulfil(step, on_token)
+            except BudgetExceededError:
+                self._resume = step
+                raise
+            step = self.current_scene.send(reply)
+        return step
+
+    async def _aadvance(self, user_input: UserInput_t) -> Command:
+        step = self._first_step(user_input)
+        while isinstance(step, (LLMRequest, ParallelRequests, Speculation)):
+            try:
+                match step:
+                    case Speculation():
+                        await asyncio.to_thread(self._speculate, step)
+                        reply = None
+                    case ParallelRequests():
+                        reply = await self._afulfil_all(step)
+                    case _:
+                        reply = await self._afulfil(step)
+            except BudgetExceededError:
+                self._resume = step
+                raise
+            step = self.current_scene.send(reply)
+        return step
 
+    def checkpoint(self) -> Checkpoint:
+        inputs, outputs = self.inputs, self.llm_outputs
+        if self._resume is not None:
+            # Taken as if a refused play never started; the player sends it again
+            inputs, outputs = inputs[:-1], outputs[: self._play_outputs]
+        return Checkpoint(
+            scene_index=self.scene_index,
+            inputs=list(inputs),
+            outputs=list(outputs),
+        )
+
+    def _before_play(self, user_input: UserInput_t) -> Command | None:
+        """Returns a command to answer with straight away if the game can't be played."""
+        if self.is_gameover():
+            logger.warn("User attempted to play a game that has finished")
+            return SceneEndCommand("The game is over.", is_game_over=True)
+        if self._resume is not None:
+            # Picks up a play that was refused budget, with the input recorded for it.
+            # Whatever was sent this time is dropped, the scene never sees it.
+            if user_input != self.inputs[-1]:
+                logger.info('dropped input "%s" while resuming a refused play', user_input)
+            return None
+
+        self._play_outputs = len(self.llm_outputs)
+        self.inputs.append(user_input)
+        if self.cassette is not None:
+            self.cassette.record_input(user_input)
+        if not self.scene_started and user_input is not None:
+            logger.warn(
+                'got user input "%s" at the beginning of a scene. Expected `None` input.',
+                user_input,
+            )
+        return None
+
+    def _failed_play(self, error: Exception) -> None:
+        logger.error(
+            "failed to get the next command from current scene. error: %s",
+            error,
+        )
+        self.gameover = True
+
+    def _after_play(self, resp: Command) -> Command:
         if isinstance(resp, SceneEndCommand):
             self.start_next_scene()
 
@@ -96,11 +560,108 @@ class Session:
             self.gameover = True
 
         self.last_scene_output = resp
-        if user_input != "":
-            self.logs.append(marshal_command(MessageCommand(f"You: {user_input}")))
-        self.logs.append(marshal_command(resp))
+        # The input the scene acted on, which is the recorded one when a play resumed
+        played = self.inputs[-1]
+        if played != "":
+            self.logs.append(MessageCommand(f"You: {played}"))
+        self.logs.append(resp)
         return resp
 
+    @contextmanager
+    def _exclusive(self, account: BudgetAccount | None):
+        # Interleaving two plays on one scene would feed one's input to the other as a model reply
+        if not self._playing.acquire(blocking=False):
+            raise SessionBusyError("the game is already being played by another request")
+        self._account = account
+        try:
+            yield
+        finally:
+            self._account = None
+            self._playing.release()
+
+    def play(
+        self,
+        user_input: str,
+        on_token: TokenCallback_t | None = None,
+        account: BudgetAccount | None = None,
+    ) -> Command:
+        """
+        Advances the game by one command. If `on_token` is given, model replies
+        generated along the way are streamed to it token by token. Raises
+        `SessionBusyError` if the game is already being played.
+
+        Every model call is reserved from and charged to `account`, if given. When it
+        has no room left, `BudgetExceededError` is raised and the scene waits where
+        it is, for the next play to carry on from there.
+        """
+        with self._exclusive(account):
+            return self._play(user_input, on_token)
+
+    def _play(self, user_input: str, on_token: TokenCallback_t | None) -> Command:
+        with log_context(scene=self.scene_name):
+            if (early := self._before_play(user_input)) is not None:
+                return early
+            try:
+                resp = self._advance(user_input, on_token)
+            except BudgetExceededError:
+                raise
+            except Exception as error:
+                self._failed_play(error)
+                raise error
+            return self._after_play(resp)
+
+    async def aplay(self, user_input: str, account: BudgetAccount | None = None) -> Command:
+        """Same as `play`, but awaits the model instead of blocking on it."""
+        with self._exclusive(account):
+            return await self._aplay(user_input)
+
+    async def _aplay(self, user_input: str) -> Command:
+        with log_context(scene=self.scene_name):
+            if (early := self._before_play(user_input)) is not None:
+                return early
+            try:
+                resp = await self._aadvance(user_input)
+            except BudgetExceededError:
+                raise
+            except Exception as error:
+                self._failed_play(error)
+                raise error
+            return self._after_play(resp)
+
+    def _ends_batch(self, command: Command, size: int) -> bool:
+        return (
+            command.expects_user_input
+            or isinstance(command, SceneEndCommand)
+            or self.is_gameover()
+            or size >= MAX_BATCH_SIZE
+        )
+
+    def play_batch(
+        self,
+        user_input: str,
+        on_token: TokenCallback_t | None = None,
+        account: BudgetAccount | None = None,
+    ) -> list[Command]:
+        """
+        Plays on until the player has something to do: a command that expects input,
+        the end of a scene, or the end of the game. Returns every command on the way,
+        in order, so the client can pace them itself.
+        """
+        with self._exclusive(account):
+            commands = [self._play(user_input, on_token)]
+            while not self._ends_batch(commands[-1], len(commands)):
+                commands.append(self._play("", on_token))
+        return commands
+
+    async def aplay_batch(
+        self, user_input: str, account: BudgetAccount | None = None
+    ) -> list[Command]:
+        with self._exclusive(account):
+            commands = [await self._aplay(user_input)]
+            while not self._ends_batch(commands[-1], len(commands)):
+                commands.append(await self._aplay(""))
+        return commands
+
     def is_input_valid(self, user_input: UserInput_t) -> bool:
         """Check that the user input is valid given the last command sent."""
         if self.last_scene_output is None:
@@ -115,27 +676,87 @@ class Session:
         return True
 
 
-def load_dict(filename: str) -> dict:
-    with open(filename, "r") as file:
-        raw = file.read()
-    return yaml.safe_load(raw)
+def initialize_game(llm: LLM_t = None, content: GameContent | None = None) -> Session:
+    if content is None:
+        content = content_registry.get()
 
+    # Create the actors. The raw character data is shared between games, only
+    # the agents' memories are per game.
+    transcript = Transcript()
+    actors = [Agent(data=data, transcript=transcript) for data in content.characters]
 
-def initialize_game(llm: LLM_t = None) -> Session:
-    data_dir = "server/data/"
+    logger.info("Initialized a new game")
+    return Session(
+        llm=llm,
+        prompts=content.prompts,
+        setting=content.setting,
+        actors=actors,
+        transcript=transcript,
+        scenes=content.scenes,
+    )
 
-    prompts = load_dict(data_dir + "prompts.yaml")
-    setting = load_dict(data_dir + "setting.yaml")
 
-    # Create the actors
-    character_names = ["flint", "billy", "clara", "whistle"]
-    actors = [
-        Agent(datafile=data_dir + f"characters/{name}.yaml") for name in character_names
-    ]
+def restore_game(
+    checkpoint: Checkpoint, llm: LLM_t = None, content: GameContent | None = None
+) -> Session:
+    """Rebuilds a session from a checkpoint without calling the model."""
+    session = initialize_game(llm=llm, content=content)
+    session._replay = deque(checkpoint.outputs)
+    for user_input in checkpoint.inputs:
+        session.play(user_input)
 
-    logger.info("Initialized a new game")
-    return Session(llm=llm, prompts=prompts, setting=setting, actors=actors)
+    if session._replay or session.scene_index != checkpoint.scene_index:
+        raise CheckpointError(
+            "replaying the checkpoint did not end where it was taken, the game content may have changed"
+        )
+    return session
+
+
+def replay_cassette(
+    path: str,
+    timings: bool = False,
+    speed: float = 1.0,
+    content: GameContent | None = None,
+) -> Session:
+    """
+    Plays a recorded game again with the recorded player inputs and model replies,
+    without any network access. With `timings`, replies take as long as they did
+    when recorded, divided by `speed`.
+    """
+    from server.agents.cassette import ReplayLLM, read_cassette
+
+    llm = ReplayLLM.from_file(path, timings=timings, speed=speed)
+    session = initialize_game(llm=llm, content=content)
+    # Only the replies the game actually used were recorded
+    session.speculator = Speculator()
+    for event in read_cassette(path):
+        if event["kind"] == "input":
+            session.play(event["input"])
+    return session
+
+
+def play_game(
+    session: Session,
+    user_input: str,
+    on_token: TokenCallback_t | None = None,
+    account: BudgetAccount | None = None,
+) -> Command:
+    return session.play(user_input, on_token, account)
+
+
+async def aplay_game(
+    session: Session, user_input: str, account: BudgetAccount | None = None
+) -> Command:
+    return await session.aplay(user_input, account)
+
+
+def play_game_batch(
+    session: Session, user_input: str, account: BudgetAccount | None = None
+) -> list[Command]:
+    return session.play_batch(user_input, account=account)
 
 
-def play_game(session: Session, user_input: str) -> Command:
-    return session.play(user_input)
+async def aplay_game_batch(
+    session: Session, user_input: str, account: BudgetAccount | None = None
+) -> list[Command]:
+    return await session.aplay_batch(user_input, account)
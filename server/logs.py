@@ -0,0 +1,147 @@
+"""
+Logging that never makes a request wait on disk. Records are handed to a queue on
+the thread that logs them and written by a background listener, as JSON lines
+carrying the game, scene and agent they came from.
+"""
+
+import atexit
+import copy
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+# Fields added to every record logged while they're set, see `log_context`
+CONTEXT_FIELDS = ("game_id", "scene", "agent")
+
+# Keep one in this many DEBUG records of each logger
+DEBUG_SAMPLE_RATE = int(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "10"))
+# Records waiting to be written. Any more are dropped rather than waited for.
+QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
+_context: ContextVar[dict] = ContextVar("log_context", default={})
+
+
+def bind_log_context(**fields) -> None:
+    """Replaces the fields logged for the rest of the current context, such as a request."""
+    _context.set(fields)
+
+
+@contextmanager
+def log_context(**fields):
+    """Adds `fields` to everything logged inside the block."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current log context onto records. Runs on the thread that logged them."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """Lets through every record above DEBUG, and one in `rate` DEBUG records of each logger."""
+
+    def __init__(self, rate: int = DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = max(rate, 1)
+        self._counters: dict[str, itertools.count] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate == 1:
+            return True
+        counter = self._counters.setdefault(record.name, itertools.count())
+        return next(counter) % self.rate == 0
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                line[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line["exception"] = record.exc_text
+        return json.dumps(line, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queues records for a `QueueListener`, dropping them when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formats the message and traceback now, while the arguments are as logged,
+        # but leaves the formatting of the line to the listener's handlers
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(
+    path: str = "server.log",
+    console_level: int = logging.WARNING,
+    file_level: int = logging.DEBUG,
+    debug_sample_rate: int = DEBUG_SAMPLE_RATE,
+    queue_size: int = QUEUE_SIZE,
+    logger: logging.Logger | None = None,
+) -> logging.handlers.QueueListener:
+    """
+    Sends everything logged to `logger`, the root logger by default, through a queue
+    to the console and to `path` as JSON lines. Returns the running listener.
+    """
+    logger = logger if logger is not None else logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+
+    console = logging.StreamHandler()
+    console.setLevel(console_level)
+    console.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    file = logging.FileHandler(path, mode="a", encoding="utf-8")
+    file.setLevel(file_level)
+    file.setFormatter(JsonFormatter())
+
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(DebugSampler(debug_sample_rate))
+    handler.addFilter(ContextFilter())
+    logger.addHandler(handler)
+
+    listener = logging.handlers.QueueListener(log_queue, console, file, respect_handler_level=True)
+    listener.start()
+    # Writes out whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,158 @@
+import bisect
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+@dataclass(slots=True)
+class LLMUsage:
+    calls: int = 0
+    latency_s: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    # Count per bucket in LATENCY_BUCKETS, plus one for anything slower
+    latency_buckets: list[int] = field(
+        default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1)
+    )
+
+    def add(self, latency: float, prompt_tokens: int, completion_tokens: int, cost: float):
+        self.calls += 1
+        self.latency_s += latency
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost += cost
+        if self.latency_buckets:
+            self.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def summary(self) -> dict:
+        return {
+            "calls": self.calls,
+            "latency_s": round(self.latency_s, 4),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost": self.cost,
+        }
+
+
+# (agent, scene, model, source) where source is "model" or "cache"
+UsageKey_t = tuple[str, str, str, str]
+
+
+class UsageMetrics:
+    """
+    LLM usage aggregated by agent, scene, model and where the reply came from.
+    Without `histogram`, latencies are only summed, which is all a single game needs.
+    """
+
+    def __init__(self, histogram: bool = True):
+        self._usage: dict[UsageKey_t, LLMUsage] = defaultdict(
+            LLMUsage if histogram else lambda: LLMUsage(latency_buckets=[])
+        )
+        self._lock = threading.Lock()
+
+    def observe(
+        self,
+        agent: str,
+        scene: str,
+        model: str,
+        source: str,
+        latency: float,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cost: float = 0.0,
+    ) -> None:
+        with self._lock:
+            self._usage[(agent, scene, model, source)].add(
+                latency, prompt_tokens, completion_tokens, cost
+            )
+
+    def total(self) -> LLMUsage:
+        total = LLMUsage()
+        with self._lock:
+            for usage in self._usage.values():
+                total.calls += usage.calls
+                total.latency_s += usage.latency_s
+                total.prompt_tokens += usage.prompt_tokens
+                total.completion_tokens += usage.completion_tokens
+                total.cost += usage.cost
+                for i, count in enumerate(usage.latency_buckets):
+                    total.latency_buckets[i] += count
+        return total
+
+    def by_agent(self) -> dict[str, dict]:
+        agents: dict[str, LLMUsage] = defaultdict(LLMUsage)
+        with self._lock:
+            for (agent, _, _, _), usage in self._usage.items():
+                merged = agents[agent]
+                merged.calls += usage.calls
+                merged.latency_s += usage.latency_s
+                merged.prompt_tokens += usage.prompt_tokens
+                merged.completion_tokens += usage.completion_tokens
+                merged.cost += usage.cost
+        return {agent: usage.summary() for agent, usage in agents.items()}
+
+    def summary(self) -> dict:
+        return {**self.total().summary(), "by_agent": self.by_agent()}
+
+    def render_prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            items = sorted(self._usage.items())
+
+        lines = [
+            "# HELP llm_calls_total Replies generated for agents.",
+            "# TYPE llm_calls_total counter",
+        ]
+        for key, usage in items:
+            lines.append(f"llm_calls_total{{{_labels(key)}}} {usage.calls}")
+
+        lines += [
+            "# HELP llm_tokens_total Tokens used by replies.",
+            "# TYPE llm_tokens_total counter",
+        ]
+        for key, usage in items:
+            lines.append(f'llm_tokens_total{{{_labels(key)},kind="prompt"}} {usage.prompt_tokens}')
+            lines.append(f'llm_tokens_total{{{_labels(key)},kind="completion"}} {usage.completion_tokens}')
+
+        lines += [
+            "# HELP llm_cost_dollars_total Cost of replies as reported by the provider.",
+            "# TYPE llm_cost_dollars_total counter",
+        ]
+        for key, usage in items:
+            lines.append(f"llm_cost_dollars_total{{{_labels(key)}}} {usage.cost}")
+
+        lines += [
+            "# HELP llm_latency_seconds Time taken to produce a reply.",
+            "# TYPE llm_latency_seconds histogram",
+        ]
+        for key, usage in items:
+            labels = _labels(key)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, usage.latency_buckets):
+                cumulative += count
+                lines.append(f'llm_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'llm_latency_seconds_bucket{{{labels},le="+Inf"}} {usage.calls}')
+            lines.append(f"llm_latency_seconds_sum{{{labels}}} {usage.latency_s}")
+            lines.append(f"llm_latency_seconds_count{{{labels}}} {usage.calls}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key: UsageKey_t) -> str:
+    agent, scene, model, source = key
+    return ",".join(
+        f'{name}="{_escape(value)}"'
+        for name, value in (("agent", agent), ("scene", scene), ("model", model), ("source", source))
+    )
+
+
+# Process-wide metrics, exposed on `/metrics`
+llm_metrics = UsageMetrics()
@@ -0,0 +1,75 @@
+import logging
+import threading
+from collections import deque
+from collections.abc import Callable
+
+from server.content import ContentRegistry, GameContent
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPool:
+    """
+    Keeps a number of freshly initialized sessions ready to be handed out, so
+    that starting a game doesn't pay for building one. A background thread
+    tops the pool back up after sessions are taken.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[GameContent], object],
+        registry: ContentRegistry,
+        size: int = 8,
+    ):
+        self.factory = factory
+        self.registry = registry
+        self.size = size
+        # Entries are (content, session) so stale sessions can be dropped after a reload
+        self._ready: deque[tuple[GameContent, object]] = deque()
+        self._wanted = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is not None or self.size <= 0:
+                return
+            self._thread = threading.Thread(
+                target=self._refill_forever, name="session-pool", daemon=True
+            )
+            self._thread.start()
+        self._wanted.set()
+
+    def _build(self, content: GameContent) -> object:
+        return self.factory(content)
+
+    def _refill_forever(self) -> None:
+        while True:
+            self._wanted.wait()
+            self._wanted.clear()
+            try:
+                while len(self._ready) < self.size:
+                    content = self.registry.get()
+                    self._ready.append((content, self._build(content)))
+            except Exception as error:
+                logger.error("failed to refill the session pool. error: %s", error)
+
+    def take(self) -> object:
+        """Returns a ready session, building one inline if the pool has run dry."""
+        self.start()
+        content = self.registry.get()
+        session = None
+        while session is None:
+            try:
+                pooled_content, pooled = self._ready.popleft()
+            except IndexError:
+                logger.info("session pool empty, building a session inline")
+                session = self._build(content)
+                break
+            if pooled_content is content:
+                session = pooled
+        self._wanted.set()
+        return session
+
+    def __len__(self) -> int:
+        return len(self._ready)
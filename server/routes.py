@@ -1,69 +1,236 @@
+import asyncio
+import gzip
+import json
 import logging
+import os
+import queue
+import threading
 import uuid
+from contextvars import copy_context
 
-from flask import jsonify, request
+from flask import Response, jsonify, request
 
-from server import AI_API_LIMIT, AI_API_USAGE, app, game_states, logger
-from server.commands import marshal_command
-from server.game import Session, initialize_game, play_game
+from flask_limiter.util import get_remote_address
+
+from server import app, game_states, logger
+from server.agents.turns import default_turn_policy
+from server.budget import BudgetAccount, BudgetExceededError, token_budget
+from server.commands import Commands, command_defaults, marshal_command
+from server.content import content_registry
+from server.game import (
+    Session,
+    SessionBusyError,
+    aplay_game,
+    aplay_game_batch,
+    initialize_game,
+    play_game,
+    play_game_batch,
+)
+from server.logs import bind_log_context
+from server.metrics import llm_metrics
+from server.pool import SessionPool
+from server.wire import MSGPACK_MIMETYPE, packb
 
 logger = logging.getLogger(__name__)
 
 
+def create_llm(api_key: str | None = None):
+    # todo:: get the user's provided API key ;)
+    from server.agents.clients import llm_clients
+
+    # Shared by every game using the same key, along with its connections
+    return llm_clients.router(api_key)
+
+
+# Sessions are built ahead of time so `/start` only has to hand one out
+session_pool = SessionPool(
+    lambda content: initialize_game(llm=create_llm(), content=content),
+    registry=content_registry,
+    size=int(os.environ.get("SESSION_POOL_SIZE", 8)),
+)
+
+
+def attach_cassette(game_id: str, session: Session) -> None:
+    """Records the game to a cassette if `LLM_CASSETTE_DIR` is set."""
+    from server.agents.cassette import CASSETTE_DIR, CassetteRecorder, cassette_path
+
+    if CASSETTE_DIR is not None and session.cassette is None:
+        session.cassette = CassetteRecorder(cassette_path(CASSETTE_DIR, game_id))
+
+
+@app.before_request
+def bind_game_to_logs():
+    # Every record logged while handling a game's request says which game it was
+    bind_log_context(game_id=(request.view_args or {}).get("game_id"))
+
+
 @app.route("/start", methods=["GET"])
 def start_game():
     # Generating a unique game ID
     game_id = str(uuid.uuid4())
 
-    # Create the llm to use for this game
-    # todo:: get the user's provided API key ;)
-    from langchain.chat_models import FakeListChatModel
-
-    llm = FakeListChatModel(
-        verbose=True,
-        responses=[
-            "Hi there, I'm talking to you.",
-            "This is a response",
-            "I say something else too!",
-            "Ok, goodbye now!",
-        ],
-    )
-
     # Initializing the game state
-    game_states[game_id]: Session = initialize_game(llm=llm)
+    game_states[game_id]: Session = session_pool.take()
+    attach_cassette(game_id, game_states[game_id])
 
     logger.info("Created a new game with id %s", game_id)
     return jsonify(game_id=game_id, message="Game started!")
 
 
-@app.route("/play/<game_id>", methods=["POST"])
-def play(game_id):
-    user_input = request.json.get("input")
-    game_state = game_states.get(game_id)
+AI_LIMIT_MESSAGE = "Unfortunately we've exceeded our daily limit for AI usage. Please continue your adventure tomorrow."
+BUSY_MESSAGE = "The game is still playing the previous input"
+
+
+def get_playable_session(game_id, user_input):
+    """
+    Checks out the session to play, or returns an error response if it can't be
+    played. A session returned must be handed back with `game_states.release`.
+    """
+    game_state = game_states.checkout(game_id)
 
     if game_state is None:
         logger.warning("`/play` called with an invalid game id %s", game_id)
-        return jsonify(error="Invalid game ID"), 400
+        return None, (jsonify(error="Invalid game ID"), 400)
 
     if not game_state.is_input_valid(user_input):
         logger.warning(
             'invalid user input provided "%s" for game id %s', user_input, game_id
         )
-        return jsonify(error="Bad user input"), 400
+        game_states.release(game_id)
+        return None, (jsonify(error="Bad user input"), 400)
+
+    # Sessions restored from disk come back without their recorder
+    attach_cassette(game_id, game_state)
+    return game_state, None
+
+
+def budget_account(game_id) -> BudgetAccount:
+    """What the model calls made for this request are charged to, see `Session.play`."""
+    return BudgetAccount(
+        token_budget, {"global": "all", "ip": get_remote_address(), "game": game_id}
+    )
 
-    command = play_game(game_state, user_input)
 
-    if user_input != "" and command != "":
-        global AI_API_USAGE
-        global AI_API_LIMIT
-        AI_API_USAGE += 1
-        if AI_API_USAGE > AI_API_LIMIT:
-            logger.error("AI API usage exceeded limit %d", AI_API_LIMIT)
-            return jsonify(
-                error="Unfortunately we've exceeded our daily limit for AI usage. Please continue your adventure tomorrow."
-            ), 429
+def wants_msgpack() -> bool:
+    preferred = request.accept_mimetypes.best_match(["application/json", MSGPACK_MIMETYPE])
+    return preferred == MSGPACK_MIMETYPE
+
+
+def respond(**payload) -> Response:
+    """`payload` as JSON, or as MessagePack if the client prefers it in `Accept`."""
+    if wants_msgpack():
+        response = Response(packb(payload), mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = jsonify(**payload)
+    response.vary.add("Accept")
+    return response
+
+
+@app.route("/play/<game_id>", methods=["POST"])
+def play(game_id):
+    """
+    Plays the next command. With `"batch": true` in the body, plays on until the
+    player needs to act and returns all of the commands as `responses`.
+    """
+    user_input = request.json.get("input")
+    game_state, error = get_playable_session(game_id, user_input)
+    if error is not None:
+        return error
 
-    return jsonify(response=marshal_command(command))
+    account = budget_account(game_id)
+    try:
+        if request.json.get("batch"):
+            commands = play_game_batch(game_state, user_input, account)
+            return respond(responses=[marshal_command(c) for c in commands])
+        command = play_game(game_state, user_input, account=account)
+    except SessionBusyError:
+        return jsonify(error=BUSY_MESSAGE), 409
+    except BudgetExceededError:
+        return jsonify(error=AI_LIMIT_MESSAGE), 429
+    finally:
+        game_states.release(game_id)
+
+    return respond(response=marshal_command(command))
+
+
+async def play_async(game_id):
+    """
+    `/play` for the ASGI server in `server/asgi.py`. The model is awaited on the
+    event loop rather than holding a worker thread for the whole completion.
+    Restoring the game blocks, so it runs in a worker thread instead.
+    """
+    user_input = request.json.get("input")
+    game_state, error = await asyncio.to_thread(get_playable_session, game_id, user_input)
+    if error is not None:
+        return error
+
+    account = budget_account(game_id)
+    try:
+        if request.json.get("batch"):
+            commands = await aplay_game_batch(game_state, user_input, account)
+            return respond(responses=[marshal_command(c) for c in commands])
+        command = await aplay_game(game_state, user_input, account)
+    except SessionBusyError:
+        return jsonify(error=BUSY_MESSAGE), 409
+    except BudgetExceededError:
+        return jsonify(error=AI_LIMIT_MESSAGE), 429
+    finally:
+        # May spill other games to disk to stay under the cap
+        await asyncio.to_thread(game_states.release, game_id)
+
+    return respond(response=marshal_command(command))
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/play/<game_id>/stream", methods=["POST"])
+def play_stream(game_id):
+    """
+    Same as `/play`, but as a stream of server-sent events. Model replies are sent
+    as `token` events tagged with the speaking agent while they are generated, and
+    the stream ends with a `command` event holding what `/play` would have returned
+    (or an `error` event).
+    """
+    user_input = request.json.get("input")
+    game_state, error = get_playable_session(game_id, user_input)
+    if error is not None:
+        return error
+
+    events: queue.Queue[str | None] = queue.Queue()
+    account = budget_account(game_id)
+
+    def on_token(agent: str, token: str):
+        events.put(sse_event("token", {"agent": agent, "token": token}))
+
+    def run():
+        try:
+            command = play_game(game_state, user_input, on_token, account)
+            events.put(sse_event("command", {"response": marshal_command(command)}))
+        except SessionBusyError:
+            events.put(sse_event("error", {"error": BUSY_MESSAGE, "status": 409}))
+        except BudgetExceededError:
+            events.put(sse_event("error", {"error": AI_LIMIT_MESSAGE, "status": 429}))
+        except Exception as error:
+            logger.error("failed to stream game %s. error: %s", game_id, error)
+            events.put(sse_event("error", {"error": "Internal error", "status": 500}))
+        finally:
+            game_states.release(game_id)
+            events.put(None)
+
+    context = copy_context()
+    threading.Thread(target=context.run, args=(run,), name=f"stream-{game_id}", daemon=True).start()
+
+    def stream():
+        while (event := events.get()) is not None:
+            yield event
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/end/<game_id>", methods=["POST"])
@@ -82,12 +249,85 @@ def test():
     return jsonify({"message": "Success"})
 
 
-@app.route("/load/<game_id>", methods=["POST"])
+# Responses smaller than this aren't worth compressing
+MIN_COMPRESS_BYTES = 512
+
+# Fields left out of compact commands, per command type
+COMMAND_DEFAULTS = {
+    command_type.__name__: command_defaults(command_type) for command_type in Commands.__args__
+}
+
+
+def compressed(response: Response) -> Response:
+    """Gzips `response` if the client accepts it and it's big enough to matter."""
+    response.vary.add("Accept-Encoding")
+    if (
+        "gzip" not in request.accept_encodings
+        or response.direct_passthrough
+        or len(response.get_data()) < MIN_COMPRESS_BYTES
+    ):
+        return response
+    response.set_data(gzip.compress(response.get_data(), compresslevel=5))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+@app.route("/load/<game_id>", methods=["GET", "POST"])
 def load_game(game_id):
-    if game_id not in game_states:
+    """
+    Everything the player has been shown since the `since` cursor (0 if not given),
+    as compact commands. Clients keep the returned `cursor` and pass it back to only
+    get newer events, and may send `If-None-Match` to skip unchanged responses.
+    """
+    session: Session = game_states.get(game_id)
+    if session is None:
         return jsonify(error="Invalid game ID"), 400
-    session: Session = game_states[game_id]
-    return jsonify(response=session.logs)
+
+    body = request.get_json(silent=True) or {}
+    try:
+        since = int(request.args.get("since", body.get("since", 0)))
+    except (TypeError, ValueError):
+        return jsonify(error="Invalid cursor"), 400
+
+    # The log is append-only, so the range of events identifies the response, along
+    # with the usage, which speculative replies can change without adding events.
+    # The ETag is weak, as the gzipped and plain bodies share it.
+    usage = session.usage.summary()
+    etag = f"{game_id}-{since}-{session.logs.cursor}-{usage['calls']}-{'msgpack' if wants_msgpack() else 'json'}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.vary.update(["Accept", "Accept-Encoding"])
+        return response
+
+    response = respond(
+        response=session.logs.since(since),
+        since=since,
+        cursor=session.logs.cursor,
+        defaults=COMMAND_DEFAULTS,
+        usage=usage,
+    )
+    response.set_etag(etag, weak=True)
+    return compressed(response)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    from server.agents.clients import llm_clients
+
+    text = (
+        llm_metrics.render_prometheus()
+        + llm_clients.render_prometheus()
+        + game_states.render_prometheus()
+    )
+    turn_stats = getattr(default_turn_policy, "stats", None)
+    if turn_stats is not None:
+        text += (
+            "# HELP llm_turn_calls_avoided_total Agent replies skipped because the player addressed someone else.\n"
+            "# TYPE llm_turn_calls_avoided_total counter\n"
+            f"llm_turn_calls_avoided_total {turn_stats['calls_avoided']}\n"
+        )
+    return Response(text, mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
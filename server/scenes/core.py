@@ -1,9 +1,16 @@
+from __future__ import annotations
+
+import os
 from dataclasses import dataclass
-from typing import Generator
+from typing import TYPE_CHECKING, Generator
 from collections.abc import Callable
-from server.agents.conversation import LLM_t, Conversation, Agent, LLMData, PlayerAgent
+from server.agents.conversation import Conversation, Agent, LLMData, LLMRequest, PlayerAgent, Speculation
+from server.agents.turns import TurnPolicy
 from server.commands import *
 
+if TYPE_CHECKING:
+    from server.agents.conversation import LLM_t
+
 @dataclass(frozen=True)
 class GameData:
     llm: LLM_t
@@ -14,39 +21,50 @@ class GameData:
 
 
 UserInput_t = str | None
-SceneReturn_t = Generator[Command, UserInput_t, None]
+# Scenes yield commands for the player, and pass up the `LLMRequest`s of their
+# conversations for the session to fulfil. They may also yield a `Speculation` about
+# requests coming up, which the session answers with `None`.
+SceneReturn_t = Generator[Command | LLMRequest | Speculation, UserInput_t, None]
 Scene_t = Callable[[GameData], SceneReturn_t]
 
 
+# "prefix_stable" uses the `<prompt>_prefix_stable` variant of a prompt when there is one,
+# which keeps everything static at the start of the prompt so provider prefix caching applies
+# (see `server.content.prefix_stable_prompt`). It changes every prompt the models see, so it
+# has to be asked for.
+PROMPT_LAYOUT = os.environ.get("PROMPT_LAYOUT", "original")
+
+
+# Whether everyone in a group conversation replies to the player at once, see `Conversation`
+PARALLEL_REACTIONS = os.environ.get("PARALLEL_REACTIONS", "0") == "1"
+
+
+def prompt_for_layout(prompts: dict[str, str], prompt_name: str, layout: str = PROMPT_LAYOUT) -> str:
+    variant = f"{prompt_name}_{layout}"
+    return variant if variant in prompts else prompt_name
+
+
 def make_conversation(
             game_data: GameData, 
             order: list[Agent], 
-            prompt_name: str = "single_person_conversation_complex"
+            prompt_name: str = "single_person_conversation_complex",
+            turn_policy: TurnPolicy | None = None,
+            parallel: bool = PARALLEL_REACTIONS,
         ) -> Conversation:
+    prompt_name = prompt_for_layout(game_data.prompts, prompt_name)
     llm_data = LLMData(
         game_data.llm, 
         game_data.prompts[prompt_name], 
-        game_data.setting_data
+        game_data.setting_data,
+        prompt_name,
     )
-    return Conversation(order, llm_data)
-
-
-def have_conversation(conversation: Conversation, max_player_messages: int):
-    responses_left = max_player_messages
+    return Conversation(order, llm_data, turn_policy, parallel)
 
-    responses = conversation.begin_conversation()
 
-    while responses_left > 0:
-        # Display all the responses
-        for i, r in enumerate(responses):
-            if r.conversation_ends: responses_left = 0
-            msg = f"{r.agent}: {r.text}"
-            if i < len(responses) - 1 or responses_left == 0:
-                yield MessageDelayCommand(msg)
-            else:
-                # If this is the last response and the player has allowed messages,
-                # get input and get new responses
-                message = yield MessageCommand(msg)
-                responses = conversation.converse(message)
+def speculate_openings(game_data: GameData, actors: list[Agent]) -> Speculation:
+    """The opening line of a one on one conversation with each of `actors`."""
+    return Speculation([
+        next(make_conversation(game_data, [actor, game_data.player]).begin_conversation())
+        for actor in actors
+    ])
 
-        responses_left -= 1
\ No newline at end of file
@@ -0,0 +1,507 @@
+"""
+Scenes described as data in `server/data/scenes.yaml`, compiled into state machines
+when the game content is loaded.
+
+A compiled scene is a flat tuple of nodes. Playing it is a `SceneRun`, whose whole
+position is the index of its current node, a phase within that node and a few
+registers: the actors still to talk to and the group chosen as bitmasks, the
+selected actor as an index, and the conversation in progress. Everything that only
+depends on the content, such as fixed messages and option tables, is built once and
+shared by every game, down to the encoding of the messages in their event logs.
+
+Runs speak the generator protocol the session drives scenes with: they return
+commands for the player and pass up the model requests of their conversations.
+"""
+
+import string
+from abc import ABC, abstractmethod
+from collections.abc import Generator
+from dataclasses import dataclass, field
+
+from server.agents.agent import Agent
+from server.agents.conversation import ConversationResponse, Talk_t
+from server.commands import (
+    Command,
+    MessageCommand,
+    MessageDelayCommand,
+    SceneEndCommand,
+    SelectOptionCommand,
+    SoundDelayCommand,
+    share_command,
+)
+from server.scenes.core import GameData, make_conversation, speculate_openings
+
+DEFAULT_PROMPT = "single_person_conversation_complex"
+
+BLANK_LINE = share_command(MessageDelayCommand("", delay_ms=0))
+
+
+class SceneGraphError(ValueError):
+    pass
+
+
+class SceneRun(Generator):
+    """One game's progress through a compiled scene."""
+
+    __slots__ = (
+        "scene",
+        "game_data",
+        "state",
+        "phase",
+        "remaining",
+        "selected",
+        "group",
+        "conversation",
+        "responses",
+        "shown",
+        "turns_left",
+        "waiting",
+        "_talk",
+    )
+
+    def __init__(self, scene: "CompiledScene", game_data: GameData):
+        self.scene = scene
+        self.game_data = game_data
+        # Index of the current node, and how far into it the run is
+        self.state = 0
+        self.phase = 0
+        # Bitmasks over `game_data.actors`
+        self.remaining = (1 << len(game_data.actors)) - 1
+        self.group = 0
+        self.selected = -1
+        self.conversation = None
+        # The replies of the conversation's last turn, and how many were shown
+        self.responses: list[ConversationResponse] = []
+        self.shown = 0
+        self.turns_left = 0
+        # Whether the current node wants the player's answer to its command
+        self.waiting = False
+        # The conversation turn waiting on the model, if any. Turns never wait on the player.
+        self._talk: Talk_t | None = None
+
+    @property
+    def selected_actor(self) -> Agent:
+        return self.game_data.actors[self.selected]
+
+    def actors(self, mask: int) -> list[Agent]:
+        return [actor for i, actor in enumerate(self.game_data.actors) if mask >> i & 1]
+
+    def next_node(self, state: int | None = None) -> None:
+        self.state = self.state + 1 if state is None else state
+        self.phase = 0
+
+    def talk(self, turn: Talk_t) -> None:
+        self._talk = turn
+
+    def _talked(self, responses: list[ConversationResponse]) -> None:
+        self._talk = None
+        self.responses = responses
+        self.shown = 0
+
+    def _run(self):
+        nodes = self.scene.nodes
+        while True:
+            if self._talk is not None:
+                try:
+                    return next(self._talk)
+                except StopIteration as stop:
+                    self._talked(stop.value)
+                    continue
+            if self.state >= len(nodes):
+                raise StopIteration
+            step = nodes[self.state].step(self)
+            if step is not None:
+                return step
+
+    def send(self, value):
+        if self._talk is not None:
+            try:
+                return self._talk.send(value)
+            except StopIteration as stop:
+                self._talked(stop.value)
+        elif self.waiting:
+            self.waiting = False
+            self.scene.nodes[self.state].receive(self, value)
+        return self._run()
+
+    def throw(self, typ, val=None, tb=None):
+        raise typ if val is None else val
+
+
+class Node(ABC):
+    # A node type without `step` can't be built, so it fails when the scenes are compiled
+    __slots__ = ()
+
+    @abstractmethod
+    def step(self, run: SceneRun) -> Command | object | None:
+        """The node's next command or model request, or None once it moved the run on."""
+
+    def receive(self, run: SceneRun, value: str) -> None:
+        """Handles the player's answer to the command this node asked it for."""
+
+
+@dataclass(frozen=True, slots=True)
+class Say(Node):
+    # Prebuilt when the text has no fields, otherwise formatted per game
+    command: Command | None
+    template: str = ""
+    options: dict = field(default_factory=dict)
+
+    def step(self, run):
+        run.next_node()
+        if self.command is not None:
+            return self.command
+        return MessageDelayCommand(self.template.format(selected=run.selected_actor), **self.options)
+
+
+@dataclass(frozen=True, slots=True)
+class Sound(Node):
+    command: SoundDelayCommand
+
+    def step(self, run):
+        run.next_node()
+        return self.command
+
+
+@dataclass(frozen=True, slots=True)
+class Speculate(Node):
+    source: str
+
+    def step(self, run):
+        run.next_node()
+        mask = run.remaining if self.source == "remaining" else (1 << len(run.game_data.actors)) - 1
+        return speculate_openings(run.game_data, run.actors(mask))
+
+
+@dataclass(frozen=True, slots=True)
+class ChooseActor(Node):
+    source: str
+    remove: bool
+    message: str
+    # Option label of every actor, by index
+    labels: tuple[str, ...]
+    # Candidate mask -> (candidate indices, command), filled in as they come up
+    tables: dict = field(default_factory=dict, compare=False)
+
+    def table(self, mask: int) -> tuple[tuple[int, ...], SelectOptionCommand]:
+        table = self.tables.get(mask)
+        if table is None:
+            candidates = tuple(i for i in range(len(self.labels)) if mask >> i & 1)
+            options = [(str(n + 1), self.labels[i]) for n, i in enumerate(candidates)]
+            command = share_command(SelectOptionCommand(self.message, options=options))
+            table = self.tables[mask] = (candidates, command)
+        return table
+
+    def candidates(self, run: SceneRun) -> int:
+        return run.remaining if self.source == "remaining" else (1 << len(self.labels)) - 1
+
+    def _select(self, run: SceneRun, index: int) -> None:
+        run.selected = index
+        if self.remove:
+            run.remaining &= ~(1 << index)
+        run.next_node()
+
+    def step(self, run):
+        candidates, command = self.table(self.candidates(run))
+        if len(candidates) == 1:
+            self._select(run, candidates[0])
+            return None
+        run.waiting = True
+        return command
+
+    def receive(self, run, value):
+        candidates, _ = self.table(self.candidates(run))
+        self._select(run, candidates[int(value) - 1])
+
+
+@dataclass(frozen=True, slots=True)
+class ChooseGroup(Node):
+    command: SelectOptionCommand
+    groups: tuple[int, ...]
+
+    def step(self, run):
+        run.waiting = True
+        return self.command
+
+    def receive(self, run, value):
+        run.group = self.groups[int(value) - 1]
+        run.next_node()
+
+
+@dataclass(frozen=True, slots=True)
+class Converse(Node):
+    """
+    A conversation with the player. In a chat, every reply is shown and the player
+    answers the last one, `player_messages` times. With statements, the player
+    makes `player_messages - 1` statements to everyone, each answered by all.
+    """
+
+    # "selected", "group" or a mask of actors
+    participants: str | int
+    player_messages: int
+    statements_left: str | None
+    prompt: str
+
+    def _start(self, run: SceneRun) -> None:
+        match self.participants:
+            case "selected":
+                mask = 1 << run.selected
+            case "group":
+                mask = run.group
+            case mask:
+                pass
+        run.conversation = make_conversation(
+            run.game_data, run.actors(mask) + [run.game_data.player], self.prompt
+        )
+        run.turns_left = self.player_messages
+        run.phase = 1
+        run.talk(run.conversation.begin_conversation())
+
+    def step(self, run):
+        if run.phase == 0:
+            self._start(run)
+            return None
+        if self.statements_left is None:
+            return self._chat(run)
+        return self._statements(run)
+
+    def _chat(self, run: SceneRun):
+        while True:
+            if run.shown == 0 and run.turns_left <= 0:
+                run.next_node()
+                return None
+            if run.shown == len(run.responses):
+                run.turns_left -= 1
+                run.shown = 0
+                continue
+            response = run.responses[run.shown]
+            run.shown += 1
+            if response.conversation_ends:
+                run.turns_left = 0
+            text = f"{response.agent}: {response.text}"
+            if run.shown < len(run.responses) or run.turns_left == 0:
+                return MessageDelayCommand(text)
+            # The player answers the last reply
+            run.waiting = True
+            return MessageCommand(text)
+
+    def _statements(self, run: SceneRun):
+        while True:
+            if run.phase == 2:
+                run.phase = 1
+                run.turns_left -= 1
+                return BLANK_LINE
+            if run.shown == 0 and run.turns_left <= 0:
+                run.next_node()
+                return None
+            if run.shown < len(run.responses):
+                response = run.responses[run.shown]
+                run.shown += 1
+                return MessageDelayCommand(f"{response.agent}: {response.text}")
+            if run.turns_left > 1:
+                run.waiting = True
+                return MessageCommand(self.statements_left.format(left=run.turns_left - 1))
+            run.turns_left -= 1
+            run.shown = 0
+
+    def receive(self, run, value):
+        if self.statements_left is None:
+            run.turns_left -= 1
+        else:
+            run.phase = 2
+        run.talk(run.conversation.converse(value))
+
+
+@dataclass(frozen=True, slots=True)
+class Speak(Node):
+    message: str
+
+    def step(self, run):
+        if run.phase == 0:
+            run.phase = 1
+            run.talk(run.conversation.speak_directly(self.message, run.selected_actor))
+            return None
+        run.next_node()
+        return MessageDelayCommand(f"{run.selected_actor.name}: {run.responses[0].text}")
+
+
+@dataclass(frozen=True, slots=True)
+class Jump(Node):
+    target: int
+    # None always jumps. Otherwise "remaining", or the index of the actor that must be selected.
+    unless: str | int | None = None
+
+    def step(self, run):
+        match self.unless:
+            case None:
+                holds = False
+            case "remaining":
+                holds = run.remaining != 0
+            case actor:
+                holds = run.selected == actor
+        run.next_node(None if holds else self.target)
+        return None
+
+
+@dataclass(frozen=True, slots=True)
+class End(Node):
+    command: SceneEndCommand
+
+    def step(self, run):
+        run.next_node()
+        return self.command
+
+
+@dataclass(frozen=True)
+class CompiledScene:
+    name: str
+    nodes: tuple[Node, ...]
+
+    def __call__(self, game_data: GameData) -> SceneRun:
+        return SceneRun(self, game_data)
+
+
+SAY_OPTIONS = ("delay_ms", "character_delay_ms", "do_type_message")
+TEMPLATE_FIELDS = {"selected"}
+
+
+class _Compiler:
+    def __init__(self, scene: str, actors: list[Agent]):
+        self.scene = scene
+        self.actors = actors
+        self.names = {actor.name: i for i, actor in enumerate(actors)}
+        self.nodes: list[Node] = []
+        self.labels: dict[str, int] = {}
+        # (node index, label) of gotos, resolved once every label is known
+        self.gotos: list[tuple[int, str]] = []
+
+    def error(self, message: str) -> SceneGraphError:
+        return SceneGraphError(f"Scene {self.scene}: {message}")
+
+    def actor(self, name: str) -> int:
+        if name not in self.names:
+            raise self.error(f"unknown actor {name}")
+        return self.names[name]
+
+    def mask(self, names: list[str]) -> int:
+        mask = 0
+        for name in names:
+            mask |= 1 << self.actor(name)
+        return mask
+
+    def template(self, text: str) -> bool:
+        fields = {name.split(".")[0] for _, name, _, _ in string.Formatter().parse(text) if name is not None}
+        if fields - TEMPLATE_FIELDS:
+            raise self.error(f"unknown fields {sorted(fields - TEMPLATE_FIELDS)} in {text!r}")
+        return bool(fields)
+
+    def source(self, value: str) -> str:
+        if value not in ("remaining", "all"):
+            raise self.error(f"unknown actors {value}, expected remaining or all")
+        return value
+
+    def steps(self, steps: list[dict]) -> None:
+        for step in steps:
+            self.step(step)
+
+    def step(self, step: dict) -> None:
+        match step:
+            case {"say": str(text)}:
+                options = {key: step[key] for key in SAY_OPTIONS if key in step}
+                if self.template(text):
+                    self.nodes.append(Say(None, text, options))
+                else:
+                    self.nodes.append(Say(share_command(MessageDelayCommand(text, **options))))
+            case {"sound": str(sound), "delay_ms": int(delay)}:
+                self.nodes.append(Sound(share_command(SoundDelayCommand(sound_name=sound, delay_ms=delay))))
+            case {"speculate": str(source)}:
+                self.nodes.append(Speculate(self.source(source)))
+            case {"choose_actor": dict(choice)}:
+                option = choice.get("option", "{actor.name}")
+                self.nodes.append(
+                    ChooseActor(
+                        source=self.source(choice.get("from", "all")),
+                        remove=bool(choice.get("remove", False)),
+                        message=choice["message"],
+                        labels=tuple(option.format(actor=actor) for actor in self.actors),
+                    )
+                )
+            case {"choose_group": {"message": str(message), "options": dict(options)}}:
+                command = share_command(
+                    SelectOptionCommand(message, options=[(str(i + 1), label) for i, label in enumerate(options)])
+                )
+                groups = tuple(self.mask(names) for names in options.values())
+                self.nodes.append(ChooseGroup(command, groups))
+            case {"converse": dict(conversation)}:
+                participants = conversation.get("with", "selected")
+                if isinstance(participants, list):
+                    participants = self.mask(participants)
+                elif participants == "all":
+                    participants = self.mask(list(self.names))
+                elif participants not in ("selected", "group"):
+                    raise self.error(f"can't converse with {participants}")
+                statements = conversation.get("style", "chat") == "statements"
+                self.nodes.append(
+                    Converse(
+                        participants=participants,
+                        player_messages=int(conversation["player_messages"]),
+                        statements_left=conversation.get("statements_left", "{left} statements left.")
+                        if statements
+                        else None,
+                        prompt=conversation.get("prompt", DEFAULT_PROMPT),
+                    )
+                )
+            case {"speak": str(message)}:
+                self.nodes.append(Speak(message))
+            case {"if": condition, "then": list(then)}:
+                if condition == "remaining":
+                    unless = "remaining"
+                elif isinstance(condition, dict) and "selected" in condition:
+                    unless = self.actor(condition["selected"])
+                else:
+                    raise self.error(f"unknown condition {condition}")
+                branch = len(self.nodes)
+                self.nodes.append(None)
+                self.steps(then)
+                if "else" in step:
+                    skip = len(self.nodes)
+                    self.nodes.append(None)
+                    self.nodes[branch] = Jump(len(self.nodes), unless)
+                    self.steps(step["else"])
+                    self.nodes[skip] = Jump(len(self.nodes))
+                else:
+                    self.nodes[branch] = Jump(len(self.nodes), unless)
+            case {"label": str(label)}:
+                if label in self.labels:
+                    raise self.error(f"label {label} is defined twice")
+                self.labels[label] = len(self.nodes)
+            case {"goto": str(label)}:
+                self.gotos.append((len(self.nodes), label))
+                self.nodes.append(None)
+            case {"end": str(text)}:
+                end = SceneEndCommand(text, is_game_over=bool(step.get("game_over", False)))
+                self.nodes.append(End(share_command(end)))
+            case _:
+                raise self.error(f"unknown step {step}")
+
+    def compile(self, steps: list[dict]) -> CompiledScene:
+        self.steps(steps)
+        for index, label in self.gotos:
+            if label not in self.labels:
+                raise self.error(f"goto unknown label {label}")
+            self.nodes[index] = Jump(self.labels[label])
+        if not self.nodes or not isinstance(self.nodes[-1], End):
+            raise self.error("must finish with an end step")
+        return CompiledScene(self.scene, tuple(self.nodes))
+
+
+def compile_scenes(config: dict, characters: list[dict]) -> tuple[CompiledScene, ...]:
+    """
+    Compiles the scenes of `config` for a game with `characters`, which actors are
+    named after and referred to by position in.
+    """
+    actors = [Agent(data=data) for data in characters]
+    scenes = config.get("scenes") if isinstance(config, dict) else None
+    if not scenes:
+        raise SceneGraphError("No scenes")
+    return tuple(_Compiler(scene["name"], actors).compile(scene["steps"]) for scene in scenes)
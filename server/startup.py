@@ -0,0 +1,52 @@
+"""
+Getting a worker ready for players. `import server` only loads what serving a
+request needs; the model libraries, game scenes and content are loaded on first
+use, or ahead of time by `warm_up` before the worker accepts any traffic.
+"""
+
+import importlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Loaded on first use otherwise. Together they're most of a cold start.
+WARM_MODULES = [
+    "langchain_core.language_models.chat_models",
+    "langchain_core.prompts",
+    "langchain_community.callbacks.manager",
+    "langchain.chains",
+    "server.agents.providers",
+    "server.agents.clients",
+    "server.agents.cassette",
+]
+
+
+def warm_up(fill_pool: bool = True) -> dict[str, float]:
+    """
+    Imports everything a game needs, loads the game content and the model
+    clients, and starts filling the session pool. Returns the seconds each step
+    took.
+    """
+    from server.content import content_registry
+    from server.routes import create_llm, session_pool
+
+    timings: dict[str, float] = {}
+    started = time.perf_counter()
+    for name in WARM_MODULES:
+        step = time.perf_counter()
+        importlib.import_module(name)
+        timings[name] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    content_registry.get()
+    timings["content"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    create_llm()
+    timings["llm"] = time.perf_counter() - step
+
+    if fill_pool:
+        session_pool.start()
+    logger.info("warmed up. seconds=%f", time.perf_counter() - started)
+    return timings
@@ -0,0 +1,299 @@
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+class SessionManager:
+    """
+    Holds the active games. Recently used sessions stay in memory; sessions that
+    have been idle for `idle_ttl` seconds, or that push the number held in memory
+    past `max_in_memory`, are written to disk as compressed checkpoints and
+    rebuilt through `restore` the next time they are asked for.
+
+    The cap counts sessions, not bytes: games grow as they are played, see
+    `server.benchmarks.session_memory` for what one keeps at each scene.
+
+    Sessions being played are `checkout`ed and never spilled until they are
+    released, so a checkpoint is never taken halfway through a turn. Disk work is
+    done outside the manager's lock: a spilled game is written out after the lock
+    is released, and handed straight back if it's asked for before that finished.
+    Restoring a spilled game replays its whole history, so only the requests for
+    that game wait for it.
+
+    Supports the subset of the dict interface the routes use.
+    """
+
+    def __init__(
+        self,
+        restore: Callable[[dict], object],
+        spill_dir: str | None = None,
+        max_in_memory: int = 1000,
+        idle_ttl: float = 15 * 60,
+        disk_ttl: float = 24 * 60 * 60,
+        sweep_interval: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.restore = restore
+        self.spill_dir = spill_dir or os.path.join(
+            tempfile.gettempdir(), "rattlesnake-sessions"
+        )
+        self.max_in_memory = max_in_memory
+        self.idle_ttl = idle_ttl
+        self.disk_ttl = disk_ttl
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+
+        # game id -> (session, last used), least recently used first
+        self._hot: OrderedDict[str, tuple[object, float]] = OrderedDict()
+        # game id -> number of requests playing it; never spilled while there are any
+        self._in_use: dict[str, int] = {}
+        # game id -> the restore in progress, for other requests to wait on
+        self._loading: dict[str, Future] = {}
+        # game id -> (session, snapshot) taken out of memory and not yet on disk
+        self._spilling: dict[str, tuple[object, dict]] = {}
+        # game ids in `_spilling` that no thread has started writing yet
+        self._unwritten: list[str] = []
+        self._lock = threading.RLock()
+        self._last_sweep = clock()
+        self.stats = {"hits": 0, "misses": 0, "spills": 0, "restores": 0, "expired": 0}
+
+    def _path(self, game_id: str) -> str:
+        # Game ids come from the url, never let them pick the directory
+        safe = "".join(c for c in game_id if c.isalnum() or c == "-")
+        return os.path.join(self.spill_dir, f"{safe}.json.gz")
+
+    def _evict(self, game_id: str) -> None:
+        # Only takes the checkpoint, a copy of the game's inputs and outputs, under
+        # the lock. It's written by `_write_spills` once the lock is released.
+        session, _ = self._hot.pop(game_id)
+        snapshot = {"version": SNAPSHOT_VERSION, "checkpoint": session.checkpoint().to_dict()}
+        self._spilling[game_id] = (session, snapshot)
+        self._unwritten.append(game_id)
+
+    @contextmanager
+    def _updating(self):
+        """Holds the lock, then writes out the sessions evicted meanwhile once it's released."""
+        with self._lock:
+            yield
+        self._write_spills()
+
+    def _write_spills(self) -> None:
+        while True:
+            with self._lock:
+                while self._unwritten and self._unwritten[-1] not in self._spilling:
+                    self._unwritten.pop()
+                if not self._unwritten:
+                    return
+                game_id = self._unwritten.pop()
+                session, snapshot = self._spilling[game_id]
+            self._spill(game_id, session, snapshot)
+
+    def _spill(self, game_id: str, session, snapshot: dict) -> None:
+        tmp = None
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            data = gzip.compress(json.dumps(snapshot).encode("utf-8"))
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.spill_dir)
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            with self._lock:
+                # Unless it was used, deleted or evicted again while being written
+                if self._spilling.get(game_id, (None, None))[1] is snapshot:
+                    del self._spilling[game_id]
+                    os.replace(tmp, self._path(game_id))
+                    tmp = None
+                    self.stats["spills"] += 1
+                    logger.debug("spilled game %s to disk", game_id)
+        except BaseException:
+            # Kept in memory, first in line to be evicted again
+            with self._lock:
+                if self._spilling.get(game_id, (None, None))[1] is snapshot:
+                    del self._spilling[game_id]
+                    self._hot[game_id] = (session, self.clock())
+                    self._hot.move_to_end(game_id, last=False)
+            raise
+        finally:
+            if tmp is not None:
+                os.remove(tmp)
+
+    def _load(self, game_id: str):
+        path = self._path(game_id)
+        try:
+            with open(path, "rb") as file:
+                snapshot = json.loads(gzip.decompress(file.read()))
+        except FileNotFoundError:
+            return None
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            logger.warning("discarding snapshot of game %s with an unknown version", game_id)
+            os.remove(path)
+            return None
+
+        session = self.restore(snapshot["checkpoint"])
+        os.remove(path)
+        logger.debug("restored game %s from disk", game_id)
+        return session
+
+    def _sweep(self, now: float) -> None:
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+
+        idle = [
+            gid
+            for gid, (_, used) in self._hot.items()
+            if now - used >= self.idle_ttl and gid not in self._in_use
+        ]
+        for game_id in idle:
+            self._evict(game_id)
+
+        # Snapshots nobody came back for are eventually deleted. Only finished ones,
+        # the directory may be shared with other processes still writing theirs.
+        if os.path.isdir(self.spill_dir):
+            cutoff = time.time() - self.disk_ttl
+            for entry in os.scandir(self.spill_dir):
+                if entry.name.endswith(".json.gz") and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    self.stats["expired"] += 1
+
+        logger.info("session storage: %d in memory, stats %s", len(self._hot), self.stats)
+
+    def _enforce_cap(self) -> None:
+        # Least recently used first. The most recently used session is never
+        # spilled, it is about to be played, and neither are sessions in use.
+        over = len(self._hot) - max(self.max_in_memory, 1)
+        if over <= 0:
+            return
+        for game_id in [gid for gid in list(self._hot)[:-1] if gid not in self._in_use][:over]:
+            self._evict(game_id)
+
+    def _touch(self, game_id: str, session, now: float, pin: bool) -> None:
+        # Any write of it in progress is dropped
+        self._spilling.pop(game_id, None)
+        self._hot[game_id] = (session, now)
+        self._hot.move_to_end(game_id)
+        if pin:
+            self._in_use[game_id] = self._in_use.get(game_id, 0) + 1
+        self._enforce_cap()
+
+    def __setitem__(self, game_id: str, session) -> None:
+        with self._updating():
+            now = self.clock()
+            self._touch(game_id, session, now, pin=False)
+            self._sweep(now)
+
+    def _fetch(self, game_id: str, pin: bool):
+        while True:
+            with self._updating():
+                now = self.clock()
+                self._sweep(now)
+                if game_id in self._hot or game_id in self._spilling:
+                    self.stats["hits"] += 1
+                    session = (self._hot.get(game_id) or self._spilling[game_id])[0]
+                    self._touch(game_id, session, now, pin)
+                    return session
+                loading = self._loading.get(game_id)
+                if loading is None:
+                    self.stats["misses"] += 1
+                    loading = self._loading[game_id] = Future()
+                    break
+            # Another request is restoring this game; use what it restores
+            if loading.result() is None:
+                return None
+
+        try:
+            session = self._load(game_id)
+        except BaseException as error:
+            with self._lock:
+                del self._loading[game_id]
+            loading.set_exception(error)
+            raise
+        with self._lock:
+            del self._loading[game_id]
+            if session is not None:
+                self.stats["restores"] += 1
+                self._touch(game_id, session, self.clock(), pin)
+        loading.set_result(session)
+        self._write_spills()
+        return session
+
+    def get(self, game_id: str, default=None):
+        """The session, restored from disk if it was spilled, for reading. Use `checkout` to play it."""
+        session = self._fetch(game_id, pin=False)
+        return default if session is None else session
+
+    def checkout(self, game_id: str):
+        """
+        The session for a request that's going to play it, or None. It stays in
+        memory until the request hands it back with `release`.
+        """
+        return self._fetch(game_id, pin=True)
+
+    def release(self, game_id: str) -> None:
+        with self._updating():
+            count = self._in_use.pop(game_id, 0) - 1
+            if count > 0:
+                self._in_use[game_id] = count
+            self._enforce_cap()
+
+    @contextmanager
+    def lease(self, game_id: str):
+        """`checkout` for the length of a block."""
+        session = self.checkout(game_id)
+        try:
+            yield session
+        finally:
+            if session is not None:
+                self.release(game_id)
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            gauges = {"in_memory": len(self._hot), "in_use": len(self._in_use)}
+            counters = dict(self.stats)
+        lines = [
+            "# HELP session_storage_sessions Games held in memory, and those being played right now.",
+            "# TYPE session_storage_sessions gauge",
+        ]
+        lines += [f'session_storage_sessions{{state="{state}"}} {count}' for state, count in gauges.items()]
+        lines += [
+            "# HELP session_storage_events_total Lookups, spills to disk, restores and expired snapshots.",
+            "# TYPE session_storage_events_total counter",
+        ]
+        lines += [f'session_storage_events_total{{event="{event}"}} {count}' for event, count in counters.items()]
+        return "\n".join(lines) + "\n"
+
+    def __getitem__(self, game_id: str):
+        session = self.get(game_id)
+        if session is None:
+            raise KeyError(game_id)
+        return session
+
+    def __contains__(self, game_id: str) -> bool:
+        with self._lock:
+            return game_id in self._hot or game_id in self._spilling or os.path.exists(self._path(game_id))
+
+    def __delitem__(self, game_id: str) -> None:
+        with self._lock:
+            found = self._hot.pop(game_id, None) is not None
+            found = self._spilling.pop(game_id, None) is not None or found
+            self._in_use.pop(game_id, None)
+            path = self._path(game_id)
+            if os.path.exists(path):
+                os.remove(path)
+                found = True
+            if not found:
+                raise KeyError(game_id)
+
+    def __len__(self) -> int:
+        return len(self._hot)
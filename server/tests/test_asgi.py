@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+from server import app
+from server.asgi import application
+
+
+async def call(method: str, path: str, payload=None) -> tuple[int, dict]:
+    body = json.dumps(payload).encode() if payload is not None else b""
+    received = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        received.append(message)
+
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "method": method,
+        "path": path,
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234),
+    }
+    await application(scope, receive, send)
+    status = received[0]["status"]
+    data = b"".join(m.get("body", b"") for m in received[1:])
+    return status, json.loads(data)
+
+
+def test_play_runs_on_the_event_loop():
+    async def scenario():
+        _, started = await call("GET", "/start")
+        game_id = started["game_id"]
+
+        commands = []
+        for user_input in [None, "", "1", "", ""]:
+            status, data = await call("POST", f"/play/{game_id}", {"input": user_input})
+            assert status == 200
+            commands.append(data["response"])
+        return game_id, commands
+
+    game_id, commands = asyncio.run(scenario())
+    assert commands[-1]["type"] == "MessageCommand"
+    assert commands[-1]["message"].startswith("Marshal Flint: ")
+
+    # The game is shared with the WSGI routes
+    with app.test_client() as client:
+        assert len(client.post(f"/load/{game_id}").json["response"]) > len(commands)
+
+
+def test_invalid_game_is_rejected():
+    status, data = asyncio.run(call("POST", "/play/nonexistantgameid", {"input": "hi"}))
+    assert status == 400
+    assert data["error"] == "Invalid game ID"
@@ -0,0 +1,36 @@
+from server.benchmarks import load_test, session_memory, startup, transcript
+
+
+def test_load_test_plays_complete_games():
+    results = load_test.run(players=2, concurrency=2, max_steps=400, memory_sessions=2)
+
+    assert set(results["endpoints"]) == {"/start", "/play", "/load", "/end"}
+    assert all(stats["errors"] == 0 for stats in results["endpoints"].values())
+    assert results["endpoints"]["/start"]["requests"] == 2
+    # Every game reached the end rather than running out of steps
+    assert results["plays_per_game"] < 400
+    assert results["session_memory"]["traced_bytes_per_session"] > 0
+
+
+def test_shared_transcript_keeps_less_per_turn():
+    results = transcript.run(turns=200, agents=5)
+    assert (
+        results["transcript"]["retained_bytes_per_turn"]
+        < results["message_lists"]["retained_bytes_per_turn"]
+    )
+
+
+def test_importing_the_server_defers_model_libraries():
+    results = startup.run(runs=1)
+    assert results["modules_loaded"] > 0
+    assert startup.check(results, budget_ms=None) == []
+
+
+def test_session_memory_is_reported_at_every_scene_boundary():
+    results = session_memory.run(games=2)
+    scenes = [boundary["scene"] for boundary in results["boundaries"]]
+    assert scenes[0] == "start" and scenes[-1] == "final_confrontation_scene"
+    assert len(scenes) == 6
+    # Games keep more as they go on
+    assert results["max_bytes_per_session"] == results["boundaries"][-1]["bytes_per_session"] > 0
+    assert session_memory.check(results, budget_kb=None) == []
@@ -0,0 +1,124 @@
+import multiprocessing
+import time
+
+import pytest
+
+from server import app
+from server.agents.cache import ResponseCache
+from server.budget import Bucket, BudgetExceededError, TokenBudget
+
+
+def make_budget(path, **buckets) -> TokenBudget:
+    return TokenBudget(str(path / "budget.sqlite"), buckets)
+
+
+def test_buckets_refuse_once_spent(tmp_path):
+    budget = make_budget(tmp_path, game=Bucket(100))
+    scopes = {"game": "abc"}
+
+    assert budget.allows(scopes)
+    budget.charge(scopes, 60)
+    assert budget.allows(scopes)
+    budget.charge(scopes, 60)
+    assert not budget.allows(scopes)
+    # Other games have their own bucket
+    assert budget.allows({"game": "other"})
+
+
+def test_buckets_refill(tmp_path):
+    budget = make_budget(tmp_path, ip=Bucket(100, period=0.001))
+    budget.charge({"ip": "1.2.3.4"}, 500)
+    time.sleep(0.01)
+    # Refills at capacity per period, capped at capacity
+    assert budget.remaining({"ip": "1.2.3.4"})["ip"] == 100
+
+
+def _charge_many(path: str):
+    budget = TokenBudget(path, {"global": Bucket(1_000_000)})
+    for _ in range(50):
+        budget.charge({"global": "all"}, 1)
+
+
+def test_budget_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "budget.sqlite")
+    budget = TokenBudget(path, {"global": Bucket(1_000_000)})
+    workers = [multiprocessing.Process(target=_charge_many, args=(path,)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert budget.remaining({"global": "all"})["global"] == 1_000_000 - 200
+
+
+def test_reservations_are_all_or_nothing(tmp_path):
+    budget = make_budget(tmp_path, ip=Bucket(100), game=Bucket(50))
+    scopes = {"ip": "1.2.3.4", "game": "abc"}
+
+    budget.reserve(scopes, 40)
+    with pytest.raises(BudgetExceededError):
+        budget.reserve(scopes, 40)
+    # The refused reservation took nothing from the bucket that had room
+    assert budget.remaining(scopes) == {"ip": 60, "game": 10}
+
+    # Settling a reservation that cost less refunds the difference
+    budget.charge(scopes, -30)
+    assert budget.remaining(scopes) == {"ip": 90, "game": 40}
+
+
+def test_stale_rows_are_pruned(tmp_path):
+    budget = TokenBudget(
+        str(tmp_path / "budget.sqlite"),
+        {"ip": Bucket(100, period=0.001), "game": Bucket(100)},
+        forget_after=0.005,
+    )
+    budget.charge({"ip": "1.2.3.4", "game": "old"}, 50)
+    time.sleep(0.01)
+    budget.charge({"game": "new"}, 50)
+
+    # The IP bucket has refilled and the old game is forgotten, the new one is kept
+    assert budget.prune() == 2
+    assert budget.remaining({"game": "new"})["game"] == 50
+
+
+def play_until_refused(client, game_id, inputs):
+    for user_input in inputs:
+        response = client.post(f"/play/{game_id}", json={"input": user_input})
+        if response.status_code != 200:
+            return response
+    return response
+
+
+def test_each_model_call_is_reserved_and_refused_plays_carry_on(monkeypatch, tmp_path):
+    import server.game
+    import server.routes
+    from server import game_states
+
+    budget = make_budget(tmp_path, game=Bucket(1))
+    monkeypatch.setattr(server.routes, "token_budget", budget)
+    # Cached replies are free, make sure the model is called
+    monkeypatch.setattr(server.game, "response_cache", ResponseCache(policy="none"))
+
+    with app.test_client() as client:
+        game_id = client.get("/start").json["game_id"]
+        inputs = [None, "", "1", "", ""]
+        # The first model call doesn't fit in the game's budget, so it isn't made
+        response = play_until_refused(client, game_id, inputs)
+        assert response.status_code == 429
+        session = game_states.get(game_id)
+        assert session.tokens_spent == 0
+        assert not session.is_gameover()
+        # Checkpoints leave the refused play out, so it's played again in full
+        checkpoint = session.checkpoint()
+        assert len(checkpoint.inputs) == len(session.inputs) - 1
+
+        # With room in the budget, the next play carries on where it stopped, with the
+        # input it was refused with. A different one is dropped, and isn't shown.
+        roomy = TokenBudget(str(tmp_path / "roomy.sqlite"), {"game": Bucket(100_000)})
+        monkeypatch.setattr(server.routes, "token_budget", roomy)
+        response = client.post(f"/play/{game_id}", json={"input": "Never mind"})
+        assert response.status_code == 200
+        assert response.json["response"]["message"].startswith("Marshal Flint: ")
+        assert session.inputs == inputs[: len(session.inputs)]
+        shown = [event.get("message") for event in session.logs.since(0)]
+        assert "You: Never mind" not in shown
+        assert roomy.remaining({"game": game_id})["game"] == 100_000 - session.tokens_spent
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+from langchain.chat_models import FakeListChatModel
+
+from server.agents.cache import CachedResponse, ResponseCache
+from server.agents.conversation import LLMRequest
+from server.game import initialize_game
+from server.scenes.core import make_conversation
+
+
+def opening_request(llm) -> LLMRequest:
+    session = initialize_game(llm=llm)
+    conversation = make_conversation(session.game_data, [session.actors[0], session.player])
+    return next(conversation.begin_conversation())
+
+
+def test_openings_are_served_from_the_cache():
+    cache = ResponseCache(policy="openings")
+    llm = FakeListChatModel(responses=["Howdy.", "Something else."])
+
+    first = opening_request(llm)
+    assert first.cached(cache) is None
+    first.to_cache(cache, first.replay(first.generate()))
+
+    second = opening_request(llm)
+    assert second.cache_key == first.cache_key
+    assert second.replay(second.cached(cache)) == "Howdy."
+    # The agent still remembers what it answered, as with a model call
+    assert second.agent._memory.buffer == first.agent._memory.buffer == "Human: [Conversation begins]"
+    assert cache.stats["hits"] == 1
+
+    # A different model configuration is a different entry
+    assert opening_request(FakeListChatModel(responses=["Hi."])).cached(cache) is None
+
+
+def test_policy_controls_what_is_cached():
+    assert ResponseCache(policy="openings").is_cacheable("")
+    assert not ResponseCache(policy="openings").is_cacheable("Whistle: Howdy.")
+    assert ResponseCache(policy="all").is_cacheable("Whistle: Howdy.")
+    assert not ResponseCache(policy="none").is_cacheable("")
+
+
+def test_disk_tier_outlives_memory(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    ResponseCache(path=path).put("key", CachedResponse("Howdy.", 10, 2, 0.01))
+
+    fresh = ResponseCache(path=path)
+    assert fresh.get("key") == CachedResponse("Howdy.", 10, 2, 0.01)
+    assert fresh.stats["saved_tokens"] == 12
+
+
+def test_entries_expire(tmp_path):
+    cache = ResponseCache(ttl=0, path=str(tmp_path / "cache.sqlite"))
+    cache.put("key", CachedResponse("Howdy."))
+    assert cache.get("key") is None
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="counts open files in /proc")
+def test_disk_tier_reuses_its_connection(tmp_path):
+    cache = ResponseCache(max_entries=0, path=str(tmp_path / "cache.sqlite"))
+    open_files = len(os.listdir("/proc/self/fd"))
+    for i in range(50):
+        cache.put(f"key {i}", CachedResponse("Howdy."))
+        assert cache.get(f"key {i}") == CachedResponse("Howdy.")
+        assert cache.contains(f"key {i}")
+    # Every call used the thread's one connection rather than opening its own
+    assert len(os.listdir("/proc/self/fd")) == open_files
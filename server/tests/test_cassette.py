@@ -0,0 +1,45 @@
+import pytest
+from langchain.chat_models import FakeListChatModel
+
+import server.game
+from server.agents.cache import ResponseCache
+from server.agents.cassette import CassetteMissError, CassetteRecorder, ReplayLLM, read_cassette
+from server.game import initialize_game, replay_cassette
+from server.tests.test_game import answer
+
+
+def record_game(path, steps: int):
+    session = initialize_game(llm=FakeListChatModel(responses=["Howdy.", "Reckon so.", "[QUIT] Get out."]))
+    session.cassette = CassetteRecorder(path)
+    user_input = None
+    for _ in range(steps):
+        if session.is_gameover():
+            break
+        user_input = answer(session.play(user_input))
+    return session
+
+
+def test_replay_plays_the_recorded_game_again(monkeypatch, tmp_path):
+    # Every reply must come from the model, for it to be recorded
+    monkeypatch.setattr(server.game, "response_cache", ResponseCache(policy="none"))
+    path = str(tmp_path / "game.jsonl")
+    original = record_game(path, 120)
+
+    events = read_cassette(path)
+    calls = [event for event in events if event["kind"] == "llm"]
+    assert len(calls) == len(original.llm_outputs)
+    assert all(call["prompt"] and call["latency_s"] >= 0 for call in calls)
+
+    replayed = replay_cassette(path)
+    assert replayed.logs == original.logs
+    assert replayed.llm_outputs == original.llm_outputs
+    assert not replayed.llm._unused
+
+
+def test_unrecorded_prompts_miss():
+    calls = [{"prompt": "hello", "response": "hi", "model": "m", "latency_s": 0.01, "prompt_tokens": 3, "completion_tokens": 1}]
+    with pytest.raises(CassetteMissError):
+        ReplayLLM(calls=calls).invoke("goodbye")
+
+    lenient = ReplayLLM(calls=calls, strict=False, timings=True)
+    assert lenient.invoke("goodbye").content == "hi"
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from server.agents.clients import ClientRegistry
+
+CONFIG = {"tiers": {"quality": {"backends": [{"kind": "fake", "responses": ["Howdy."]}]}}}
+
+# A reply from the chat completions API
+COMPLETION = {
+    "id": "stand-in",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "stand-in",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "Howdy."}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5},
+}
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Answers like the chat completions API, slowly, on keep-alive connections."""
+
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        type(self).connections += 1
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(0.05)
+        body = json.dumps(COMPLETION).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in():
+    StandIn.connections = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+
+
+def test_requests_share_keep_alive_connections(stand_in):
+    pool = ClientRegistry(pool_size=1).pool(stand_in)
+    with ThreadPoolExecutor(4) as executor:
+        replies = list(executor.map(lambda _: pool.http.post(f"{stand_in}/chat/completions", json={}), range(4)))
+
+    assert all(reply.status_code == 200 for reply in replies)
+    assert StandIn.connections == 1
+    stats = pool.stats
+    assert stats["requests"] == 4 and stats["connections_opened"] == 1
+    assert stats["in_flight"] == 0
+    # Three of them queued behind the only connection
+    assert stats["max_wait_s"] >= 0.05
+
+
+def test_sync_and_async_clients_send_through_the_pool():
+    sent = []
+
+    def stand_in(request: httpx.Request) -> httpx.Response:
+        sent.append((request.url.path, json.loads(request.content)["model"]))
+        return httpx.Response(200, json=COMPLETION)
+
+    registry = ClientRegistry(transport=httpx.MockTransport(stand_in))
+    pool = registry.pool("http://stand-in/v1", "sk-test")
+    body = {"model": "stand-in", "messages": [{"role": "user", "content": "Howdy"}]}
+
+    async def send_async():
+        return await pool.async_http.post(f"{pool.base_url}/chat/completions", json=body)
+
+    replies = [pool.http.post(f"{pool.base_url}/chat/completions", json=body), asyncio.run(send_async())]
+    assert [reply.json()["choices"][0]["message"]["content"] for reply in replies] == ["Howdy.", "Howdy."]
+    assert sent == [("/v1/chat/completions", "stand-in")] * 2
+    assert registry.stats[0]["requests"] == 2
+    assert registry.pool("http://stand-in/v1", "sk-test") is pool
+
+
+def test_games_share_clients_per_config_and_key():
+    registry = ClientRegistry()
+    assert registry.router(config=CONFIG) is registry.router(config=CONFIG)
+    assert registry.router("sk-one", config=CONFIG) is not registry.router(config=CONFIG)
+    assert registry.pool("http://a", "sk-one") is registry.pool("http://a", "sk-one")
+    assert registry.pool("http://a", "sk-one") is not registry.pool("http://a", "sk-two")
+    assert "sk-one" not in registry.render_prometheus()
+
+
+def test_chat_openai_sends_through_the_shared_pool():
+    # Needs the `openai` extra
+    pytest.importorskip("openai")
+    sent = []
+
+    def stand_in(request: httpx.Request) -> httpx.Response:
+        sent.append((request.url.path, request.headers["Authorization"], json.loads(request.content)["model"]))
+        return httpx.Response(200, json=COMPLETION)
+
+    registry = ClientRegistry(transport=httpx.MockTransport(stand_in))
+    config = {
+        "tiers": {
+            "quality": {
+                "backends": [{"kind": "openai", "model_name": "stand-in", "openai_api_base": "http://stand-in/v1"}]
+            }
+        }
+    }
+    for api_key in ["sk-test", "sk-test"]:
+        assert registry.router(api_key, config=config).invoke("Howdy").content == "Howdy."
+    # Both games used the same router, which sent through the one pool for the key
+    assert sent == [("/v1/chat/completions", "Bearer sk-test", "stand-in")] * 2
+    assert len(registry.stats) == 1 and registry.stats[0]["requests"] == 2
@@ -1,6 +1,12 @@
+import gc
+import json
+import random
+
 import pytest
 
+from server import commands
 from server.commands import *
+from server.wire import WireError, packb, unpackb
 
 EXAMPLE_MESSAGE = "this is an example message"
 
@@ -29,3 +35,130 @@ def test_ensure_expected_fields():
     # (it doesn't make sense to send a message without a message)
     with pytest.raises(TypeError):
         MessageCommand()
+
+
+def random_text(rng: random.Random) -> str:
+    alphabet = "abc XYZ\n\"'é🐍\\"
+    return "".join(rng.choice(alphabet) for _ in range(rng.choice([0, 1, 5, 40, 300])))
+
+
+def random_command(rng: random.Random) -> Command:
+    common = {"is_game_over": rng.random() < 0.2}
+    message_fields = {
+        **common,
+        "do_type_message": rng.random() < 0.5,
+        "character_delay_ms": rng.choice([0, 30, 200, 70000, -1]),
+    }
+    match rng.randrange(5):
+        case 0:
+            return SoundDelayCommand(random_text(rng), rng.choice([0, 1000, 2**40]), **common)
+        case 1:
+            return MessageDelayCommand(random_text(rng), delay_ms=rng.choice([1000, 0, 6000]), **message_fields)
+        case 2:
+            options = [(str(i + 1), random_text(rng)) for i in range(rng.randrange(6))]
+            return SelectOptionCommand(random_text(rng), options=rng.choice([None, options]), **message_fields)
+        case 3:
+            return MessageCommand(random_text(rng), **message_fields)
+    return SceneEndCommand(random_text(rng), **message_fields)
+
+
+def test_every_command_type_is_registered():
+    for command_type in Commands.__args__:
+        assert command_layout(command_type).type_name == command_type.__name__
+
+
+def test_commands_are_slotted():
+    for command_type in Commands.__args__:
+        assert "__dict__" not in dir(command_type)
+    assert MessageCommand(EXAMPLE_MESSAGE).expects_user_input
+    assert SelectOptionCommand(EXAMPLE_MESSAGE).expects_user_input
+    assert not MessageDelayCommand(EXAMPLE_MESSAGE).expects_user_input
+
+
+def test_commands_round_trip():
+    rng = random.Random(15)
+    for _ in range(500):
+        command = random_command(rng)
+        assert unmarshal_command(marshal_command(command)) == command
+        assert unmarshal_command(json.loads(json.dumps(marshal_command(command)))) == command
+        assert unmarshal_command(json.loads(json.dumps(compact_command(command)))) == command
+        assert decode_command(encode_command(command)) == command
+
+
+def test_binary_encoding_is_compact():
+    command = MessageDelayCommand(EXAMPLE_MESSAGE)
+    encoded = encode_command(command)
+    assert len(encoded) < len(json.dumps(compact_command(command)))
+    assert unpackb(encoded) == [command_layout(MessageDelayCommand).tag, EXAMPLE_MESSAGE]
+
+
+def test_shared_commands_are_encoded_once():
+    shared = share_command(MessageDelayCommand(EXAMPLE_MESSAGE))
+    assert encode_command(shared) is encode_command(shared)
+    # An equal command that isn't shared gets its own encoding
+    other = MessageDelayCommand(EXAMPLE_MESSAGE)
+    assert encode_command(other) == encode_command(shared)
+    assert encode_command(other) is not encode_command(shared)
+
+    # The encoding is dropped along with the command, such as on a content reload
+    shared_id = id(shared)
+    del shared
+    gc.collect()
+    assert shared_id not in commands._shared_encodings
+
+
+def test_wire_round_trips_plain_values():
+    rng = random.Random(2)
+
+    def value(depth: int):
+        kinds = ["none", "bool", "int", "float", "str", "bytes"] + (["list", "dict"] if depth < 3 else [])
+        match rng.choice(kinds):
+            case "none":
+                return None
+            case "bool":
+                return rng.random() < 0.5
+            case "int":
+                return rng.choice([0, 1, 127, 128, 255, 256, 65536, 2**32, 2**63, 2**64 - 1, -1, -32, -33, -129, -40000, -(2**31) - 1, -(2**63)])
+            case "float":
+                return rng.uniform(-1e9, 1e9)
+            case "str":
+                return random_text(rng) * rng.choice([1, 300])
+            case "bytes":
+                return bytes(rng.randrange(256) for _ in range(rng.choice([0, 3, 300])))
+            case "list":
+                return [value(depth + 1) for _ in range(rng.choice([0, 2, 20]))]
+        return {random_text(rng): value(depth + 1) for _ in range(rng.choice([0, 2, 20]))}
+
+    for _ in range(300):
+        original = value(0)
+        assert unpackb(packb(original)) == original
+
+
+def test_malformed_wire_data_only_raises_wire_errors():
+    rng = random.Random(7)
+    valid = packb([1, "hello", {"choices": ["1", "2"], "raw": b"\x00\xff"}, 3.5, None, -40000])
+    for _ in range(5000):
+        data = bytearray(valid)
+        for _ in range(rng.randrange(1, 5)):
+            data[rng.randrange(len(data))] = rng.randrange(256)
+        data = bytes(data[: rng.randrange(1, len(data) + 1)])
+        try:
+            unpackb(data)
+        except WireError:
+            pass
+    for data in [b"", b"\xc1", b"\xa2\xff\xfe", b"\xdb\xff\xff\xff\xff", b"\x01\x02"]:
+        with pytest.raises(WireError):
+            unpackb(data)
+    with pytest.raises(WireError):
+        packb(object())
+
+
+def test_invalid_data_is_rejected():
+    with pytest.raises(CommandCodecError):
+        unmarshal_command({"type": "NotACommand"})
+    with pytest.raises(CommandCodecError):
+        unmarshal_command({"type": "MessageCommand"})
+    with pytest.raises(CommandCodecError):
+        decode_command(packb([99, "message"]))
+    with pytest.raises(CommandCodecError):
+        decode_command(b"\x92\x04")
@@ -0,0 +1,60 @@
+import os
+import shutil
+
+import pytest
+
+from server.content import ContentError, ContentRegistry, DATA_DIR
+from server.game import Session, initialize_game
+from server.pool import SessionPool
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    target = tmp_path / "data"
+    shutil.copytree(DATA_DIR, target)
+    return target
+
+
+def test_content_is_loaded_once(data_dir):
+    registry = ContentRegistry(data_dir=str(data_dir), check_interval=0)
+    assert registry.get() is registry.get()
+    assert [c["short_name"] for c in registry.get().characters] == [
+        "Flint",
+        "Billy",
+        "Clara",
+        "Whistle",
+    ]
+
+
+def test_content_reloads_when_a_file_changes(data_dir):
+    registry = ContentRegistry(data_dir=str(data_dir), check_interval=0)
+    first = registry.get()
+
+    setting = data_dir / "setting.yaml"
+    setting.write_text(setting.read_text() + "\nextra: more\n")
+    stat = os.stat(setting)
+    os.utime(setting, (stat.st_atime, stat.st_mtime + 10))
+
+    second = registry.get()
+    assert second is not first
+    assert second.version == first.version + 1
+    assert second.setting["extra"] == "more"
+
+
+def test_invalid_content_is_rejected(data_dir):
+    (data_dir / "prompts.yaml").write_text("broken: '{not_a_field}'\n")
+    with pytest.raises(ContentError):
+        ContentRegistry(data_dir=str(data_dir)).get()
+
+
+def test_pool_hands_out_distinct_sessions(data_dir):
+    registry = ContentRegistry(data_dir=str(data_dir))
+    pool = SessionPool(
+        lambda content: initialize_game(content=content), registry=registry, size=2
+    )
+    first = pool.take()
+    second = pool.take()
+    assert isinstance(first, Session)
+    assert first is not second
+    assert first.actors[0] is not second.actors[0]
+    assert first.actors[0]._raw is second.actors[0]._raw
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+from langchain.chat_models import FakeListChatModel
+
+import server.game
+from server.agents.cache import ResponseCache
+from server.agents.cassette import CassetteRecorder, read_cassette
+from server.agents.conversation import LLMData, ParallelRequests, compile_prompt
+from server.agents.turns import RoundRobin
+from server.content import content_registry
+from server.game import initialize_game
+from server.scenes.core import make_conversation, prompt_for_layout
+
+
+def test_compiled_prompts_are_shared_between_games():
+    llm = FakeListChatModel(responses=["Howdy."])
+    first, second = initialize_game(llm=llm), initialize_game(llm=llm)
+    a = make_conversation(first.game_data, [first.actors[0], first.player])
+    b = make_conversation(second.game_data, [second.actors[0], second.player])
+    assert a.conversations[0].prompt is b.conversations[0].prompt
+
+
+def test_compiled_prompt_follows_content_changes():
+    content = content_registry.get()
+    session = initialize_game(content=content)
+    agent = session.actors[0]
+    llmd = LLMData(None, "Hello {name}: {{message}}", content.setting, "test")
+    assert compile_prompt(agent, llmd).format(message="hi") == f"Hello {agent.name}: hi"
+
+    changed = LLMData(None, "Bye {name}: {{message}}", content.setting, "test")
+    assert compile_prompt(agent, changed).format(message="hi") == f"Bye {agent.name}: hi"
+
+
+def test_prefix_stable_layout_puts_history_last():
+    prompts = content_registry.get().prompts
+    name = prompt_for_layout(prompts, "single_person_conversation_complex", "prefix_stable")
+    assert name == "single_person_conversation_complex_prefix_stable"
+    prompt = prompts[name]
+    dynamic = prompt.index("{{history}}")
+    assert all(prompt.index(field) < dynamic for field in ["{clues}", "{opinions}", "{premise}"])
+    assert prompt_for_layout(prompts, "other_example", "prefix_stable") == "other_example"
+    # The variant is built from the original, so it holds the same lines
+    original = prompts["single_person_conversation_complex"]
+    assert sorted(filter(None, prompt.splitlines())) == sorted(filter(None, original.splitlines()))
+    assert prompt_for_layout(prompts, "single_person_conversation_complex", "original") == "single_person_conversation_complex"
+
+
+class SlowChatModel(FakeListChatModel):
+    def _call(self, *args, **kwargs):
+        time.sleep(self.sleep)
+        return super()._call(*args, **kwargs)
+
+
+def test_parallel_reactions_overlap_and_merge_in_order(monkeypatch):
+    monkeypatch.setattr(server.game, "response_cache", ResponseCache(policy="none"))
+    session = initialize_game(llm=SlowChatModel(responses=["Howdy."], sleep=0.2))
+    conversation = make_conversation(
+        session.game_data, session.actors + [session.player], turn_policy=RoundRobin(), parallel=True
+    )
+    names = [agent.name for agent in session.actors]
+
+    talk = conversation.converse("Where were you last night?")
+    step = next(talk)
+    assert isinstance(step, ParallelRequests)
+    started = time.perf_counter()
+    replies = session._fulfil_all(step, None)
+    # Four replies in about the time of one
+    assert time.perf_counter() - started < 0.2 * 2
+    with pytest.raises(StopIteration) as stop:
+        talk.send(replies)
+
+    assert [response.agent for response in stop.value.value] == names
+    transcript = session.actors[0]._memory.transcript
+    assert [entry.role for entry in transcript.entries] == ["Human"] * 4 + names
+    assert session.llm_outputs == replies
+
+
+def test_parallel_replies_are_recorded_and_streamed_in_order(monkeypatch, tmp_path):
+    monkeypatch.setattr(server.game, "response_cache", ResponseCache(policy="none"))
+    delays, lock = iter([0.3, 0.2, 0.1, 0.0]), threading.Lock()
+
+    class ReversedChatModel(FakeListChatModel):
+        # Calls made first take longest, so replies finish in reverse order
+        def _call(self, *args, **kwargs):
+            with lock:
+                delay = next(delays)
+            time.sleep(delay)
+            return super()._call(*args, **kwargs)
+
+    session = initialize_game(llm=ReversedChatModel(responses=["Howdy."]))
+    path = str(tmp_path / "cassette.jsonl")
+    session.cassette = CassetteRecorder(path)
+    conversation = make_conversation(
+        session.game_data, session.actors + [session.player], turn_policy=RoundRobin(), parallel=True
+    )
+    names = [agent.name for agent in session.actors]
+
+    streamed = []
+    session._fulfil_all(
+        next(conversation.converse("Where were you last night?")),
+        lambda agent, token: streamed.append((agent, token)),
+    )
+    assert streamed == [(name, "Howdy.") for name in names]
+    assert [event["agent"] for event in read_cassette(path)] == names
+    assert [key[0] for key in session.usage._usage] == names
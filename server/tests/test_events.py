@@ -0,0 +1,15 @@
+from server.commands import MessageCommand, compact_command
+from server.events import EVENT_BLOCK, EventLog
+
+
+def test_events_are_read_back_from_any_offset():
+    log = EventLog()
+    commands = [MessageCommand(f"Line number {i}.") for i in range(2 * EVENT_BLOCK + 5)]
+    assert [log.append(command) for command in commands] == list(range(len(commands)))
+
+    # Older events are compressed in blocks, the newest are kept as they are
+    assert len(log.blocks) == 2 and len(log.events) == 5
+    assert log.cursor == len(log) == len(commands)
+    for offset in [-1, 0, 1, EVENT_BLOCK, EVENT_BLOCK + 3, len(commands) - 1, len(commands), len(commands) + 7]:
+        expected = [compact_command(command) for command in commands[max(offset, 0) :]]
+        assert log.since(offset) == expected
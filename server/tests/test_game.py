@@ -0,0 +1,78 @@
+import json
+import threading
+
+import pytest
+from langchain.chat_models import FakeListChatModel
+
+from server.commands import marshal_command
+from server.game import Checkpoint, SessionBusyError, initialize_game, restore_game
+
+
+def make_llm():
+    return FakeListChatModel(responses=["Howdy.", "Reckon so.", "[QUIT] Get out."])
+
+
+def answer(command) -> str | None:
+    match command.__class__.__name__:
+        case "SelectOptionCommand":
+            return command.choices[-1]
+        case "MessageCommand":
+            return "Where were you last night?"
+        case "SceneEndCommand":
+            return None
+    return ""
+
+
+def play_steps(session, steps: int, user_input=None):
+    for _ in range(steps):
+        command = session.play(user_input)
+        user_input = answer(command)
+    return command, user_input
+
+
+def test_restore_replays_without_calling_the_model():
+    session = initialize_game(llm=make_llm())
+    _, next_input = play_steps(session, 40)
+
+    # Checkpoints must survive a trip through JSON
+    checkpoint = Checkpoint.from_dict(json.loads(json.dumps(session.checkpoint().to_dict())))
+    assert checkpoint.outputs
+
+    llm = make_llm()
+    restored = restore_game(checkpoint, llm=llm)
+    # The fake model only moves through its responses when it is called
+    assert llm.i == 0
+    assert restored.logs == session.logs
+    assert restored.scene_index == session.scene_index
+
+    # Both sessions carry on identically
+    llm.i = session.llm.i
+    for agent, original in zip(restored.actors, session.actors):
+        assert agent._memory.buffer == original._memory.buffer
+    original_next, _ = play_steps(session, 1, next_input)
+    restored_next, _ = play_steps(restored, 1, next_input)
+    assert marshal_command(original_next) == marshal_command(restored_next)
+
+
+def test_a_game_is_played_by_one_request_at_a_time():
+    entered, finish = threading.Event(), threading.Event()
+
+    class SlowModel(FakeListChatModel):
+        def _call(self, *args, **kwargs) -> str:
+            entered.set()
+            finish.wait(5)
+            return super()._call(*args, **kwargs)
+
+    session = initialize_game(llm=SlowModel(responses=["Howdy.", "Reckon so."]))
+    player = threading.Thread(target=play_steps, args=(session, 10))
+    player.start()
+    assert entered.wait(5)
+
+    # The first play is waiting on the model, so a second one must not drive the scene
+    with pytest.raises(SessionBusyError):
+        session.play("Who's asking?")
+
+    finish.set()
+    player.join(5)
+    assert "Who's asking?" not in session.inputs
+    assert not session.is_gameover()
@@ -0,0 +1,40 @@
+import atexit
+import json
+import logging
+import queue
+
+from server.logs import DroppingQueueHandler, log_context, setup_logging
+
+
+def test_records_are_written_as_json_with_their_context(tmp_path):
+    path = tmp_path / "server.log"
+    logger = logging.getLogger("test_logs.context")
+    logger.propagate = False
+    listener = setup_logging(str(path), console_level=logging.CRITICAL, debug_sample_rate=2, logger=logger)
+    try:
+        with log_context(game_id="abc", scene="first_day_scene"):
+            with log_context(agent="Whistle"):
+                logger.info("invoked llm. prompt tokens=%d", 12)
+            logger.warning("no agent here")
+        for i in range(4):
+            logger.debug("debug %d", i)
+    finally:
+        listener.stop()
+        atexit.unregister(listener.stop)
+        logger.handlers.clear()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert lines[0]["message"] == "invoked llm. prompt tokens=12"
+    assert (lines[0]["game_id"], lines[0]["scene"], lines[0]["agent"]) == ("abc", "first_day_scene", "Whistle")
+    assert "agent" not in lines[1] and lines[1]["scene"] == "first_day_scene"
+    # Half of the debug records are kept
+    assert [line["message"] for line in lines[2:]] == ["debug 0", "debug 2"]
+
+
+def test_a_full_queue_drops_records_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "hello %s", ("there",), None)
+    for _ in range(3):
+        handler.handle(record)
+    assert handler.dropped == 2
+    assert handler.queue.get_nowait().msg == "hello there"
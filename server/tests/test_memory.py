@@ -0,0 +1,53 @@
+from server.agents.memory import Transcript, estimate_tokens, summarize_line
+
+LINE = " ".join(["Dealt another hand."] * 5)
+
+
+def test_history_stays_within_budget():
+    transcript = Transcript()
+    memory = transcript.view("Whistle", token_budget=200)
+    for i in range(100):
+        transcript.append("Whistle", f"Line number {i}. {LINE}", memory.audience)
+
+    history = memory.buffer
+    assert estimate_tokens(history) < 200 * 1.2
+    # The latest message is kept word for word
+    assert history.endswith(f"Whistle: Line number 99. {LINE}")
+    assert "Summary of earlier conversation:\nWhistle: Line number" in history
+
+
+def test_a_zero_budget_keeps_the_whole_history():
+    transcript = Transcript()
+    memory = transcript.view("Whistle", token_budget=0)
+    for i in range(100):
+        transcript.append("Whistle", f"Line number {i}. {LINE}", memory.audience)
+
+    assert memory.start == 0
+    assert memory.buffer.startswith(f"Whistle: Line number 0. {LINE}")
+    assert len(list(memory.messages())) == 100
+
+
+def test_short_history_is_untouched():
+    transcript = Transcript()
+    memory = transcript.view("Whistle")
+    transcript.append("Miss Clara", "Welcome, stranger.", frozenset(["Whistle", "Miss Clara"]))
+    assert memory.buffer == "Miss Clara: Welcome, stranger."
+
+
+def test_views_only_see_their_own_entries():
+    transcript = Transcript()
+    whistle, clara = transcript.view("Whistle"), transcript.view("Miss Clara")
+    both = frozenset(["Whistle", "Miss Clara"])
+    transcript.append("Human", "[Conversation begins]", whistle.audience)
+    transcript.append("Whistle", "Evening.", both)
+    transcript.append("Human", "Evening.", clara.audience)
+    transcript.append("Miss Clara", "Welcome.", both)
+
+    assert whistle.buffer == "Human: [Conversation begins]\nWhistle: Evening.\nMiss Clara: Welcome."
+    assert clara.buffer == "Whistle: Evening.\nHuman: Evening.\nMiss Clara: Welcome."
+    # Everything is stored once
+    assert len(transcript.entries) == 4
+
+
+def test_summarize_line_keeps_the_first_sentence():
+    assert summarize_line("Billy: I was with her. All night long!") == "Billy: I was with her."
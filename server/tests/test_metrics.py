@@ -0,0 +1,36 @@
+from server import app
+from server.metrics import UsageMetrics
+
+
+def test_usage_is_broken_down_and_rendered():
+    metrics = UsageMetrics()
+    metrics.observe("Whistle", "first_day_scene", "gpt-4o", "model", 0.3, 100, 20, 0.01)
+    metrics.observe("Whistle", "first_day_scene", "gpt-4o", "model", 7.0, 120, 30, 0.02)
+    metrics.observe("Miss Clara", "first_day_scene", "gpt-4o", "cache", 0.001)
+
+    summary = metrics.summary()
+    assert summary["calls"] == 3
+    assert summary["prompt_tokens"] == 220
+    assert summary["by_agent"]["Whistle"]["completion_tokens"] == 50
+
+    text = metrics.render_prometheus()
+    labels = 'agent="Whistle",scene="first_day_scene",model="gpt-4o",source="model"'
+    assert f"llm_calls_total{{{labels}}} 2" in text
+    assert f'llm_latency_seconds_bucket{{{labels},le="0.5"}} 1' in text
+    assert f'llm_latency_seconds_bucket{{{labels},le="10.0"}} 2' in text
+    assert f'llm_tokens_total{{{labels},kind="prompt"}} 220' in text
+
+
+def test_metrics_route_and_game_summary():
+    with app.test_client() as client:
+        game_id = client.get("/start").json["game_id"]
+        for user_input in [None, "", "1", "", ""]:
+            client.post(f"/play/{game_id}", json={"input": user_input})
+
+        usage = client.post(f"/load/{game_id}").json["usage"]
+        assert usage["calls"] == 1
+        assert list(usage["by_agent"]) == ["Marshal Flint"]
+
+        response = client.get("/metrics")
+        assert response.mimetype == "text/plain"
+        assert 'agent="Marshal Flint",scene="first_day_scene"' in response.get_data(as_text=True)
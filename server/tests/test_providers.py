@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import pytest
+
+from server.agents.providers import (
+    LatencyLLM,
+    LLMTimeoutError,
+    ModelRouter,
+    PooledLLM,
+    build_router,
+    load_providers,
+)
+from server.content import content_registry
+from server.scenes.core import make_conversation
+from server.game import initialize_game
+
+
+def fake(text: str, latency: float = 0.0, failures: int = 0) -> LatencyLLM:
+    return LatencyLLM(responses=[text], latency=latency, failures=failures, model_name=text)
+
+
+def test_slow_backend_times_out_and_retries_on_the_next():
+    llm = PooledLLM(backends=[fake("slow", latency=1.0), fake("fast")], timeout=0.1, backoff=0)
+    started = time.perf_counter()
+    assert llm.invoke("Howdy").content == "fast"
+    assert time.perf_counter() - started < 0.5
+    assert llm.stats["timeouts"] == 1 and llm.stats["retries"] == 1
+
+
+def test_raises_a_timeout_when_every_attempt_is_too_slow():
+    llm = PooledLLM(backends=[fake("slow", latency=1.0)], timeout=0.05, retries=1, backoff=0)
+    with pytest.raises(LLMTimeoutError) as raised:
+        llm.invoke("Howdy")
+    # The second attempt was still running when given up on
+    assert raised.value.abandoned == 1
+    assert llm.stats["timeouts"] == 2
+
+
+def test_gives_up_after_the_last_retry():
+    llm = PooledLLM(backends=[fake("broken", failures=10)], retries=2, backoff=0)
+    with pytest.raises(Exception, match="failed call 2"):
+        llm.invoke("Howdy")
+    assert llm.stats["errors"] == 3
+
+
+def test_slow_calls_are_hedged():
+    llm = PooledLLM(
+        backends=[fake("fast", latency=0.01), fake("slow", latency=1.0)],
+        hedge_percentile=0.9,
+        hedge_min_samples=1,
+        hedge_min_delay=0.01,
+    )
+    started = time.perf_counter()
+    # The second call starts on the slow backend, and is duplicated on the fast one
+    assert [llm.invoke("Howdy").content for _ in range(2)] == ["fast", "fast"]
+    assert time.perf_counter() - started < 0.5
+    assert llm.stats["hedged"] == 1 and llm.stats["hedges_won"] == 1
+
+
+def test_calls_left_running_are_charged_with_the_reply():
+    llm = PooledLLM(backends=[fake("slow", latency=1.0), fake("fast")], timeout=0.05, backoff=0)
+    usage = llm.invoke("Howdy").usage_metadata
+    alone = fake("fast").invoke("Howdy").usage_metadata
+    # The timed out call is still billed for, so it's reported with the one used
+    assert usage["total_tokens"] == 2 * alone["total_tokens"]
+
+
+def test_fake_replies_only_depend_on_the_prompt():
+    llm = LatencyLLM(responses=["One.", "Two.", "Three."])
+    first = [llm.invoke(prompt).content for prompt in ("a", "b", "c", "d")]
+    # Other games' calls in between don't change what each prompt gets
+    llm.invoke("other game")
+    assert [llm.invoke(prompt).content for prompt in ("a", "b", "c", "d")] == first
+    assert len(set(first)) > 1
+
+
+def test_async_calls_time_out_and_retry():
+    llm = PooledLLM(backends=[fake("slow", latency=1.0), fake("fast")], timeout=0.1, backoff=0)
+    assert asyncio.run(llm.ainvoke("Howdy")).content == "fast"
+
+
+def test_replies_are_streamed_through_the_router():
+    router = build_router(
+        {"tiers": {"quality": {"backends": [{"kind": "fake", "responses": ["Evening, stranger. Sit a spell."]}]}}}
+    )
+    session = initialize_game(llm=router, content=content_registry.get())
+    conversation = make_conversation(session.game_data, [session.actors[0], session.player])
+    request = next(conversation.begin_conversation())
+
+    tokens = []
+    text = request.generate_stream(lambda agent, token: tokens.append(token))
+    assert text == "Evening, stranger. Sit a spell."
+    assert tokens == ["Evening, ", "stranger. ", "Sit ", "a ", "spell."]
+    # Usage comes with the last chunk, so the call is still charged for
+    assert request.prompt_tokens > 0 and request.completion_tokens > 0
+
+
+def test_streams_retry_until_the_first_chunk():
+    llm = PooledLLM(
+        backends=[fake("slow", latency=1.0), LatencyLLM(responses=["Quick on the draw."])],
+        timeout=0.1,
+        backoff=0,
+    )
+    started = time.perf_counter()
+    assert [chunk.content for chunk in llm.stream("Howdy")] == ["Quick ", "on ", "the ", "draw."]
+    assert time.perf_counter() - started < 0.5
+    assert llm.stats["timeouts"] == 1 and llm.stats["retries"] == 1
+
+
+def test_async_streams_are_hedged():
+    llm = PooledLLM(
+        backends=[LatencyLLM(responses=["Fast as lightning."], latency=0.01), fake("slow", latency=1.0)],
+        hedge_percentile=0.9,
+        hedge_min_samples=1,
+        hedge_min_delay=0.01,
+    )
+
+    async def stream() -> list[str]:
+        return [chunk.content async for chunk in llm.astream("Howdy")]
+
+    # The second call starts on the slow backend, and is duplicated on the fast one
+    assert [asyncio.run(stream()) for _ in range(2)] == [["Fast ", "as ", "lightning."]] * 2
+    assert llm.stats["hedged"] == 1 and llm.stats["hedges_won"] == 1
+
+
+def test_prompts_are_routed_to_their_tier():
+    router = build_router(
+        {
+            "default_tier": "quality",
+            "routes": {"single_person_conversation_complex": "fast"},
+            "tiers": {
+                "quality": {"backends": [{"kind": "fake", "responses": ["Good."]}]},
+                "fast": {"backends": [{"kind": "fake", "responses": ["Quick."]}]},
+            },
+        }
+    )
+    assert router.tier_for("single_person_conversation_complex_prefix_stable") == "fast"
+    assert router.tier_for("other_example") == "quality"
+
+    session = initialize_game(llm=router, content=content_registry.get())
+    conversation = make_conversation(session.game_data, [session.actors[0], session.player])
+    assert conversation.conversations[0].llm is router.tiers["fast"]
+
+
+def test_shipped_config_loads():
+    assert isinstance(load_providers(), ModelRouter)
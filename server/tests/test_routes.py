@@ -1,4 +1,8 @@
-from server import app
+import json
+
+from server import app, game_states
+from server.commands import MessageDelayCommand, unmarshal_command
+from server.wire import unpackb
 
 
 def test_play_with_no_game_returns_400():
@@ -9,3 +13,100 @@ def test_play_with_no_game_returns_400():
         response = client.post("/play/nonexistantgameid", json={"input": "dummy input"})
 
         assert response.status_code == 400
+
+
+def read_events(response) -> list[tuple[str, dict]]:
+    events = []
+    for block in response.get_data(as_text=True).split("\n\n"):
+        if not block:
+            continue
+        event, data = block.split("\n")
+        events.append((event[len("event: ") :], json.loads(data[len("data: ") :])))
+    return events
+
+
+def test_play_stream_sends_tokens_then_the_command():
+    with app.test_client() as client:
+        game_id = client.get("/start").json["game_id"]
+
+        # Walk into the first conversation: intro, choice, two intro messages, then the agent talks
+        for user_input in [None, "", "1", "", ""]:
+            response = client.post(f"/play/{game_id}/stream", json={"input": user_input})
+            assert response.mimetype == "text/event-stream"
+            events = read_events(response)
+
+        tokens = [data for event, data in events if event == "token"]
+        final_event, final = events[-1]
+        assert final_event == "command"
+        assert tokens
+        assert all(token["agent"] == "Marshal Flint" for token in tokens)
+        text = "".join(token["token"] for token in tokens)
+        assert final["response"]["message"] == f"Marshal Flint: {text}"
+
+
+def test_batched_play_returns_everything_up_to_the_next_input():
+    with app.test_client() as client:
+        game_id = client.get("/start").json["game_id"]
+
+        response = client.post(f"/play/{game_id}", json={"input": None, "batch": True})
+        types = [command["type"] for command in response.json["responses"]]
+        assert types == ["MessageDelayCommand", "SelectOptionCommand"]
+
+        # Choosing somebody plays through both introductions and their first reply
+        response = client.post(f"/play/{game_id}", json={"input": "1", "batch": True})
+        commands = response.json["responses"]
+        assert [command["type"] for command in commands] == [
+            "MessageDelayCommand",
+            "MessageDelayCommand",
+            "MessageCommand",
+        ]
+        assert commands[1]["delay_ms"] == 3200
+        assert commands[-1]["message"].startswith("Marshal Flint: ")
+
+
+def test_load_returns_events_since_the_cursor():
+    with app.test_client() as client:
+        game_id = client.get("/start").json["game_id"]
+        for user_input in [None, "", "1"]:
+            client.post(f"/play/{game_id}", json={"input": user_input})
+
+        everything = client.get(f"/load/{game_id}").json
+        assert everything["cursor"] == len(everything["response"])
+        # Default fields are left out, and listed once per command type instead
+        intro = everything["response"][1]
+        assert intro["type"] == "MessageDelayCommand"
+        assert "delay_ms" not in intro
+        assert everything["defaults"]["MessageDelayCommand"]["delay_ms"] == 1000
+
+        client.post(f"/play/{game_id}", json={"input": ""})
+        newer = client.post(f"/load/{game_id}", json={"since": everything["cursor"]})
+        assert newer.json["response"] == client.get(f"/load/{game_id}").json["response"][everything["cursor"] :]
+
+        # Nothing new since the last response
+        unchanged = client.get(f"/load/{game_id}?since=2", headers={"If-None-Match": newer.headers["ETag"]})
+        assert unchanged.status_code == 200
+        again = client.get(f"/load/{game_id}?since={newer.json['since']}", headers={"If-None-Match": newer.headers["ETag"]})
+        assert again.status_code == 304
+        assert set(again.vary) == {"Accept", "Accept-Encoding"}
+
+        compressed = client.get(f"/load/{game_id}", headers={"Accept-Encoding": "gzip"})
+        assert compressed.headers["Content-Encoding"] == "gzip"
+        # Either body is only a weak match for the other
+        assert compressed.headers["ETag"].startswith("W/")
+        assert set(compressed.vary) == {"Accept", "Accept-Encoding"}
+
+        # A reply that adds no events still changes the usage, and so the ETag
+        session = game_states.get(game_id)
+        session.usage.observe("Whistle", "test", "model", "model", 0.1, 10, 5)
+        assert client.get(f"/load/{game_id}").headers["ETag"] != compressed.headers["ETag"]
+
+
+def test_play_answers_in_msgpack_when_asked():
+    with app.test_client() as client:
+        game_id = client.get("/start").json["game_id"]
+        response = client.post(
+            f"/play/{game_id}", json={"input": None}, headers={"Accept": "application/msgpack"}
+        )
+        assert response.mimetype == "application/msgpack"
+        command = unmarshal_command(unpackb(response.get_data())["response"])
+        assert isinstance(command, MessageDelayCommand)
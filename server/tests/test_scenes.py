@@ -0,0 +1,98 @@
+from dataclasses import dataclass
+
+import pytest
+from langchain_community.chat_models import FakeListChatModel
+
+from server.agents.agent import Agent, PlayerAgent
+from server.commands import MessageCommand, MessageDelayCommand, SceneEndCommand, SelectOptionCommand
+from server.content import content_registry
+from server.game import initialize_game
+from server.scenes import graph
+from server.scenes.core import GameData
+from server.scenes.graph import SceneGraphError, compile_scenes
+
+CHARACTERS = [{"name": "Whistle", "subtitle": "Saloon owner"}, {"name": "Miss Clara", "subtitle": "Seamstress"}]
+
+
+def test_the_game_scenes_compile_in_order():
+    content = content_registry.get()
+    assert [scene.name for scene in content.scenes] == [
+        "first_day_scene",
+        "first_night_scene",
+        "second_day_morning_scene",
+        "second_day_afternoon_scene",
+        "final_confrontation_scene",
+    ]
+
+
+@pytest.mark.parametrize(
+    "steps, error",
+    [
+        ([{"goto": "nowhere"}, {"end": "."}], "unknown label nowhere"),
+        ([{"converse": {"with": ["Jeb"], "player_messages": 1}}, {"end": "."}], "unknown actor Jeb"),
+        ([{"say": "Hi {player.name}"}, {"end": "."}], "unknown fields"),
+        ([{"dance": True}, {"end": "."}], "unknown step"),
+        ([{"say": "Hi"}], "must finish with an end step"),
+    ],
+)
+def test_bad_scenes_are_rejected(steps, error):
+    with pytest.raises(SceneGraphError, match=error):
+        compile_scenes({"scenes": [{"name": "broken", "steps": steps}]}, CHARACTERS)
+
+
+def test_nodes_without_a_step_fail_to_compile(monkeypatch):
+    @dataclass(frozen=True, slots=True)
+    class Mumble(graph.Node):
+        message: str
+
+    monkeypatch.setattr(graph, "Speak", Mumble)
+    with pytest.raises(TypeError, match="abstract method"):
+        compile_scenes({"scenes": [{"name": "broken", "steps": [{"speak": "Hi"}, {"end": "."}]}]}, CHARACTERS)
+
+
+def test_a_run_is_a_position_in_the_compiled_scene():
+    session = initialize_game(llm=FakeListChatModel(responses=["Howdy."]))
+    run = session.current_scene
+    assert isinstance(session.play(None), MessageDelayCommand)
+    assert isinstance(session.play(""), SelectOptionCommand)
+    assert isinstance(run.state, int) and run.remaining == 0b1111
+
+    # Picking an actor removes them from the actors still to talk to
+    session.play("2")
+    assert run.remaining == 0b1101 and run.selected_actor.name == session.actors[1].name
+    while not isinstance(session.last_scene_output, MessageCommand):
+        session.play("")
+    assert run.conversation is not None and run.turns_left == 6
+
+
+def test_branches_follow_the_selected_actor():
+    scene = compile_scenes(
+        {
+            "scenes": [
+                {
+                    "name": "choice",
+                    "steps": [
+                        {"choose_actor": {"message": "Pick.", "option": "{actor.name} -- {actor.short_description}"}},
+                        {"if": {"selected": "Whistle"}, "then": [{"say": "It was {selected.name}"}], "else": [{"say": "Wrong"}]},
+                        {"end": "The end"},
+                    ],
+                }
+            ]
+        },
+        CHARACTERS,
+    )[0]
+    game_data = GameData(
+        llm=None,
+        actors=[Agent(data=data) for data in CHARACTERS],
+        player=PlayerAgent(),
+        prompts={},
+        setting_data={},
+    )
+    for choice, said in (("1", "It was Whistle"), ("2", "Wrong")):
+        run = scene(game_data)
+        assert next(run).options == [("1", "Whistle -- Saloon owner"), ("2", "Miss Clara -- Seamstress")]
+        assert run.send(choice).message == said
+        assert isinstance(run.send(""), SceneEndCommand)
+        with pytest.raises(StopIteration):
+            run.send(None)
+
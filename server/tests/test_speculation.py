@@ -0,0 +1,77 @@
+from langchain.chat_models import FakeListChatModel
+
+import server.game
+from server.agents.cache import ResponseCache
+from server.agents.speculation import Speculator
+from server.budget import Bucket, BudgetAccount, TokenBudget
+from server.commands import SelectOptionCommand
+from server.game import initialize_game
+
+
+def play_to_choice(session, account=None):
+    command = session.play(None, account=account)
+    while not isinstance(command, SelectOptionCommand):
+        command = session.play("", account=account)
+    return command
+
+
+def test_opening_is_handed_off_and_the_rest_discarded(monkeypatch):
+    monkeypatch.setattr(server.game, "response_cache", ResponseCache(policy="none"))
+    # A single response, so the order the workers run in doesn't matter
+    session = initialize_game(llm=FakeListChatModel(responses=["Howdy."]))
+    speculator = session.speculator = Speculator(workers=2)
+
+    command = play_to_choice(session)
+    assert len(session._speculative) == len(command.choices)
+
+    # Read through the introduction up to the opening line
+    session.play(command.choices[1])
+    while not session.usage.summary()["calls"]:
+        session.play("")
+
+    usage = session.usage._usage
+    assert [key[3] for key in usage] == ["speculative"]
+    assert session._speculative == {}
+    assert speculator.stats["used"] == 1
+    assert speculator.stats["started"] == len(command.choices)
+    assert speculator.stats["wasted"] + speculator.stats["used"] <= len(command.choices)
+    assert session.tokens_spent > 0
+
+
+def test_waste_cap_stops_speculation():
+    speculator = Speculator(workers=1, max_wasted_tokens=10)
+    session = initialize_game(llm=FakeListChatModel(responses=["Howdy."]))
+    session.speculator = speculator
+
+    play_to_choice(session)
+    for _, future, _ in session._speculative.values():
+        future.result()
+    session._discard_speculation()
+    assert speculator.stats["wasted_tokens"] > 10
+
+    # Another choice comes up, but nothing more is spent on guessing
+    session.play("1")
+    while not isinstance(session.last_scene_output, SelectOptionCommand):
+        session.play("Hi" if session.last_scene_output.expects_user_input else "")
+    assert session._speculative == {}
+    assert speculator.stats["skipped"] > 0
+
+
+def test_wasted_guesses_are_charged_to_the_budget(monkeypatch, tmp_path):
+    monkeypatch.setattr(server.game, "response_cache", ResponseCache(policy="none"))
+    budget = TokenBudget(str(tmp_path / "budget.sqlite"), {"game": Bucket(100_000)})
+    account = BudgetAccount(budget, {"game": "abc"})
+    session = initialize_game(llm=FakeListChatModel(responses=["Howdy."]))
+    session.speculator = Speculator(workers=2)
+
+    play_to_choice(session, account)
+    guesses = [future for _, future, _ in session._speculative.values()]
+    assert guesses
+    # Guesses are reserved for up front, and settled once known to be wasted, long
+    # after the play that started them
+    assert budget.remaining({"game": "abc"})["game"] < 100_000 - session.tokens_spent
+    for future in guesses:
+        future.result()
+    session._discard_speculation()
+    assert budget.remaining({"game": "abc"})["game"] == 100_000 - session.tokens_spent
+    assert session.tokens_spent > 0
@@ -0,0 +1,9 @@
+import sys
+
+from server.startup import WARM_MODULES, warm_up
+
+
+def test_warm_up_loads_everything_a_game_needs():
+    timings = warm_up(fill_pool=False)
+    assert all(name in sys.modules for name in WARM_MODULES)
+    assert {"content", "llm"} <= set(timings)
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+
+from langchain.chat_models import FakeListChatModel
+
+from server import storage
+from server.game import Checkpoint, initialize_game, restore_game
+from server.storage import SessionManager
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_manager(tmp_path, **kwargs) -> SessionManager:
+    return SessionManager(
+        restore=lambda data: restore_game(Checkpoint.from_dict(data), llm=make_llm()),
+        spill_dir=str(tmp_path),
+        **kwargs,
+    )
+
+
+def make_llm():
+    return FakeListChatModel(responses=["Howdy."])
+
+
+def started_game():
+    session = initialize_game(llm=make_llm())
+    session.play(None)
+    session.play("")
+    return session
+
+
+def test_sessions_over_the_cap_are_spilled_and_restored(tmp_path):
+    manager = make_manager(tmp_path, max_in_memory=1)
+    first, second = started_game(), started_game()
+    manager["first"] = first
+    manager["second"] = second
+
+    assert len(manager) == 1
+    assert manager.stats["spills"] == 1
+    assert "first" in manager
+
+    restored = manager.get("first")
+    assert restored is not first
+    assert restored.logs == first.logs
+    assert manager.stats["misses"] == 1
+    assert manager.stats["restores"] == 1
+
+    manager.get("first")
+    assert manager.stats["hits"] == 1
+
+
+def test_idle_sessions_are_spilled(tmp_path):
+    clock = Clock()
+    manager = make_manager(tmp_path, idle_ttl=60, sweep_interval=0, clock=clock)
+    manager["game"] = started_game()
+
+    clock.now = 61
+    assert manager.get("missing") is None
+    assert len(manager) == 0
+    assert manager.stats["spills"] == 1
+    assert manager.get("game") is not None
+
+
+def test_deleting_removes_spilled_sessions(tmp_path):
+    manager = make_manager(tmp_path, max_in_memory=1)
+    manager["game"] = started_game()
+    manager["other"] = started_game()
+    del manager["game"]
+    assert "game" not in manager
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_sessions_being_played_are_not_spilled(tmp_path):
+    clock = Clock()
+    manager = make_manager(tmp_path, max_in_memory=1, idle_ttl=60, sweep_interval=0, clock=clock)
+    manager["first"] = started_game()
+    playing = manager.checkout("first")
+
+    manager["second"] = started_game()
+    clock.now = 61
+    manager.get("second")
+    # Over the cap and idle, but still the same session
+    assert manager.get("first") is playing
+    assert not (tmp_path / "first.json.gz").exists()
+
+    # Handed back, it's spilled like any other
+    manager.release("first")
+    manager.get("second")
+    assert (tmp_path / "first.json.gz").exists()
+    assert 'session_storage_sessions{state="in_use"} 0' in manager.render_prometheus()
+
+
+def test_restores_run_outside_the_lock(tmp_path):
+    restoring, finish = threading.Event(), threading.Event()
+
+    def slow_restore(data):
+        restoring.set()
+        finish.wait(5)
+        return restore_game(Checkpoint.from_dict(data), llm=make_llm())
+
+    manager = SessionManager(restore=slow_restore, spill_dir=str(tmp_path), max_in_memory=1)
+    manager["spilled"] = started_game()
+    manager["hot"] = started_game()
+
+    results = []
+    readers = [threading.Thread(target=lambda: results.append(manager.get("spilled"))) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    assert restoring.wait(5)
+    # Other games are served while one is being restored
+    assert manager.get("hot") is not None
+    finish.set()
+    for reader in readers:
+        reader.join(5)
+
+    # Both requests got the one restored session
+    assert len(results) == 2 and results[0] is results[1] is not None
+    assert manager.stats["restores"] == 1
+
+
+def test_spills_are_written_outside_the_lock(tmp_path, monkeypatch):
+    writing, finish = threading.Event(), threading.Event()
+    compress = storage.gzip.compress
+
+    def slow_compress(data):
+        # Only the first write is slow
+        if not writing.is_set():
+            writing.set()
+            finish.wait(5)
+        return compress(data)
+
+    manager = make_manager(tmp_path, max_in_memory=1)
+    first = started_game()
+    manager["first"] = first
+    monkeypatch.setattr(storage.gzip, "compress", slow_compress)
+    evicting = threading.Thread(target=manager.__setitem__, args=("second", started_game()))
+    evicting.start()
+    assert writing.wait(5)
+
+    # Other games are served while one is being written, and the one being
+    # written is handed back as it is, dropping the write. That spills `second`.
+    assert manager.get("second") is not None
+    assert manager.get("first") is first
+    assert manager.stats["spills"] == 1
+    finish.set()
+    evicting.join(5)
+    assert manager.stats["spills"] == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["second.json.gz"]
+
+
+def test_expiry_only_deletes_finished_snapshots(tmp_path):
+    clock = Clock()
+    manager = make_manager(tmp_path, sweep_interval=0, disk_ttl=60, clock=clock)
+    (tmp_path / "old.json.gz").write_bytes(b"")
+    # Another process's snapshot, still being written
+    (tmp_path / "tmp1234.tmp").write_bytes(b"")
+    past = time.time() - 120
+    for path in tmp_path.iterdir():
+        os.utime(path, (past, past))
+
+    clock.now = 1
+    manager.get("missing")
+    assert [path.name for path in tmp_path.iterdir()] == ["tmp1234.tmp"]
+    assert manager.stats["expired"] == 1
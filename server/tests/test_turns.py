@@ -0,0 +1,47 @@
+from langchain.chat_models import FakeListChatModel
+
+from server.agents.turns import Addressed, RoundRobin
+from server.game import initialize_game
+from server.scenes.core import make_conversation
+
+
+def speakers_of(conversation, message: str) -> list[str]:
+    """Names of the agents that reply to `message`, in order."""
+    names = []
+    talk = conversation.converse(message)
+    try:
+        request = next(talk)
+        while True:
+            names.append(request.agent.name)
+            request = talk.send("Howdy.")
+    except StopIteration:
+        return names
+
+
+def group_conversation(policy):
+    session = initialize_game(llm=FakeListChatModel(responses=["Howdy."]))
+    return make_conversation(session.game_data, session.actors + [session.player], turn_policy=policy)
+
+
+def test_only_addressed_agents_reply():
+    policy = Addressed()
+    conversation = group_conversation(policy)
+    everyone = [agent.name for agent in conversation.agents[:-1]]
+
+    assert speakers_of(conversation, "Where were you last night?") == everyone
+    assert speakers_of(conversation, "whistle, what did you see?") == ["Whistle"]
+    assert speakers_of(conversation, "Clara says Snake Eyes was there. Is that so, Billy?") == [
+        "Miss Clara",
+        'Billy "Snake Eyes" Thompson',
+    ]
+    assert policy.stats == {"rounds": 3, "addressed_rounds": 2, "calls_avoided": 5}
+
+
+def test_replies_can_be_capped():
+    conversation = group_conversation(Addressed(max_replies=1))
+    assert speakers_of(conversation, "Marshal Flint and Whistle, explain yourselves.") == ["Marshal Flint"]
+
+
+def test_round_robin_lets_everyone_reply():
+    conversation = group_conversation(RoundRobin())
+    assert len(speakers_of(conversation, "Whistle, what did you see?")) == 4
@@ -0,0 +1,32 @@
+"""
+MessagePack encoding for commands and API responses, using msgspec's codec.
+Covers the types commands and responses are made of: None, bools, ints, floats,
+strings, bytes, lists, tuples and dicts. Tuples come back as lists, as they
+would from JSON.
+"""
+
+import msgspec
+
+MSGPACK_MIMETYPE = "application/msgpack"
+
+
+class WireError(ValueError):
+    pass
+
+
+_encoder = msgspec.msgpack.Encoder()
+_decoder = msgspec.msgpack.Decoder()
+
+
+def packb(value) -> bytes:
+    try:
+        return _encoder.encode(value)
+    except (TypeError, OverflowError) as error:
+        raise WireError(f"Can't encode value: {error}") from error
+
+
+def unpackb(data: bytes):
+    try:
+        return _decoder.decode(data)
+    except (msgspec.DecodeError, UnicodeDecodeError) as error:
+        raise WireError(f"Invalid MessagePack data: {error}") from error